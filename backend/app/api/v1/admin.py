@@ -1,54 +1,146 @@
 from __future__ import annotations
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...db import get_db
-from ...models import Generation, ModerationReview, User
-from ...schemas import ModerationReviewCreate, ModerationReviewOut, GenerationOut
+from ...config import get_settings
+from ...core.auth_cache import UserSnapshot
+from ...core.lifecycle import REVIEW_STATUSES, review_stmts
+from ...core.pagination import after_cursor, page
+from ...db import get_async_db
+from ...models import Generation, ModerationReview
+from ...schemas import (
+    GenerationPage,
+    ModerationBulkReviewCreate,
+    ModerationBulkReviewOut,
+    ModerationReviewCreate,
+    ModerationReviewOut,
+)
 from ...security import get_current_admin
+from ...workers.routing import enqueue
+from ...workers.tasks import task_moderate
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
 
-@router.get("/queue", response_model=List[GenerationOut])
-def get_queue(_: User = Depends(get_current_admin), db: Session = Depends(get_db)):
-    gens = db.query(Generation).filter(Generation.status.in_(["queued", "flagged"]))\
-        .order_by(Generation.created_at.asc()).limit(100).all()
-    return gens
+REVIEW_ACTIONS = tuple(REVIEW_STATUSES)
+
+
+@router.get("/queue", response_model=GenerationPage)
+async def get_queue(
+    status: List[str] = Query(["queued", "flagged"]),
+    gen_type: Optional[str] = Query(None, alias="type"),
+    user_id: Optional[int] = None,
+    nsfw_tag: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    _: UserSnapshot = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Oldest first; served by ix_generations_status_created_at_id
+    stmt = select(Generation).where(Generation.status.in_(status))
+    if gen_type:
+        stmt = stmt.where(Generation.type == gen_type)
+    if user_id is not None:
+        stmt = stmt.where(Generation.user_id == user_id)
+    if nsfw_tag:
+        # nsfw_tags is comma-separated; match whole tags only
+        stmt = stmt.where((literal(",") + Generation.nsfw_tags + literal(",")).contains(f",{nsfw_tag},", autoescape=True))
+    keyset = after_cursor(Generation.created_at, Generation.id, cursor)
+    if keyset is not None:
+        stmt = stmt.where(keyset)
+    stmt = stmt.order_by(Generation.created_at.asc(), Generation.id.asc()).limit(limit + 1)
+    items, next_cursor = page((await db.scalars(stmt)).all(), limit)
+    return GenerationPage(items=items, next_cursor=next_cursor)
+
+
+async def _apply_review(db: AsyncSession, gen_ids: List[int], action: str, tags: Optional[str]) -> List[int]:
+    """Ids the verdict applied to; see ``lifecycle.review_stmts`` for which rows it skips."""
+    values = {"nsfw_tags": tags} if tags else {}
+    reviewed = []
+    for stmt in review_stmts(gen_ids, action, **values):
+        reviewed += await db.scalars(stmt.returning(Generation.id))
+    return reviewed
+
+
+@router.post("/review/bulk", response_model=ModerationBulkReviewOut)
+async def review_generations_bulk(
+    payload: ModerationBulkReviewCreate,
+    admin: UserSnapshot = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db),
+):
+    settings = get_settings()
+    if payload.action not in REVIEW_ACTIONS:
+        raise HTTPException(status_code=400, detail="action must be 'allow', 'flag' or 'block'")
+    requested = list(dict.fromkeys(payload.generation_ids))
+    if len(requested) > settings.ADMIN_BULK_REVIEW_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {settings.ADMIN_BULK_REVIEW_MAX} generations per request")
+
+    found = set(await db.scalars(select(Generation.id).where(Generation.id.in_(requested))))
+    ids = [gen_id for gen_id in requested if gen_id in found]
+    reviewed = set()
+    if ids:
+        # Two UPDATEs for all rows and one INSERT for the reviews, committed together
+        reviewed = set(await _apply_review(db, ids, payload.action, payload.tags))
+        if reviewed:
+            await db.execute(
+                insert(ModerationReview),
+                [
+                    dict(generation_id=gen_id, reviewer_id=admin.id, action=payload.action,
+                         tags=payload.tags, notes=payload.notes)
+                    for gen_id in ids if gen_id in reviewed
+                ],
+            )
+        await db.commit()
+    return ModerationBulkReviewOut(
+        reviewed=len(reviewed),
+        missing=[gen_id for gen_id in requested if gen_id not in found],
+        skipped=[gen_id for gen_id in ids if gen_id not in reviewed],
+    )
 
 
 @router.post("/review/{generation_id}", response_model=ModerationReviewOut)
-def review_generation(
+async def review_generation(
     generation_id: int,
     payload: ModerationReviewCreate,
-    admin: User = Depends(get_current_admin),
-    db: Session = Depends(get_db),
+    admin: UserSnapshot = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    gen = db.query(Generation).filter(Generation.id == generation_id).first()
-    if not gen:
+    if payload.action not in REVIEW_ACTIONS:
+        raise HTTPException(status_code=400, detail="action must be 'allow', 'flag' or 'block'")
+    status = await db.scalar(select(Generation.status).where(Generation.id == generation_id))
+    if status is None:
         raise HTTPException(status_code=404, detail="Generation not found")
+    if not await _apply_review(db, [generation_id], payload.action, payload.tags):
+        await db.rollback()
+        detail = "Generation is still running" if status == "running" else f"Cannot {payload.action} a {status} generation"
+        raise HTTPException(status_code=409, detail=detail)
 
     review = ModerationReview(
-        generation_id=gen.id,
+        generation_id=generation_id,
         reviewer_id=admin.id,
         action=payload.action,
         tags=payload.tags,
         notes=payload.notes,
     )
-    gen.nsfw_action = payload.action
-    if payload.tags:
-        gen.nsfw_tags = payload.tags
-    if payload.action == "block":
-        gen.status = "blocked"
-    elif payload.action == "flag":
-        gen.status = "flagged"
-    elif payload.action == "allow":
-        gen.status = "completed" if gen.output_path else gen.status
-
     db.add(review)
-    db.add(gen)
-    db.commit()
-    db.refresh(review)
+    await db.commit()
+    await db.refresh(review)
     return review
+
+
+@router.post("/remoderate/{generation_id}", status_code=202)
+async def remoderate_generation(
+    generation_id: int,
+    admin: UserSnapshot = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db),
+):
+    gen_id = await db.scalar(select(Generation.id).where(Generation.id == generation_id))
+    if not gen_id:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    # Broker publish is blocking I/O
+    await run_in_threadpool(enqueue, task_moderate, generation_id, admin)
+    return {"generation_id": generation_id, "status": "queued"}
@@ -1,37 +1,48 @@
 from __future__ import annotations
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...db import get_db
+from ...core.auth_cache import UserSnapshot
+from ...core.passwords import password_hasher
+from ...db import get_async_db
 from ...models import User
 from ...schemas import UserCreate, UserOut, Token
-from ...security import get_password_hash, verify_password, create_access_token, get_current_user
+from ...security import create_access_token, get_current_user
 
 router = APIRouter(prefix="/api/v1/auth", tags=["auth"])
 
 
 @router.post("/register", response_model=UserOut)
-def register(user_in: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_in.email).first()
+async def register(user_in: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing = await db.scalar(select(User.id).where(User.email == user_in.email))
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = User(email=user_in.email, password_hash=get_password_hash(user_in.password), is_admin=False)
+    password_hash = await password_hasher.hash(user_in.password)
+    user = User(email=user_in.email, password_hash=password_hash, is_admin=False)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.email == form_data.username))
+    if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
+    ok, new_hash = await password_hasher.verify_and_update(form_data.password, user.password_hash)
+    if not ok:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was stored
+        user.password_hash = new_hash
+        await db.commit()
     access_token = create_access_token(subject=user.id)
     return Token(access_token=access_token)
 
 
 @router.get("/me", response_model=UserOut)
-def me(current_user: User = Depends(get_current_user)):
+async def me(current_user: UserSnapshot = Depends(get_current_user)):
     return current_user
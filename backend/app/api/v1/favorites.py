@@ -0,0 +1,50 @@
+from __future__ import annotations
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...core.auth_cache import UserSnapshot
+from ...core.pagination import after_cursor, page
+from ...db import get_async_db
+from ...models import Favorite, Generation
+from ...schemas import FavoriteGenerationOut, FavoritePage, GenerationOut
+from ...security import get_current_user
+from .generations import GENERATION_OUT_COLUMNS
+
+router = APIRouter(prefix="/api/v1/favorites", tags=["favorites"])
+
+
+@router.get("", response_model=FavoritePage)
+async def list_favorites(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # One JOIN for the whole page instead of a lazy Favorite.generation load per row
+    stmt = (
+        select(
+            Favorite.id.label("favorite_id"),
+            Favorite.created_at.label("favorited_at"),
+            *GENERATION_OUT_COLUMNS,
+        )
+        .join(Generation, Generation.id == Favorite.generation_id)
+        .where(Favorite.user_id == user.id)
+    )
+    keyset = after_cursor(Favorite.created_at, Favorite.id, cursor, descending=True)
+    if keyset is not None:
+        stmt = stmt.where(keyset)
+    stmt = stmt.order_by(Favorite.created_at.desc(), Favorite.id.desc()).limit(limit + 1)
+    rows, next_cursor = page((await db.execute(stmt)).all(), limit, key=lambda row: (row.favorited_at, row.favorite_id))
+    items = [
+        FavoriteGenerationOut(
+            id=row.favorite_id,
+            generation_id=row.id,
+            created_at=row.favorited_at,
+            generation=GenerationOut.from_orm(row),
+        )
+        for row in rows
+    ]
+    return FavoritePage(items=items, next_cursor=next_cursor)
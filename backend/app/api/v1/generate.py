@@ -1,26 +1,52 @@
 from __future__ import annotations
-from typing import Optional
+from collections import Counter
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
-from sqlalchemy.orm import Session
+from celery import group
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...db import get_db
-from ...models import User, Generation
-from ...schemas import GenerationCreate, GenerationOut
+from ...config import get_settings
+from ...core.admission import admission
+from ...core.auth_cache import UserSnapshot
+from ...core.lifecycle import transition_stmt
+from ...core.events import sse_stream
+from ...db import get_async_db
+from ...models import Generation, SourceUpload
+from ...schemas import GenerationCreate, GenerationOut, GenerationBatchCreate, GenerationBatchOut
 from ...security import get_current_user
+from ...workers.routing import enqueue, signature_for
 from ...workers.tasks import task_txt2img, task_img2img, task_upscale, task_txt2video, task_img2video
 
 router = APIRouter(prefix="/api/v1/generate", tags=["generate"])
 
 
+async def _source_paths(jobs: List[GenerationCreate], db: AsyncSession, user: UserSnapshot) -> List[Optional[str]]:
+    """Each job's source locator from its uploaded ``source_id`` (one query for all jobs), or None."""
+    ids = {job.source_id for job in jobs if job.source_id is not None}
+    locators: Dict[int, str] = {}
+    if ids:
+        rows = await db.execute(
+            select(SourceUpload.id, SourceUpload.locator).where(SourceUpload.id.in_(ids), SourceUpload.user_id == user.id)
+        )
+        locators = dict(rows.all())
+        if len(locators) != len(ids):
+            raise HTTPException(status_code=404, detail="Source not found")
+    return [locators[job.source_id] if job.source_id is not None else None for job in jobs]
+
+
 @router.post("/image", response_model=GenerationOut)
-def generate_image(
+async def generate_image(
     payload: GenerationCreate,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: UserSnapshot = Depends(get_current_user),
 ):
     if payload.type not in ("image", "upscale"):
         raise HTTPException(status_code=400, detail="type must be 'image' or 'upscale'")
+    (source_path,) = await _source_paths([payload], db, user)
 
     gen = Generation(
         user_id=user.id,
@@ -33,26 +59,27 @@ def generate_image(
         width=payload.width,
         height=payload.height,
         style=payload.style,
+        source_path=source_path if payload.type == "upscale" else None,
         status="queued",
     )
-    db.add(gen)
-    db.commit()
-    db.refresh(gen)
+    async with admission.reserve(user, {payload.type: 1}, db):
+        db.add(gen)
+        await db.commit()
+    await db.refresh(gen)
 
-    if payload.type == "image":
-        task_txt2img.delay(gen.id)
-    else:
-        task_upscale.delay(gen.id)
+    task = task_txt2img if payload.type == "image" else task_upscale
+    await _publish(db, user, [gen.id], enqueue, task, gen.id, user)
 
     return gen
 
 
 @router.post("/image-from", response_model=GenerationOut)
-def generate_image_from(
+async def generate_image_from(
     payload: GenerationCreate,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: UserSnapshot = Depends(get_current_user),
 ):
+    (source_path,) = await _source_paths([payload], db, user)
     gen = Generation(
         user_id=user.id,
         type="image",
@@ -64,23 +91,25 @@ def generate_image_from(
         width=payload.width,
         height=payload.height,
         style=payload.style,
-        source_path=payload.source_path,
+        source_path=source_path,
         status="queued",
     )
-    db.add(gen)
-    db.commit()
-    db.refresh(gen)
+    async with admission.reserve(user, {"image": 1}, db):
+        db.add(gen)
+        await db.commit()
+    await db.refresh(gen)
 
-    task_img2img.delay(gen.id)
+    await _publish(db, user, [gen.id], enqueue, task_img2img, gen.id, user)
     return gen
 
 
 @router.post("/video", response_model=GenerationOut)
-def generate_video(
+async def generate_video(
     payload: GenerationCreate,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: UserSnapshot = Depends(get_current_user),
 ):
+    (source_path,) = await _source_paths([payload], db, user)
     gen = Generation(
         user_id=user.id,
         type="video",
@@ -92,16 +121,106 @@ def generate_video(
         width=payload.width,
         height=payload.height,
         style=payload.style,
-        source_path=payload.source_path,
+        source_path=source_path,
         status="queued",
     )
-    db.add(gen)
-    db.commit()
-    db.refresh(gen)
+    async with admission.reserve(user, {"video": 1}, db):
+        db.add(gen)
+        await db.commit()
+    await db.refresh(gen)
 
-    if payload.source_path:
-        task_img2video.delay(gen.id)
-    else:
-        task_txt2video.delay(gen.id)
+    task = task_img2video if source_path else task_txt2video
+    await _publish(db, user, [gen.id], enqueue, task, gen.id, user)
 
     return gen
+
+
+async def _publish(db: AsyncSession, user: UserSnapshot, ids: List[int], send, *args) -> None:
+    """Hand committed rows to the broker. Broker publishes block on the network,
+    so they run off the event loop; if one fails, rows no worker claimed are
+    failed and their admission slots handed back rather than left for the reaper.
+    """
+    try:
+        await run_in_threadpool(send, *args)
+    except Exception:
+        result = await db.execute(transition_stmt(ids, ["queued"], "failed", error="could not be queued"))
+        await db.commit()
+        if not user.is_admin:
+            await run_in_threadpool(admission.release, [user.id] * result.rowcount)
+        raise
+
+
+def _task_for(payload: GenerationCreate):
+    if payload.type == "image":
+        return task_img2img if payload.source_id is not None else task_txt2img
+    if payload.type == "upscale":
+        return task_upscale
+    if payload.type == "video":
+        return task_img2video if payload.source_id is not None else task_txt2video
+    return None
+
+
+@router.post("/batch", response_model=GenerationBatchOut)
+async def generate_batch(
+    payload: GenerationBatchCreate,
+    db: AsyncSession = Depends(get_async_db),
+    user: UserSnapshot = Depends(get_current_user),
+):
+    settings = get_settings()
+    if len(payload.jobs) > settings.GENERATE_BATCH_MAX_JOBS:
+        raise HTTPException(status_code=400, detail=f"at most {settings.GENERATE_BATCH_MAX_JOBS} jobs per batch")
+    tasks = [_task_for(job) for job in payload.jobs]
+    if None in tasks:
+        raise HTTPException(status_code=400, detail="type must be 'image', 'upscale' or 'video'")
+    source_paths = await _source_paths(payload.jobs, db, user)
+    rows = [
+        dict(
+            user_id=user.id,
+            type=job.type,
+            mode=job.mode,
+            prompt=job.prompt,
+            negative_prompt=job.negative_prompt,
+            seed=job.seed,
+            steps=job.steps,
+            width=job.width,
+            height=job.height,
+            style=job.style,
+            source_path=source_path,
+            status="queued",
+        )
+        for job, source_path in zip(payload.jobs, source_paths)
+    ]
+    # One multi-row INSERT ... RETURNING (ids in job order) and one commit for the whole batch.
+    # SQLite cannot guarantee RETURNING order, so SQLAlchemy falls back to per-row inserts there.
+    # All or nothing: a batch is admitted whole or rejected with 429
+    async with admission.reserve(user, dict(Counter(job.type for job in payload.jobs)), db):
+        ids = list(await db.scalars(insert(Generation).returning(Generation.id, sort_by_parameter_order=True), rows))
+        await db.commit()
+
+    batch = group(signature_for(task, gen_id, user, bulk=True) for task, gen_id in zip(tasks, ids))
+    await _publish(db, user, ids, batch.apply_async)
+    return GenerationBatchOut(ids=ids)
+
+
+@router.get("/{generation_id}/events")
+async def generation_events(
+    generation_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user: UserSnapshot = Depends(get_current_user),
+):
+    # One DB read up front; afterwards progress is pushed from Redis pub/sub
+    result = await db.execute(
+        select(Generation.user_id, Generation.status, Generation.error).where(Generation.id == generation_id)
+    )
+    row = result.first()
+    if not row or (row.user_id != user.id and not user.is_admin):
+        raise HTTPException(status_code=404, detail="Generation not found")
+    # Hand the pooled connection back before the long-lived stream starts
+    await db.close()
+
+    snapshot = {"type": "status", "generation_id": generation_id, "status": row.status, "error": row.error}
+    return StreamingResponse(
+        sse_stream(generation_id, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
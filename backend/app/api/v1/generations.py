@@ -0,0 +1,60 @@
+from __future__ import annotations
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...core.auth_cache import UserSnapshot
+from ...core.pagination import after_cursor, page
+from ...db import get_async_db
+from ...models import Generation
+from ...schemas import GenerationPage
+from ...security import get_current_user
+
+router = APIRouter(prefix="/api/v1/generations", tags=["generations"])
+
+# The columns GenerationOut serialises (keep in step with it); rows are never loaded as ORM objects
+GENERATION_OUT_COLUMNS = [
+    Generation.id,
+    Generation.type,
+    Generation.mode,
+    Generation.prompt,
+    Generation.negative_prompt,
+    Generation.seed,
+    Generation.steps,
+    Generation.width,
+    Generation.height,
+    Generation.style,
+    Generation.source_path,
+    Generation.output_path,
+    Generation.status,
+    Generation.error,
+    Generation.nsfw_tags,
+    Generation.nsfw_action,
+    Generation.created_at,
+    Generation.updated_at,
+]
+
+
+@router.get("", response_model=GenerationPage)
+async def list_generations(
+    gen_type: Optional[str] = Query(None, alias="type"),
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Newest first; a range scan of ix_generations_user_created_at_id
+    stmt = select(*GENERATION_OUT_COLUMNS).where(Generation.user_id == user.id)
+    if gen_type:
+        stmt = stmt.where(Generation.type == gen_type)
+    if status:
+        stmt = stmt.where(Generation.status == status)
+    keyset = after_cursor(Generation.created_at, Generation.id, cursor, descending=True)
+    if keyset is not None:
+        stmt = stmt.where(keyset)
+    stmt = stmt.order_by(Generation.created_at.desc(), Generation.id.desc()).limit(limit + 1)
+    items, next_cursor = page((await db.execute(stmt)).all(), limit)
+    return GenerationPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import mimetypes
+import os
+from typing import Iterator, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from PIL import UnidentifiedImageError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...config import get_settings
+from ...core.auth_cache import UserSnapshot
+from ...core.derivatives import MEDIA_TYPES, ensure_derivative, supported_formats
+from ...core.storage import get_storage, locator_digest
+from ...db import get_async_db
+from ...models import Generation
+from ...security import get_current_user
+
+router = APIRouter(prefix="/api/v1/media", tags=["media"])
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _read_range(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Single ``bytes=`` range as (start, end) inclusive; None means serve the whole file."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # multipart ranges: a full 200 is a valid answer
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def _serve_file(request: Request, path: str, media_type: str, etag: str, vary: bool = False) -> Response:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={get_settings().MEDIA_CACHE_MAX_AGE}",
+        "Accept-Ranges": "bytes",
+    }
+    if vary:
+        headers["Vary"] = "Accept"
+    if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(path)
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(range_header, size)
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_read_range(path, 0, size), media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_read_range(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
+
+
+def _negotiate(request: Request, requested: Optional[str]) -> str:
+    formats = supported_formats()
+    if not formats:
+        raise HTTPException(status_code=404, detail="No derivative formats available")
+    if requested:
+        if requested not in formats:
+            raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(formats)}")
+        return requested
+    accept = request.headers.get("accept", "")
+    for fmt in formats:
+        if MEDIA_TYPES[fmt] in accept:
+            return fmt
+    return formats[-1]
+
+
+@router.get("/{generation_id}/{variant}")
+async def get_media(
+    generation_id: int,
+    variant: str,
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format"),
+    user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """``variant`` is ``original`` or a configured derivative size (``thumb``, ``preview``)."""
+    row = (await db.execute(
+        select(Generation.user_id, Generation.type, Generation.status, Generation.output_path)
+        .where(Generation.id == generation_id)
+    )).first()
+    await db.close()
+    if not row or (not user.is_admin and (row.user_id != user.id or row.status == "blocked")):
+        raise HTTPException(status_code=404, detail="Generation not found")
+    if not row.output_path:
+        raise HTTPException(status_code=404, detail="Output not available")
+
+    try:
+        if variant == "original":
+            path = await run_in_threadpool(get_storage().local_path, row.output_path)
+            digest = await run_in_threadpool(locator_digest, row.output_path)
+            media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            return _serve_file(request, path, media_type, f'"{digest}"')
+
+        if row.type == "video":
+            raise HTTPException(status_code=415, detail="Video outputs only have an original")
+        fmt = _negotiate(request, fmt)
+        # Rendered here on first request for rows produced before derivatives existed
+        path = await run_in_threadpool(ensure_derivative, row.output_path, variant, fmt)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Output not available")
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="Output is not an image")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown variant")
+    name = os.path.basename(path)
+    return _serve_file(request, path, MEDIA_TYPES[fmt], f'"{name}"', vary=True)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import hashlib
+import io
+import os
+import uuid
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...config import get_settings
+from ...core.auth_cache import UserSnapshot
+from ...core.storage import get_storage, scratch_path
+from ...db import get_async_db
+from ...models import SourceUpload
+from ...schemas import SourceUploadOut
+from ...security import get_current_user
+
+router = APIRouter(prefix="/api/v1/sources", tags=["sources"])
+
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+def _allowed_formats():
+    return {f.strip().upper() for f in get_settings().UPLOAD_FORMATS.split(",") if f.strip()}
+
+
+def _probe(head: bytes, complete: bool) -> Optional[Tuple[str, int, int]]:
+    """(format, width, height) from the first bytes; None when more bytes are needed.
+
+    ``Image.open`` only parses the header, so nothing is decoded here.
+    """
+    try:
+        with Image.open(io.BytesIO(head)) as im:
+            fmt, (width, height) = im.format, im.size
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    except Exception:
+        if not complete:
+            return None
+        raise HTTPException(status_code=415, detail="Not a readable image")
+    if fmt not in _allowed_formats() or fmt not in EXTENSIONS:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format {fmt}")
+    if width * height > get_settings().UPLOAD_MAX_PIXELS:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    return fmt, width, height
+
+
+def _discard(f, path: str) -> None:
+    f.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@router.post("", response_model=SourceUploadOut, status_code=201)
+async def upload_source(
+    request: Request,
+    user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Upload a source image as the raw request body (``Content-Type: image/*``).
+
+    The body is written to scratch storage chunk by chunk as it arrives, so
+    memory use does not grow with the upload. Format and dimensions are read
+    from the header bytes and the upload is refused before the rest is stored.
+    """
+    settings = get_settings()
+    max_bytes = settings.UPLOAD_MAX_MB * 1024 * 1024
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {settings.UPLOAD_MAX_MB} MB")
+    if request.headers.get("content-type", "").split(";")[0].strip() == "multipart/form-data":
+        raise HTTPException(status_code=415, detail="Send the image as the request body, not as a form")
+
+    head = bytearray()
+    probed = None
+    digest = hashlib.sha256()
+    size = 0
+    scratch = None
+    f = None
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {settings.UPLOAD_MAX_MB} MB")
+            digest.update(chunk)
+            if probed is None:
+                head += chunk
+                probed = _probe(bytes(head), complete=len(head) >= settings.UPLOAD_HEADER_BYTES)
+                if probed is None:
+                    continue
+                chunk, head = bytes(head), bytearray()
+            if f is None:
+                scratch = scratch_path(f"upload_{uuid.uuid4().hex}{EXTENSIONS[probed[0]]}")
+                f = open(scratch, "wb")
+            await run_in_threadpool(f.write, chunk)
+        if probed is None:
+            # Body shorter than the probe window
+            probed = _probe(bytes(head), complete=True)
+            scratch = scratch_path(f"upload_{uuid.uuid4().hex}{EXTENSIONS[probed[0]]}")
+            f = open(scratch, "wb")
+            await run_in_threadpool(f.write, bytes(head))
+        f.close()
+        locator = await run_in_threadpool(get_storage().put_file, scratch, True, digest.hexdigest())
+    except BaseException:
+        if f is not None:
+            _discard(f, scratch)
+        raise
+
+    fmt, width, height = probed
+    source = SourceUpload(user_id=user.id, locator=locator, format=fmt, width=width, height=height, size_bytes=size)
+    db.add(source)
+    await db.commit()
+    await db.refresh(source)
+    return source
+
+
+@router.get("/{source_id}", response_model=SourceUploadOut)
+async def get_source(
+    source_id: int,
+    user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    source = await db.scalar(select(SourceUpload).where(SourceUpload.id == source_id, SourceUpload.user_id == user.id))
+    if source is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return source
@@ -7,10 +7,27 @@ class Settings:
     SECRET_KEY: str = os.getenv("SECRET_KEY", "dev-secret-key-change-me")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "120"))
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
+    # Verified-token cache; 0 disables it. Set AUTH_CACHE_REDIS_URL to share it across API replicas.
+    AUTH_CACHE_TTL_SECONDS: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+    AUTH_CACHE_REDIS_URL: str = os.getenv("AUTH_CACHE_REDIS_URL", "")
+    # bcrypt cost; stored hashes with a different cost are rehashed on the next login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    # Processes hashing passwords per API process (0 = thread pool); extra logins queue up to the limit
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
 
     # Database
     ENV: str = os.getenv("ENV", "dev")
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+    # Async driver URL for the API; empty derives it from DATABASE_URL (asyncpg / aiosqlite)
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+    # Connection pool (per engine, per process); ignored for SQLite
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 
     # CORS
     CORS_ORIGINS: str = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000")
@@ -20,18 +37,128 @@ class Settings:
     IMAGES_DIR_NAME: str = "images"
     VIDEOS_DIR_NAME: str = "videos"
     UPSCALES_DIR_NAME: str = "upscales"
+    # Content-addressed object store for outputs and sources: "local" (STORAGE_DIR/objects) or "s3"
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local").lower()
+    STORAGE_OBJECTS_DIR_NAME: str = "objects"
+    STORAGE_TMP_DIR_NAME: str = "tmp"
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "objects/")
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")  # e.g. http://minio:9000
+    S3_REGION: str = os.getenv("S3_REGION", "")
+    S3_CACHE_DIR_NAME: str = "s3cache"
+    # zlib level for PNG outputs (0-9): lower encodes faster, larger files
+    PNG_COMPRESS_LEVEL: int = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+    # Gallery derivatives: longest edge per variant, formats in preference order (avif needs pillow-avif-plugin)
+    DERIVATIVES_DIR_NAME: str = "derivatives"
+    DERIVATIVE_SIZES: str = os.getenv("DERIVATIVE_SIZES", "thumb:256,preview:1024")
+    DERIVATIVE_FORMATS: str = os.getenv("DERIVATIVE_FORMATS", "avif,webp")
+    DERIVATIVE_QUALITY: int = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+    MEDIA_CACHE_MAX_AGE: int = int(os.getenv("MEDIA_CACHE_MAX_AGE", "86400"))
+
+    # Content-addressed cache of deterministic results (seeded generations, upscales)
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    RESULT_CACHE_DIR_NAME: str = "cache"
+    RESULT_CACHE_MAX_MB: int = int(os.getenv("RESULT_CACHE_MAX_MB", "2048"))
 
     # Celery / Redis
     CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/1")
+    # Run tasks inline in the caller (tests, local debugging); no broker needed
+    CELERY_TASK_ALWAYS_EAGER: bool = os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() in ("1", "true", "yes")
+
+    # Job recovery: tasks are acked after they finish, so a lost worker's job is redelivered.
+    # JOB_TIMEOUT_SECONDS is the hard per-task limit; running rows older than it are reaped.
+    JOB_TIMEOUT_SECONDS: int = int(os.getenv("JOB_TIMEOUT_SECONDS", "1800"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_QUEUED_TIMEOUT_SECONDS: int = int(os.getenv("JOB_QUEUED_TIMEOUT_SECONDS", "3600"))  # re-enqueue after
+    REAPER_INTERVAL_SECONDS: int = int(os.getenv("REAPER_INTERVAL_SECONDS", "60"))
+
+    # Generation event stream (Redis pub/sub -> SSE)
+    EVENTS_REDIS_URL: str = os.getenv("EVENTS_REDIS_URL", CELERY_BROKER_URL)
+    EVENTS_TTL_SECONDS: int = int(os.getenv("EVENTS_TTL_SECONDS", "3600"))
+    EVENTS_PREVIEW_EVERY: int = int(os.getenv("EVENTS_PREVIEW_EVERY", "5"))  # steps; 0 disables previews
+    EVENTS_HEARTBEAT_SECONDS: int = int(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+    # Admission control at submission: per-user token buckets per job type ("type=per_minute/burst"),
+    # a per-user cap on queued + running jobs and a global one (backpressure). 0 disables a cap.
+    # State is shared through Redis; with ADMISSION_REDIS_URL empty each API process keeps its own.
+    ADMISSION_REDIS_URL: str = os.getenv("ADMISSION_REDIS_URL", CELERY_BROKER_URL)
+    ADMISSION_RATES: str = os.getenv("ADMISSION_RATES", "image=60/500,upscale=60/100,video=10/20")
+    ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "500"))
+    ADMISSION_MAX_QUEUE_DEPTH: int = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "20000"))
+    ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "15"))
+
+    # Source uploads (POST /api/v1/sources): size/pixel caps are checked before the body is accepted
+    UPLOAD_MAX_MB: int = int(os.getenv("UPLOAD_MAX_MB", "64"))
+    UPLOAD_MAX_PIXELS: int = int(os.getenv("UPLOAD_MAX_PIXELS", str(10000 * 10000)))
+    UPLOAD_FORMATS: str = os.getenv("UPLOAD_FORMATS", "PNG,JPEG,WEBP")
+    UPLOAD_HEADER_BYTES: int = int(os.getenv("UPLOAD_HEADER_BYTES", str(256 * 1024)))
+
+    # Max jobs accepted by one /api/v1/generate/batch request
+    GENERATE_BATCH_MAX_JOBS: int = int(os.getenv("GENERATE_BATCH_MAX_JOBS", "500"))
+    # Max generations touched by one /api/v1/admin/review/bulk request
+    ADMIN_BULK_REVIEW_MAX: int = int(os.getenv("ADMIN_BULK_REVIEW_MAX", "1000"))
+
+    # txt2img micro-batching (worker mode)
+    TXT2IMG_BATCHING: bool = os.getenv("TXT2IMG_BATCHING", "false").lower() in ("1", "true", "yes")
+    TXT2IMG_BATCH_MAX_SIZE: int = int(os.getenv("TXT2IMG_BATCH_MAX_SIZE", "4"))
+    TXT2IMG_BATCH_WINDOW_MS: int = int(os.getenv("TXT2IMG_BATCH_WINDOW_MS", "250"))
 
     # Models
     MODELS_DIR: str = os.getenv("MODELS_DIR", "/workspace/backend/models")
     SD_MODEL_ID: str = os.getenv("SD_MODEL_ID", "runwayml/stable-diffusion-v1-5")
     SD_INPAINT_MODEL_ID: str = os.getenv("SD_INPAINT_MODEL_ID", "stabilityai/stable-diffusion-2-inpainting")
     REAL_ESRGAN_MODEL: str = os.getenv("REAL_ESRGAN_MODEL", "x4plus")
+    # Tiled upscaling: input tile edge/overlap in pixels; the budget caps the blend strip buffer
+    UPSCALE_TILE_SIZE: int = int(os.getenv("UPSCALE_TILE_SIZE", "256"))
+    UPSCALE_TILE_OVERLAP: int = int(os.getenv("UPSCALE_TILE_OVERLAP", "16"))
+    UPSCALE_BATCH_SIZE: int = int(os.getenv("UPSCALE_BATCH_SIZE", "4"))
+    UPSCALE_MEMORY_BUDGET_MB: int = int(os.getenv("UPSCALE_MEMORY_BUDGET_MB", "256"))
     STABLE_VIDEO_MODEL_ID: str = os.getenv("STABLE_VIDEO_MODEL_ID", "stabilityai/stable-video-diffusion-img2vid-xt")
 
+    # Video encoding: VIDEO_ENCODER pyav|ffmpeg|auto; VIDEO_CODEC auto picks the first working
+    # encoder among nvenc/qsv/videotoolbox/libx264/openh264/mpeg4
+    VIDEO_ENCODER: str = os.getenv("VIDEO_ENCODER", "auto")
+    VIDEO_CODEC: str = os.getenv("VIDEO_CODEC", "auto")
+    VIDEO_CRF: int = int(os.getenv("VIDEO_CRF", "23"))
+    VIDEO_FPS: int = int(os.getenv("VIDEO_FPS", "8"))
+    VIDEO_SECONDS: float = float(os.getenv("VIDEO_SECONDS", "2"))
+    VIDEO_ENCODE_TIMEOUT: int = int(os.getenv("VIDEO_ENCODE_TIMEOUT", "300"))
+    FFMPEG_BINARY: str = os.getenv("FFMPEG_BINARY", "ffmpeg")
+    # Optional per-style checkpoints: "anime=org/anime-model,photo=org/photo-model"
+    SD_STYLE_MODELS: str = os.getenv("SD_STYLE_MODELS", "")
+    # auto = float16 on CUDA, float32 on CPU
+    MODEL_DTYPE: str = os.getenv("MODEL_DTYPE", "auto")
+    # Byte budget for resident model weights, LRU-evicted past it; 0 = unbounded
+    MODEL_CACHE_BUDGET_MB: int = int(os.getenv("MODEL_CACHE_BUDGET_MB", "0"))
+
+    # Optional JSON file {"explicit": [...], "soft": [...], "fetish": [...]}; hot-reloaded on change
+    NSFW_KEYWORDS_FILE: str = os.getenv("NSFW_KEYWORDS_FILE", "")
+
+    # Image NSFW detector (ONNX, CPU); disabled when the model file is missing
+    NSFW_IMAGE_MODEL_PATH: str = os.getenv("NSFW_IMAGE_MODEL_PATH", os.path.join(MODELS_DIR, "nsfw", "model.onnx"))
+    NSFW_IMAGE_LABELS: str = os.getenv("NSFW_IMAGE_LABELS", "drawings,hentai,neutral,porn,sexy")
+    NSFW_IMAGE_LABEL_TAGS: str = os.getenv("NSFW_IMAGE_LABEL_TAGS", "hentai=explicit,porn=explicit,sexy=soft")
+    NSFW_IMAGE_THRESHOLD: float = float(os.getenv("NSFW_IMAGE_THRESHOLD", "0.6"))
+    NSFW_IMAGE_INPUT_SIZE: int = int(os.getenv("NSFW_IMAGE_INPUT_SIZE", "224"))
+    NSFW_IMAGE_THREADS: int = int(os.getenv("NSFW_IMAGE_THREADS", "0"))  # 0 = onnxruntime default
+
+    # Worker model residency: comma-separated model names to preload at worker boot
+    # (txt2img,img2img,upscaler,nsfw). Empty means derive from the queues the worker consumes.
+    WORKER_PRELOAD_MODELS: str = os.getenv("WORKER_PRELOAD_MODELS", "")
+    WORKER_WARMUP: bool = os.getenv("WORKER_WARMUP", "true").lower() in ("1", "true", "yes")
+
+    # Observability: workers serve /metrics on METRICS_WORKER_PORT (0 = off) and report the models
+    # they hold every WORKER_HEARTBEAT_SECONDS. /ready fails unless some live worker holds each READY_MODELS entry.
+    METRICS_WORKER_PORT: int = int(os.getenv("METRICS_WORKER_PORT", "0"))
+    WORKER_HEARTBEAT_SECONDS: int = int(os.getenv("WORKER_HEARTBEAT_SECONDS", "30"))
+    # Heartbeats live in Redis: the broker by default, when it is Redis; set this with an AMQP broker
+    WORKER_HEARTBEAT_REDIS_URL: str = os.getenv(
+        "WORKER_HEARTBEAT_REDIS_URL",
+        CELERY_BROKER_URL if CELERY_BROKER_URL.startswith(("redis://", "rediss://", "unix://")) else "",
+    )
+    READY_MODELS: str = os.getenv("READY_MODELS", "")
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -42,6 +169,10 @@ def get_settings() -> Settings:
         settings.IMAGES_DIR_NAME,
         settings.VIDEOS_DIR_NAME,
         settings.UPSCALES_DIR_NAME,
+        settings.RESULT_CACHE_DIR_NAME,
+        settings.DERIVATIVES_DIR_NAME,
+        settings.STORAGE_OBJECTS_DIR_NAME,
+        settings.STORAGE_TMP_DIR_NAME,
     ):
         path = os.path.join(settings.STORAGE_DIR, sub)
         os.makedirs(path, exist_ok=True)
@@ -0,0 +1,306 @@
+from __future__ import annotations
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+
+from ..config import get_settings
+from ..models import Generation, User
+from .metrics import ADMISSION_REJECTED
+
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT_STATUSES = ("queued", "running")
+
+# KEYS: global in-flight, user in-flight, then one token bucket per job type
+# ARGV: now, cost total, max in-flight, max queue depth, counter ttl, then (rate/s, burst, cost) per bucket
+# Returns {0} when admitted, else {reason, retry_after}; nothing is taken unless every check passes.
+_ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local total = tonumber(ARGV[2])
+local max_in_flight = tonumber(ARGV[3])
+local max_depth = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+if max_depth > 0 and tonumber(redis.call('GET', KEYS[1]) or '0') + total > max_depth then
+  return {1, '0'}
+end
+if max_in_flight > 0 and tonumber(redis.call('GET', KEYS[2]) or '0') + total > max_in_flight then
+  return {2, '0'}
+end
+local buckets = {}
+for i = 3, #KEYS do
+  local a = 6 + (i - 3) * 3
+  local rate, burst, cost = tonumber(ARGV[a]), tonumber(ARGV[a + 1]), tonumber(ARGV[a + 2])
+  local b = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local tokens = tonumber(b[1]) or burst
+  tokens = math.min(burst, tokens + math.max(0, now - (tonumber(b[2]) or now)) * rate)
+  if tokens < cost then
+    return {3, tostring((cost - tokens) / rate)}
+  end
+  buckets[i] = {tokens - cost, math.ceil(burst / rate)}
+end
+for i, b in pairs(buckets) do
+  redis.call('HSET', KEYS[i], 'tokens', tostring(b[1]), 'ts', tostring(now))
+  redis.call('EXPIRE', KEYS[i], b[2])
+end
+redis.call('INCRBY', KEYS[1], total)
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('INCRBY', KEYS[2], total)
+redis.call('EXPIRE', KEYS[2], ttl)
+return {0, '0'}
+"""
+
+# KEYS: global in-flight, then user in-flight keys; ARGV: the count per user key
+_RELEASE_SCRIPT = """
+local total = 0
+for i = 2, #KEYS do
+  local n = tonumber(ARGV[i - 1])
+  total = total + n
+  if redis.call('DECRBY', KEYS[i], n) < 0 then redis.call('SET', KEYS[i], 0) end
+end
+if redis.call('DECRBY', KEYS[1], total) < 0 then redis.call('SET', KEYS[1], 0) end
+return total
+"""
+
+
+def parse_rates(spec: str) -> Dict[str, Tuple[float, float]]:
+    """``"image=60/500,video=10/20"`` -> {type: (tokens per second, burst)}."""
+    rates = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        job_type, _, value = item.partition("=")
+        per_minute, _, burst = value.partition("/")
+        if float(per_minute) > 0:  # 0 leaves the type unlimited
+            rates[job_type.strip()] = (float(per_minute) / 60.0, float(burst or per_minute))
+    return rates
+
+
+def in_flight_counts_stmt():
+    """Queued + running jobs per user: the ground truth the counters are reconciled to.
+
+    Admins are never admitted, so their jobs are not counted.
+    """
+    return (
+        select(Generation.user_id, func.count())
+        .join(User, User.id == Generation.user_id)
+        .where(Generation.status.in_(IN_FLIGHT_STATUSES), User.is_admin.is_(False))
+        .group_by(Generation.user_id)
+    )
+
+
+def admin_ids_stmt(user_ids: Iterable[int]):
+    """The admins among ``user_ids``: owners whose finished jobs hold no slot to release."""
+    return select(User.id).where(User.id.in_(set(user_ids)), User.is_admin.is_(True))
+
+
+class AdmissionController:
+    """Per-user, per-job-type token buckets, a per-user cap on queued + running jobs,
+    and global backpressure once the total crosses ``max_queue_depth``.
+
+    State lives in Redis (one Lua script per decision, so concurrent API
+    replicas cannot overshoot). Without Redis, or while it is unreachable, an
+    in-process copy is used instead; that copy reloads the in-flight counts
+    from the database every ``reconcile_seconds``, since it never sees workers
+    finish. Workers ``release`` jobs as they reach a final status and the
+    reaper ``reconcile``s the shared counters against the database.
+    """
+
+    GLOBAL_KEY = "admission:inflight"
+
+    def __init__(
+        self,
+        rates: Dict[str, Tuple[float, float]],
+        max_in_flight: int,
+        max_queue_depth: int,
+        retry_after_seconds: int,
+        redis_url: str = "",
+        counter_ttl_seconds: int = 86400,
+        reconcile_seconds: float = 30.0,
+    ) -> None:
+        self.rates = rates
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.retry_after_seconds = retry_after_seconds
+        self.redis_url = redis_url
+        self.counter_ttl_seconds = counter_ttl_seconds
+        self.reconcile_seconds = reconcile_seconds
+        self.rejected: Dict[str, int] = {}
+        self._buckets: Dict[Tuple[int, str], Tuple[float, float]] = {}
+        self._in_flight: Dict[int, int] = {}
+        self._reconciled_at = 0.0
+        self._redis_down_until = 0.0
+        self._lock = threading.Lock()
+        self._sync_redis = None
+        self._async_redis = None
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        settings = get_settings()
+        return cls(
+            rates=parse_rates(settings.ADMISSION_RATES),
+            max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+            max_queue_depth=settings.ADMISSION_MAX_QUEUE_DEPTH,
+            retry_after_seconds=settings.ADMISSION_RETRY_AFTER_SECONDS,
+            redis_url=settings.ADMISSION_REDIS_URL,
+            counter_ttl_seconds=settings.JOB_TIMEOUT_SECONDS + settings.JOB_QUEUED_TIMEOUT_SECONDS,
+        )
+
+    def _sync_client(self):
+        if self._sync_redis is None:
+            import redis
+
+            self._sync_redis = redis.Redis.from_url(self.redis_url)
+        return self._sync_redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+        return self._async_redis
+
+    def _use_redis(self) -> bool:
+        return bool(self.redis_url) and time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, what: str) -> None:
+        # Back off so an unreachable Redis does not add a connect timeout to every request
+        self._redis_down_until = time.monotonic() + 5.0
+        logger.warning("admission control: %s failed, using in-process state", what, exc_info=True)
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"admission:inflight:{user_id}"
+
+    @staticmethod
+    def _bucket_key(user_id: int, job_type: str) -> str:
+        return f"admission:bucket:{user_id}:{job_type}"
+
+    def _reject(self, reason: str, retry_after: float, detail: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def _outcome(self, code: int, retry_after: float) -> None:
+        if code == 1:
+            self._reject("backpressure", self.retry_after_seconds, "Service is busy, try again shortly")
+        elif code == 2:
+            self._reject("in_flight", self.retry_after_seconds, f"At most {self.max_in_flight} unfinished jobs per user")
+        elif code == 3:
+            self._reject("rate", retry_after, "Too many jobs submitted, slow down")
+
+    async def admit(self, user, costs: Dict[str, int], db=None) -> None:
+        """Admit ``costs`` ({job type: job count}) for ``user`` or raise 429 with ``Retry-After``.
+
+        ``db`` (an AsyncSession) lets the in-process fallback refresh its
+        in-flight counts. Admins are never limited.
+        """
+        if user.is_admin:
+            return
+        total = sum(costs.values())
+        for job_type, cost in costs.items():
+            rate = self.rates.get(job_type)
+            if rate and cost > rate[1]:
+                raise HTTPException(status_code=400, detail=f"At most {int(rate[1])} {job_type} jobs per request")
+        limited = [(t, c) for t, c in costs.items() if t in self.rates]
+        now = time.time()
+        if self._use_redis():
+            keys = [self.GLOBAL_KEY, self._user_key(user.id), *(self._bucket_key(user.id, t) for t, _ in limited)]
+            args = [now, total, self.max_in_flight, self.max_queue_depth, self.counter_ttl_seconds]
+            for job_type, cost in limited:
+                args += [*self.rates[job_type], cost]
+            try:
+                code, retry_after = await self._async_client().eval(_ADMIT_SCRIPT, len(keys), *keys, *args)
+            except Exception:
+                self._redis_failed("admit")
+            else:
+                return self._outcome(int(code), float(retry_after))
+        if db is not None and time.monotonic() - self._reconciled_at > self.reconcile_seconds:
+            self.reconcile((await db.execute(in_flight_counts_stmt())).all())
+        self._outcome(*self._admit_local(user.id, limited, total, now))
+
+    @asynccontextmanager
+    async def reserve(self, user, costs: Dict[str, int], db=None):
+        """``admit``, handing the slots back if the body (the INSERT) raises."""
+        await self.admit(user, costs, db)
+        try:
+            yield
+        except BaseException:
+            if not user.is_admin:
+                await run_in_threadpool(self.release, [user.id] * sum(costs.values()))
+            raise
+
+    def _admit_local(self, user_id: int, limited, total: int, now: float) -> Tuple[int, float]:
+        with self._lock:
+            if self.max_queue_depth and sum(self._in_flight.values()) + total > self.max_queue_depth:
+                return 1, 0.0
+            if self.max_in_flight and self._in_flight.get(user_id, 0) + total > self.max_in_flight:
+                return 2, 0.0
+            updated = {}
+            for job_type, cost in limited:
+                rate, burst = self.rates[job_type]
+                tokens, ts = self._buckets.get((user_id, job_type), (burst, now))
+                tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+                if tokens < cost:
+                    return 3, (cost - tokens) / rate
+                updated[(user_id, job_type)] = (tokens - cost, now)
+            self._buckets.update(updated)
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + total
+            return 0, 0.0
+
+    def release(self, user_ids: Iterable[int]) -> None:
+        """One job of each listed user (repeats allowed) reached a final status."""
+        counts: Dict[int, int] = {}
+        for user_id in user_ids:
+            counts[user_id] = counts.get(user_id, 0) + 1
+        if not counts:
+            return
+        if self._use_redis():
+            try:
+                keys = [self.GLOBAL_KEY, *(self._user_key(u) for u in counts)]
+                self._sync_client().eval(_RELEASE_SCRIPT, len(keys), *keys, *counts.values())
+                return
+            except Exception:
+                self._redis_failed("release")  # the reaper reconciles the shared counters
+        with self._lock:
+            for user_id, n in counts.items():
+                self._in_flight[user_id] = max(0, self._in_flight.get(user_id, 0) - n)
+
+    def reconcile(self, counts: Iterable[Tuple[int, int]]) -> None:
+        """Reset in-flight counters to ``(user_id, count)`` rows from ``in_flight_counts_stmt``."""
+        counts = dict(counts)
+        self._reconciled_at = time.monotonic()
+        if self._use_redis():
+            try:
+                client = self._sync_client()
+                pipe = client.pipeline(transaction=True)
+                stale = [k for k in client.scan_iter("admission:inflight:*") if int(k.rsplit(b":", 1)[1]) not in counts]
+                if stale:
+                    pipe.delete(*stale)
+                for user_id, n in counts.items():
+                    pipe.set(self._user_key(user_id), n, ex=self.counter_ttl_seconds)
+                pipe.set(self.GLOBAL_KEY, sum(counts.values()), ex=self.counter_ttl_seconds)
+                pipe.execute()
+                return
+            except Exception:
+                self._redis_failed("reconcile")
+        with self._lock:
+            self._in_flight = counts
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"rejected": dict(self.rejected), "in_flight_local": sum(self._in_flight.values())}
+
+
+admission = AdmissionController.from_settings()
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import os
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from ..config import get_settings
+from .derivatives import render_all
+from .metrics import STAGE_SECONDS, timed
+from .nsfw_pipeline import NSFWResult
+from .storage import content_digest
+
+
+class SourceImage:
+    """A source file hashed in chunks (the result-cache digest) and decoded from its path on first use.
+
+    Uploads can be tens of MB, so the encoded bytes are never held in memory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.digest = content_digest(path)
+        self._image: Optional[Image.Image] = None
+
+    def image(self) -> Image.Image:
+        if self._image is None:
+            with Image.open(self.path) as im:
+                self._image = im.convert("RGB")
+        return self._image
+
+
+def save_image(image: Image.Image, path: str) -> None:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".png":
+        image.save(path, format="PNG", compress_level=get_settings().PNG_COMPRESS_LEVEL)
+    else:
+        image.save(path)
+
+
+class PngStreamWriter:
+    """Writes an RGB PNG row block by row block, so the full image never has to be in memory.
+
+    Rows use the PNG "Up" filter, computed with numpy, and are deflated
+    incrementally into IDAT chunks.
+    """
+
+    def __init__(self, path: str, width: int, height: int, level: Optional[int] = None) -> None:
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._prev = np.zeros((width * 3,), dtype=np.uint8)
+        self._zlib = zlib.compressobj(get_settings().PNG_COMPRESS_LEVEL if level is None else level)
+        self._f = open(path, "wb")
+        self._f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._f.write(struct.pack(">I", len(data)) + kind + data)
+        self._f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """``rows`` is a uint8 array of shape (n, width, 3)."""
+        flat = rows.reshape(len(rows), self.width * 3)
+        prev = np.vstack([self._prev[None, :], flat[:-1]])
+        block = np.empty((len(rows), 1 + self.width * 3), dtype=np.uint8)
+        block[:, 0] = 2  # Up filter
+        np.subtract(flat, prev, out=block[:, 1:])  # wraps mod 256 as PNG expects
+        self._prev = flat[-1].copy()
+        self.rows_written += len(rows)
+        data = self._zlib.compress(block.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG expects {self.height} rows, got {self.rows_written}")
+            self._chunk(b"IDAT", self._zlib.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self._f.close()
+
+    def __enter__(self) -> "PngStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self._f.close()  # leave the partial file to the caller; don't mask the error
+            return
+        self.close()
+
+
+@dataclass
+class ImageArtifact:
+    """A generated image on its way to storage; ``image`` stays in memory until encoded."""
+
+    gen: object  # Generation row (id, mode, ...)
+    image: Image.Image
+    output_path: str
+    moderation: Optional[NSFWResult] = None
+    extra: Dict[str, str] = field(default_factory=dict)
+    encoded: bool = False  # output_path already written (e.g. streamed); ``image`` is a proxy for later stages
+
+
+Stage = Callable[[List[ImageArtifact]], None]
+
+
+def moderation_stage(classifier_factory: Callable) -> Stage:
+    """Classify the in-memory images of ``nsfw_smart`` jobs in one detector batch."""
+
+    def stage(artifacts: List[ImageArtifact]) -> None:
+        smart = [a for a in artifacts if a.gen.mode == "nsfw_smart"]
+        if not smart:
+            return
+        with timed(STAGE_SECONDS, stage="moderation"):
+            results = classifier_factory().classify_images([a.image for a in smart])
+        for artifact, res in zip(smart, results):
+            artifact.moderation = res
+
+    return stage
+
+
+def encode_stage(artifacts: List[ImageArtifact]) -> None:
+    for artifact in artifacts:
+        if not artifact.encoded:
+            with timed(STAGE_SECONDS, stage="encode"):
+                save_image(artifact.image, artifact.output_path)
+
+
+def derivative_stage(artifacts: List[ImageArtifact]) -> None:
+    """Render thumbnails/previews from the in-memory image, named by the encoded original's hash."""
+    for artifact in artifacts:
+        with timed(STAGE_SECONDS, stage="derivatives"):
+            artifact.extra.update(render_all(artifact.image, content_digest(artifact.output_path)))
+
+
+class ArtifactPipeline:
+    """Runs batches of in-memory artifacts through ordered stages; encoding is the only disk write."""
+
+    def __init__(self, stages: List[Stage]) -> None:
+        self.stages = stages
+
+    def run(self, artifacts: List[ImageArtifact]) -> List[ImageArtifact]:
+        for stage in self.stages:
+            if artifacts:
+                stage(artifacts)
+        return artifacts
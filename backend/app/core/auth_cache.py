@@ -0,0 +1,272 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ..config import get_settings
+from ..models import User
+from .metrics import cache_lookup
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """The user fields request handlers need, detached from any DB session."""
+
+    id: int
+    email: str
+    is_admin: bool
+    is_paid: bool
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            is_admin=bool(user.is_admin),
+            is_paid=bool(user.is_paid),
+            created_at=user.created_at,
+        )
+
+    def dumps(self) -> str:
+        data = asdict(self)
+        data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        return json.dumps(data)
+
+    @classmethod
+    def loads(cls, raw) -> "UserSnapshot":
+        data = json.loads(raw)
+        if data["created_at"]:
+            data["created_at"] = datetime.fromisoformat(data["created_at"])
+        return cls(**data)
+
+
+def token_key(token: str) -> str:
+    # Never keep raw bearer tokens as cache keys
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class AuthCache:
+    """Bounded TTL cache of verified tokens -> user snapshots.
+
+    Entries never outlive the token's ``exp``. With ``redis_url`` set, entries
+    live in Redis so every API replica shares them and sees invalidations;
+    otherwise they are kept in an in-process LRU. While Redis is unreachable
+    the cache is bypassed (every request verifies against the database).
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int, redis_url: str = "") -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.redis_url = redis_url
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, UserSnapshot]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+        self._sync_redis = None
+        self._async_redis = None
+
+    @classmethod
+    def from_settings(cls) -> "AuthCache":
+        settings = get_settings()
+        return cls(
+            ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS,
+            max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+            redis_url=settings.AUTH_CACHE_REDIS_URL,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _sync_client(self):
+        if self._sync_redis is None:
+            import redis
+
+            self._sync_redis = redis.Redis.from_url(self.redis_url)
+        return self._sync_redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+        return self._async_redis
+
+    def _use_redis(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, what: str) -> None:
+        # Back off so an unreachable Redis does not add a connect timeout to every request
+        self._redis_down_until = time.monotonic() + 5.0
+        logger.warning("auth cache: %s failed, bypassing the cache", what, exc_info=True)
+
+    @staticmethod
+    def _entry_key(key: str) -> str:
+        return f"auth:token:{key}"
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"auth:user:{user_id}"
+
+    def _ttl(self, expires_at: Optional[float]) -> float:
+        ttl = float(self.ttl_seconds)
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        return ttl
+
+    async def get(self, token: str) -> Optional[UserSnapshot]:
+        if not self.enabled:
+            return None
+        key = token_key(token)
+        snapshot = None
+        if self.redis_url:
+            if self._use_redis():
+                try:
+                    raw = await self._async_client().get(self._entry_key(key))
+                    snapshot = UserSnapshot.loads(raw) if raw else None
+                except Exception:
+                    self._redis_failed("lookup")
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] > time.monotonic():
+                        self._entries.move_to_end(key)
+                        snapshot = entry[1]
+                    else:
+                        self._drop(key)
+        if snapshot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        cache_lookup("auth", snapshot is not None)
+        return snapshot
+
+    async def put(self, token: str, snapshot: UserSnapshot, expires_at: Optional[float] = None) -> None:
+        """Cache ``snapshot`` for ``token``; ``expires_at`` is the token's ``exp`` (epoch seconds)."""
+        ttl = self._ttl(expires_at)
+        if not self.enabled or ttl <= 0:
+            return
+        key = token_key(token)
+        if self.redis_url:
+            if not self._use_redis():
+                return
+            try:
+                pipe = self._async_client().pipeline(transaction=False)
+                pipe.set(self._entry_key(key), snapshot.dumps(), px=int(ttl * 1000))
+                # Per-user index so invalidation can find every token of a user
+                pipe.sadd(self._user_key(snapshot.id), key)
+                pipe.expire(self._user_key(snapshot.id), self.ttl_seconds)
+                await pipe.execute()
+            except Exception:
+                self._redis_failed("store")
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, snapshot)
+            self._by_user.setdefault(snapshot.id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_user.get(entry[1].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry[1].id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget every cached token of ``user_id``; call after the user changes or is deleted."""
+        self.invalidate_users([user_id])
+
+    def invalidate_users(self, user_ids: Iterable[int]) -> None:
+        """``invalidate_user`` for several users. The Redis round-trips run in the
+        default executor when called on an event loop, so they never block it."""
+        user_ids = list(user_ids)
+        if not self.redis_url:
+            with self._lock:
+                for user_id in user_ids:
+                    for key in list(self._by_user.get(user_id, ())):
+                        self._drop(key)
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._invalidate_redis(user_ids)
+        else:
+            loop.run_in_executor(None, self._invalidate_redis, user_ids)
+
+    def _invalidate_redis(self, user_ids) -> None:
+        for user_id in user_ids:
+            try:
+                client = self._sync_client()
+                keys = client.smembers(self._user_key(user_id))
+                pipe = client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.delete(self._entry_key(key.decode()))
+                pipe.delete(self._user_key(user_id))
+                pipe.execute()
+            except Exception:
+                logger.warning("could not invalidate cached tokens of user %s", user_id, exc_info=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+auth_cache = AuthCache.from_settings()
+
+
+_PENDING = "auth_cache_invalidate"
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: User) -> None:
+    # Runs inside the flush (on the event loop for async sessions): only note the id
+    session = object_session(target)
+    if session is None:
+        auth_cache.invalidate_user(target.id)
+        return
+    session.info.setdefault(_PENDING, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session) -> None:
+    user_ids = session.info.pop(_PENDING, None)
+    if user_ids:
+        auth_cache.invalidate_users(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_invalidations(session) -> None:
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+import os
+import threading
+from typing import Dict, List, Optional
+
+from PIL import Image, features
+
+from ..config import get_settings
+from .metrics import cache_lookup
+from .storage import get_storage, locator_digest
+
+try:  # AVIF encoder for Pillow < 11.2
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pillow_avif = None
+
+MEDIA_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+_PIL_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+
+
+def variant_sizes() -> Dict[str, int]:
+    """``DERIVATIVE_SIZES`` ("thumb:256,preview:1024") as name -> longest edge."""
+    sizes = {}
+    for item in get_settings().DERIVATIVE_SIZES.split(","):
+        name, _, edge = item.strip().partition(":")
+        if name and edge:
+            sizes[name] = int(edge)
+    return sizes
+
+
+def supported_formats() -> List[str]:
+    """Configured derivative formats this Pillow build can encode, in preference order."""
+    Image.init()
+    formats = []
+    for fmt in get_settings().DERIVATIVE_FORMATS.split(","):
+        fmt = fmt.strip().lower()
+        if fmt == "webp" and features.check("webp"):
+            formats.append(fmt)
+        elif fmt == "avif" and _PIL_FORMATS["avif"] in Image.SAVE:
+            formats.append(fmt)
+    return formats
+
+
+def derivative_path(digest: str, variant: str, fmt: str) -> str:
+    """Content-addressed location: identical originals share their derivatives."""
+    settings = get_settings()
+    return os.path.join(settings.STORAGE_DIR, settings.DERIVATIVES_DIR_NAME, digest[:2], f"{digest}_{variant}.{fmt}")
+
+
+def render_derivative(image: Image.Image, edge: int, fmt: str, path: str) -> str:
+    thumb = image.copy()
+    thumb.thumbnail((edge, edge), Image.LANCZOS, reducing_gap=2.0)
+    if thumb.mode not in ("RGB", "RGBA"):
+        thumb = thumb.convert("RGB")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so concurrent readers never see a partial file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    thumb.save(tmp, format=_PIL_FORMATS[fmt], quality=get_settings().DERIVATIVE_QUALITY, method=4)
+    os.replace(tmp, path)
+    return path
+
+
+def render_all(image: Image.Image, digest: str) -> Dict[str, str]:
+    """Write every configured variant/format of an in-memory image; returns ``variant.fmt`` -> path."""
+    written = {}
+    for variant, edge in variant_sizes().items():
+        for fmt in supported_formats():
+            path = derivative_path(digest, variant, fmt)
+            if not os.path.exists(path):
+                render_derivative(image, edge, fmt, path)
+            written[f"{variant}.{fmt}"] = path
+    return written
+
+
+def render_stored(locator: str) -> Dict[str, str]:
+    """``render_all`` for an original already in storage (a streamed upscale), decoded from its file."""
+    edge = max(variant_sizes().values(), default=0)
+    with Image.open(get_storage().local_path(locator)) as im:
+        im.draft("RGB", (edge, edge))
+        return render_all(im, locator_digest(locator))
+
+
+def ensure_derivative(locator: str, variant: str, fmt: str) -> Optional[str]:
+    """Path of a derivative of a stored original, rendering it on first request (older rows)."""
+    edge = variant_sizes().get(variant)
+    if edge is None or fmt not in supported_formats():
+        return None
+    path = derivative_path(locator_digest(locator), variant, fmt)
+    exists = os.path.exists(path)
+    cache_lookup("derivative", exists)
+    if not exists:
+        with Image.open(get_storage().local_path(locator)) as im:
+            # JPEG sources decode straight at a reduced scale
+            im.draft("RGB", (edge, edge))
+            render_derivative(im, edge, fmt, path)
+    return path
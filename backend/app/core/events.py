@@ -0,0 +1,142 @@
+from __future__ import annotations
+import base64
+import io
+import json
+import logging
+from typing import Dict, List, Optional
+
+from ..config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ("completed", "failed", "blocked", "flagged")
+
+# Linear approximation of the SD 1.x VAE decoder (4 latent channels -> RGB),
+# good enough for a thumbnail-sized progress preview without running the VAE.
+_LATENT_RGB_FACTORS = [
+    [0.298, 0.207, 0.208],
+    [0.187, 0.286, 0.173],
+    [-0.158, 0.189, 0.264],
+    [-0.184, -0.271, -0.473],
+]
+
+_redis = None
+
+
+def channel_name(gen_id: int) -> str:
+    return f"generation:{gen_id}:events"
+
+
+def last_event_key(gen_id: int) -> str:
+    return f"generation:{gen_id}:last"
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(get_settings().EVENTS_REDIS_URL)
+    return _redis
+
+
+def publish_event(gen_id: int, event: Dict) -> None:
+    """Publish a generation event; never lets a Redis failure break the job."""
+    payload = json.dumps({"generation_id": gen_id, **event})
+    try:
+        client = _client()
+        pipe = client.pipeline(transaction=False)
+        pipe.publish(channel_name(gen_id), payload)
+        # Late subscribers start from the latest known state
+        pipe.set(last_event_key(gen_id), payload, ex=get_settings().EVENTS_TTL_SECONDS)
+        pipe.execute()
+    except Exception:
+        logger.debug("could not publish event for generation %s", gen_id, exc_info=True)
+
+
+def publish_status(gen_id: int, status: str, error: Optional[str] = None) -> None:
+    publish_event(gen_id, {"type": "status", "status": status, "error": error})
+
+
+def latents_preview(latents, index: int, size: int = 64) -> Optional[str]:
+    """Base64 PNG preview of one latent in a batch, via the linear RGB approximation."""
+    try:
+        import torch
+        from PIL import Image
+    except Exception:
+        return None
+    with torch.no_grad():
+        lat = latents[index].float().cpu()
+        factors = torch.tensor(_LATENT_RGB_FACTORS, dtype=lat.dtype)
+        rgb = torch.einsum("chw,cr->hwr", lat, factors)
+        rgb = ((rgb + 1.0) * 127.5).clamp(0, 255).to(torch.uint8).numpy()
+    img = Image.fromarray(rgb)
+    img.thumbnail((size, size))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def step_callback(gen_ids: List[int], total_steps: int):
+    """Build a diffusers ``callback_on_step_end`` publishing progress for each row in a batch."""
+    settings = get_settings()
+    preview_every = settings.EVENTS_PREVIEW_EVERY
+
+    def callback(pipe, step: int, timestep, callback_kwargs: Dict):
+        done = step + 1
+        latents = callback_kwargs.get("latents")
+        with_preview = preview_every > 0 and latents is not None and (done % preview_every == 0)
+        for i, gen_id in enumerate(gen_ids):
+            event = {"type": "progress", "step": done, "total_steps": total_steps}
+            if with_preview:
+                event["preview"] = latents_preview(latents, i)
+            publish_event(gen_id, event)
+        return callback_kwargs
+
+    return callback
+
+
+def _sse(event: Dict) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event)}\n\n"
+
+
+def _is_final(event: Dict) -> bool:
+    return event.get("type") == "status" and event.get("status") in FINAL_STATUSES
+
+
+async def sse_stream(gen_id: int, snapshot: Dict):
+    """Server-Sent Events for one generation until it reaches a final status.
+
+    ``snapshot`` is the row's current DB state, used when nothing has been
+    published yet (or events have expired).
+    """
+    if _is_final(snapshot):
+        yield _sse(snapshot)
+        return
+
+    import redis.asyncio as aioredis
+
+    settings = get_settings()
+    client = aioredis.from_url(settings.EVENTS_REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the last event so nothing published in between is lost
+        await pubsub.subscribe(channel_name(gen_id))
+        last = await client.get(last_event_key(gen_id))
+        event = json.loads(last) if last else snapshot
+        yield _sse(event)
+        if _is_final(event):
+            return
+        while True:
+            msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=settings.EVENTS_HEARTBEAT_SECONDS)
+            if msg is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = json.loads(msg["data"])
+            yield _sse(event)
+            if _is_final(event):
+                return
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
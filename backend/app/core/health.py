@@ -0,0 +1,93 @@
+from __future__ import annotations
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from ..config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+
+
+def _client():
+    """Redis holding worker heartbeats, or None when ``WORKER_HEARTBEAT_REDIS_URL`` is unset."""
+    global _redis
+    url = get_settings().WORKER_HEARTBEAT_REDIS_URL
+    if not url:
+        return None
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis
+
+
+def residency_key(worker: str) -> str:
+    return f"worker:residency:{worker}"
+
+
+def publish_residency(worker: str, models: List[str]) -> None:
+    """Worker heartbeat: the models this process holds, expiring unless refreshed."""
+    settings = get_settings()
+    client = _client()
+    if client is None:
+        return
+    try:
+        client.set(residency_key(worker), json.dumps(models), ex=settings.WORKER_HEARTBEAT_SECONDS * 3)
+    except Exception:
+        logger.debug("could not publish residency of %s", worker, exc_info=True)
+
+
+def worker_models() -> Optional[Dict[str, int]]:
+    """Model name -> number of live worker processes holding it; None without a heartbeat store."""
+    client = _client()
+    if client is None:
+        return None
+    counts: Dict[str, int] = {}
+    keys = list(client.scan_iter("worker:residency:*"))
+    for raw in client.mget(keys) if keys else []:
+        for name in json.loads(raw or "[]"):
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def check_broker() -> None:
+    from ..workers.celery_app import celery_app
+
+    with celery_app.connection_for_write() as conn:
+        conn.ensure_connection(max_retries=1, interval_start=0, timeout=2)
+
+
+async def readiness(db) -> Tuple[bool, Dict[str, object]]:
+    """Check the database, the broker and, for ``READY_MODELS``, worker model residency."""
+    from fastapi.concurrency import run_in_threadpool
+
+    checks: Dict[str, object] = {}
+    ok = True
+    try:
+        await db.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        ok, checks["database"] = False, f"error: {e}"
+    try:
+        await run_in_threadpool(check_broker)
+        checks["broker"] = "ok"
+    except Exception as e:
+        ok, checks["broker"] = False, f"error: {e}"
+    required = [m.strip() for m in get_settings().READY_MODELS.split(",") if m.strip()]
+    if required:
+        try:
+            held = await run_in_threadpool(worker_models)
+        except Exception as e:
+            ok, checks["models"] = False, f"error: {e}"
+        else:
+            if held is None:
+                checks["models"] = "skipped: WORKER_HEARTBEAT_REDIS_URL is not set"
+            else:
+                checks["models"] = {name: held.get(name, 0) for name in required}
+                ok = ok and all(held.get(name) for name in required)
+    return ok, checks
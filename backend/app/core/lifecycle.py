@@ -0,0 +1,228 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import Generation
+from .admission import admin_ids_stmt, admission, in_flight_counts_stmt
+from .events import publish_status
+from .metrics import JOBS_FINISHED, observe_queue_wait
+
+# queued -> running -> completed|flagged|failed, plus moderation moves between
+# the final states. blocked is reachable from anywhere but running, so a
+# moderator can stop a job before a worker claims it. running -> running is a
+# redelivered message taking over from its own lost worker; running -> queued is the reaper.
+TRANSITIONS = {
+    "queued": {"running", "failed", "blocked"},
+    "running": {"running", "queued", "completed", "flagged", "failed"},
+    "completed": {"flagged", "blocked"},
+    "flagged": {"completed", "blocked"},
+    "blocked": {"completed", "flagged"},
+    "failed": set(),
+}
+STATUSES = tuple(TRANSITIONS)
+
+WORKER_LOST = "worker lost too many times"
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def check_transition(src: str, dst: str) -> None:
+    if dst not in TRANSITIONS.get(src, ()):
+        raise InvalidTransition(f"generation cannot go from {src!r} to {dst!r}")
+
+
+def transition_stmt(gen_ids: Optional[Iterable[int]], src: Iterable[str], dst: str, **values):
+    """Compare-and-set ``UPDATE``: only rows still in one of ``src`` move to ``dst``.
+
+    ``gen_ids=None`` matches every row in ``src``; narrow it with ``.where()``.
+    """
+    src = list(src)
+    for s in src:
+        check_transition(s, dst)
+    stmt = update(Generation).where(Generation.status.in_(src))
+    if gen_ids is not None:
+        stmt = stmt.where(Generation.id.in_(list(gen_ids)))
+    return stmt.values(status=dst, **values).execution_options(synchronize_session=False)
+
+
+def claim_stmt(gen_ids: Iterable[int], task_id: Optional[str] = None, resume: bool = False):
+    """queued -> running, counting the attempt and recording ``task_id`` as the holder.
+
+    ``resume`` (a redelivered message: the worker that held it is gone) also
+    takes over running rows, but only those this same message claimed. A row
+    the reaper requeued and a fresh message claimed is left to that live
+    worker. Rows out of attempts are skipped.
+    """
+    stmt = transition_stmt(
+        gen_ids, ["queued", "running"] if resume else ["queued"], "running",
+        error=None, attempts=Generation.attempts + 1, claimed_by=task_id,
+    ).where(Generation.attempts < get_settings().JOB_MAX_ATTEMPTS)
+    if resume:
+        stmt = stmt.where(or_(Generation.status == "queued", Generation.claimed_by == task_id))
+    return stmt
+
+
+def values_stmt(gen_id: int, **values):
+    """``UPDATE`` of non-status columns, whatever the row's status."""
+    return (
+        update(Generation)
+        .where(Generation.id == gen_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Moderator actions and the status each moves a row to
+REVIEW_STATUSES = {"allow": "completed", "flag": "flagged", "block": "blocked"}
+
+
+def review_stmts(gen_ids: Iterable[int], action: str, **values):
+    """A moderator verdict as two UPDATEs: a compare-and-set into the action's status,
+    and a values-only update of rows already in it.
+
+    ``allow`` and ``flag`` judge an output, so rows without one are not matched;
+    ``block`` also stops a queued job before a worker claims it. Running rows
+    (their worker's final write would race the review) and failed rows match
+    neither statement and are left as they are.
+    """
+    gen_ids = list(gen_ids)
+    dst = REVIEW_STATUSES[action]
+    src = [s for s, targets in TRANSITIONS.items() if dst in targets and s != "running"]
+    values = {"nsfw_action": action, **values}
+    move = transition_stmt(gen_ids, src, dst, **values)
+    keep = (
+        update(Generation)
+        .where(Generation.id.in_(gen_ids), Generation.status == dst)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if action != "block":
+        move = move.where(Generation.output_path.is_not(None))
+        keep = keep.where(Generation.output_path.is_not(None))
+    return move, keep
+
+
+@dataclass
+class Outcome:
+    """Everything a finished job writes, applied in one statement."""
+
+    gen_id: int
+    status: str
+    values: Dict[str, Any] = field(default_factory=dict)
+
+
+def claim(session: Session, gen_id: int, task_id: Optional[str] = None, resume: bool = False) -> bool:
+    """Claim a row for the delivery ``task_id``. False when another worker (or a moderator)
+    got there first, or, for a redelivered message still holding the row, when it is out
+    of attempts (the row is then failed)."""
+    stmt = claim_stmt([gen_id], task_id, resume).returning(Generation.type, Generation.created_at)
+    claimed = session.execute(stmt).first()
+    if claimed is None:
+        session.rollback()
+        if resume:
+            fail(session, [gen_id], WORKER_LOST, claimed_by=task_id)
+        return False
+    session.commit()
+    observe_queue_wait([claimed])
+    publish_status(gen_id, "running")
+    return True
+
+
+def _limited_owners(session: Session, owners: List[int]) -> List[int]:
+    """``owners`` minus admins, whose jobs were never admitted and hold no slot."""
+    if not owners:
+        return owners
+    admins = set(session.scalars(admin_ids_stmt(owners)))
+    return [u for u in owners if u not in admins]
+
+
+def finish(session: Session, outcomes: List[Outcome]) -> None:
+    """Write final results for running rows in a single transaction.
+
+    A row no longer ``running`` was moved by someone else; its outputs are
+    still recorded but its status is left alone.
+    """
+    published = []
+    owners = []
+    for outcome in outcomes:
+        stmt = transition_stmt([outcome.gen_id], ["running"], outcome.status, **outcome.values)
+        owner = session.scalar(stmt.returning(Generation.user_id))
+        if owner is not None:
+            published.append(outcome)
+            owners.append(owner)
+        elif outcome.values:
+            session.execute(values_stmt(outcome.gen_id, **outcome.values))
+    owners = _limited_owners(session, owners)
+    session.commit()
+    admission.release(owners)
+    for outcome in published:
+        JOBS_FINISHED.labels(status=outcome.status).inc()
+        publish_status(outcome.gen_id, outcome.status, outcome.values.get("error"))
+
+
+def fail(session: Session, gen_ids: Iterable[int], error: Optional[str], claimed_by: Optional[str] = None) -> None:
+    """Mark running rows failed, discarding anything the job had not committed.
+
+    ``claimed_by`` limits this to rows held by that delivery.
+    """
+    gen_ids = list(gen_ids)
+    session.rollback()
+    stmt = transition_stmt(gen_ids, ["running"], "failed", error=error)
+    if claimed_by is not None:
+        stmt = stmt.where(Generation.claimed_by == claimed_by)
+    stmt = stmt.returning(Generation.id, Generation.user_id)
+    failed = session.execute(stmt).all()
+    owners = _limited_owners(session, [row.user_id for row in failed])
+    session.commit()
+    admission.release(owners)
+    JOBS_FINISHED.labels(status="failed").inc(len(failed))
+    for row in failed:
+        publish_status(row.id, "failed", error)
+
+
+def reap(session: Session) -> List[int]:
+    """Recover jobs whose worker or broker message was lost; returns ids to enqueue again.
+
+    Running rows untouched for longer than the task time limit go back to
+    queued, or to failed once out of attempts. Queued rows waiting longer than
+    ``JOB_QUEUED_TIMEOUT_SECONDS`` are re-enqueued; a duplicate message is
+    harmless since only one claim can succeed.
+    """
+    settings = get_settings()
+    now = datetime.utcnow()
+    # Grace on top of the time limit: the killed worker's own failure write may still land
+    stale = now - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS + 60)
+    waiting = now - timedelta(seconds=settings.JOB_QUEUED_TIMEOUT_SECONDS)
+
+    def ids(stmt) -> List[int]:
+        return session.scalars(stmt.returning(Generation.id)).all()
+
+    failed = session.execute(
+        transition_stmt(None, ["running"], "failed", error=WORKER_LOST)
+        .where(Generation.updated_at < stale, Generation.attempts >= settings.JOB_MAX_ATTEMPTS)
+        .returning(Generation.id, Generation.user_id)
+    ).all()
+    requeued = ids(transition_stmt(None, ["running"], "queued").where(Generation.updated_at < stale))
+    # Touch updated_at so the next pass does not enqueue them again
+    lost = ids(
+        update(Generation)
+        .where(Generation.status == "queued", Generation.updated_at < waiting)
+        .values(updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    # Counters drift when a release is lost (crashed worker, moderator blocks); reset them from the rows
+    admission.reconcile(session.execute(in_flight_counts_stmt()).all())
+    JOBS_FINISHED.labels(status="failed").inc(len(failed))
+    for gen_id, _ in failed:
+        publish_status(gen_id, "failed", WORKER_LOST)
+    for gen_id in requeued:
+        publish_status(gen_id, "queued")
+    return requeued + lost
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import contextlib
+import os
+import time
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Prefork Celery workers and multi-process uvicorn need PROMETHEUS_MULTIPROC_DIR set
+# (an empty directory per host, wiped at start) so every child's samples are exported.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+_LONG = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_SHORT = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency by route template",
+    ["method", "route", "status"], buckets=_SHORT,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "generation_queue_wait_seconds", "Time from submission to a worker claiming the job",
+    ["type"], buckets=_LONG,
+)
+MODEL_LOAD_SECONDS = Histogram("model_load_seconds", "Model load time", ["model"], buckets=_LONG)
+INFERENCE_SECONDS = Histogram("inference_seconds", "Model inference time per call", ["task"], buckets=_LONG)
+INFERENCE_STEP_SECONDS = Histogram(
+    "inference_step_seconds", "Inference time divided by denoising steps", ["task"], buckets=_SHORT,
+)
+STAGE_SECONDS = Histogram(
+    "generation_stage_seconds", "Post-inference stages: moderation, encode, derivatives, store",
+    ["stage"], buckets=_SHORT + (30, 60, 300),
+)
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "Session flush + commit latency", buckets=_SHORT)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+JOBS_FINISHED = Counter("generation_jobs_finished_total", "Jobs reaching a final status", ["status"])
+TASK_SECONDS = Histogram("celery_task_seconds", "Celery task run time", ["task", "state"], buckets=_LONG)
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Submissions refused with 429", ["reason"])
+
+
+@contextlib.contextmanager
+def timed(histogram: Histogram, **labels) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def timed_inference(task: str, steps: Optional[int] = None) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    INFERENCE_SECONDS.labels(task=task).observe(elapsed)
+    if steps:
+        INFERENCE_STEP_SECONDS.labels(task=task).observe(elapsed / steps)
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def observe_queue_wait(rows: Iterable[Tuple[str, datetime]]) -> None:
+    """``(type, created_at)`` of freshly claimed rows; ``created_at`` is naive UTC."""
+    now = datetime.utcnow()
+    for gen_type, created_at in rows:
+        QUEUE_WAIT_SECONDS.labels(type=gen_type).observe(max(0.0, (now - created_at).total_seconds()))
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing each request, labelled by route template rather than raw path."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set by the router once a route matched; streamed responses count until their last byte
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(method=scope["method"], route=route, status=str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        from prometheus_client import REGISTRY
+
+        return REGISTRY
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+
+def render() -> Tuple[bytes, str]:
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+# Commit latency for every session, sync (workers) and async (API; events fire on its sync session)
+@event.listens_for(Session, "before_commit")
+def _commit_started(session) -> None:
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session) -> None:
+    start = session.info.pop("commit_started", None)
+    if start is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
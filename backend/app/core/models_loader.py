@@ -1,67 +1,358 @@
 from __future__ import annotations
+import gc
 import os
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
 
-from .nsfw_pipeline import NSFWSmartClassifier
+from .metrics import MODEL_LOAD_SECONDS, cache_lookup, timed
+from .nsfw_pipeline import NSFWSmartClassifier, OnnxImageDetector
 from ..config import get_settings
 
 
+MODEL_NAMES = ("txt2img", "img2img", "upscaler", "img2video", "nsfw")
+
+
+class ModelKey(NamedTuple):
+    kind: str  # txt2img|img2img|upscaler|img2video
+    model_id: str
+    dtype: str
+    device: str
+
+
+@dataclass
+class ModelResidency:
+    status: str = "unloaded"  # unloaded|loading|loaded|failed|unavailable
+    load_time_s: Optional[float] = None
+    loaded_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _CacheEntry:
+    model: object
+    nbytes: int
+    parent: Optional[ModelKey] = None
+
+
+def _torch_device() -> str:
+    try:
+        import torch
+    except Exception:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _dtype_name(device: str) -> str:
+    dtype = get_settings().MODEL_DTYPE
+    if dtype == "auto":
+        return "float16" if device == "cuda" else "float32"
+    return dtype
+
+
+def _tensor_sizes(model) -> Dict[int, int]:
+    """Map storage pointer -> bytes for every parameter/buffer reachable from a model or pipeline."""
+    modules = getattr(model, "components", None)
+    if not isinstance(modules, dict):
+        modules = {"model": getattr(model, "model", model)}
+    sizes: Dict[int, int] = {}
+    for module in modules.values():
+        if not hasattr(module, "parameters") or not hasattr(module, "buffers"):
+            continue
+        for t in (*module.parameters(), *module.buffers()):
+            sizes[t.data_ptr()] = t.numel() * t.element_size()
+    return sizes
+
+
+def style_model_ids() -> Dict[str, str]:
+    raw = get_settings().SD_STYLE_MODELS
+    pairs = (item.split("=", 1) for item in raw.split(",") if "=" in item)
+    return {style.strip(): model_id.strip() for style, model_id in pairs}
+
+
+class ModelCache:
+    """LRU cache of loaded models keyed by (kind, model id, dtype, device) under a byte budget.
+
+    Entries built from another entry's components (e.g. img2img sharing the
+    txt2img UNet/VAE/text encoder) record it as ``parent``; only tensors they
+    do not share are charged to them, and evicting a parent evicts its
+    dependents since the shared weights are not freed until both are gone.
+    """
+
+    def __init__(self, budget_bytes: int = 0, on_evict: Optional[Callable[[ModelKey], None]] = None):
+        self.budget_bytes = budget_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[ModelKey, _CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def __contains__(self, key: ModelKey) -> bool:
+        return key in self._entries
+
+    def peek(self, key: ModelKey):
+        entry = self._entries.get(key)
+        return entry.model if entry else None
+
+    def get_or_load(self, key: ModelKey, loader: Callable[[], object], parent: Optional[ModelKey] = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            cache_lookup("model", entry is not None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.parent in self._entries:
+                    self._entries.move_to_end(entry.parent)
+                    self._entries.move_to_end(key)
+                return entry.model
+
+            with timed(MODEL_LOAD_SECONDS, model=key.kind):
+                model = loader()
+            if model is None:
+                return None
+            sizes = _tensor_sizes(model)
+            if parent is not None and parent in self._entries:
+                shared = _tensor_sizes(self._entries[parent].model)
+                nbytes = sum(n for ptr, n in sizes.items() if ptr not in shared)
+            else:
+                parent = None
+                nbytes = sum(sizes.values())
+            self._entries[key] = _CacheEntry(model=model, nbytes=nbytes, parent=parent)
+            self._evict_over_budget(protect={key, parent})
+            return model
+
+    def _evict_over_budget(self, protect: set) -> None:
+        if self.budget_bytes <= 0:
+            return
+        while self.total_bytes > self.budget_bytes:
+            victim = next((k for k in self._entries if k not in protect), None)
+            if victim is None:
+                break
+            self.evict(victim)
+
+    def evict(self, key: ModelKey) -> None:
+        with self._lock:
+            if key not in self._entries:
+                return
+            dependents = [k for k, e in self._entries.items() if e.parent == key]
+            for dep in dependents:
+                self.evict(dep)
+            del self._entries[key]
+            if self.on_evict:
+                self.on_evict(key)
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+
+    def stats(self) -> List[dict]:
+        return [
+            {**key._asdict(), "bytes": entry.nbytes, "parent": entry.parent.kind if entry.parent else None}
+            for key, entry in self._entries.items()
+        ]
+
+
 class ModelRegistry:
     def __init__(self):
-        self._loaded = False
-        self.sd_pipeline = None
-        self.img2img_pipeline = None
-        self.upscaler = None
-        self.video_model = None
+        self._lock = threading.RLock()
+        self._residency: Dict[str, ModelResidency] = {name: ModelResidency() for name in MODEL_NAMES}
+        self.cache = ModelCache(get_settings().MODEL_CACHE_BUDGET_MB * 1024 * 1024, on_evict=self._on_evict)
         self.nsfw = None
 
-    def load_all(self):
-        if self._loaded:
-            return self
+    def _key(self, kind: str, model_id: str) -> ModelKey:
+        device = _torch_device()
+        return ModelKey(kind, model_id, _dtype_name(device), device)
+
+    def _default_key(self, name: str) -> Optional[ModelKey]:
         settings = get_settings()
+        if name in ("txt2img", "img2img"):
+            return self._key(name, settings.SD_MODEL_ID)
+        if name == "upscaler":
+            return self._key(name, settings.REAL_ESRGAN_MODEL)
+        if name == "img2video":
+            return self._key(name, settings.STABLE_VIDEO_MODEL_ID)
+        return None
 
-        # Lazy imports to avoid heavy startup
-        try:
-            from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline
-            import torch
-        except Exception:
-            StableDiffusionPipeline = None
-            StableDiffusionImg2ImgPipeline = None
-            torch = None
+    def _on_evict(self, key: ModelKey) -> None:
+        for name in MODEL_NAMES:
+            if self._default_key(name) == key:
+                self._residency[name] = ModelResidency()
 
-        try:
-            from realesrgan import RealESRGAN
-        except Exception:
-            RealESRGAN = None
-
-        # Load SD pipelines if available
-        if StableDiffusionPipeline:
-            device = "cuda" if torch and torch.cuda.is_available() else "cpu"
-            self.sd_pipeline = StableDiffusionPipeline.from_pretrained(settings.SD_MODEL_ID)
-            self.sd_pipeline = self.sd_pipeline.to(device)
-            if StableDiffusionImg2ImgPipeline:
-                self.img2img_pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(settings.SD_INPAINT_MODEL_ID)
-                self.img2img_pipeline = self.img2img_pipeline.to(device)
-
-        # Load Real-ESRGAN if available
-        if RealESRGAN:
+    def model_id_for_style(self, style: Optional[str]) -> str:
+        return style_model_ids().get(style or "", get_settings().SD_MODEL_ID)
+
+    # Cached accessors return the model, or None when its optional dependency is missing
+
+    def get_txt2img(self, model_id: Optional[str] = None):
+        model_id = model_id or get_settings().SD_MODEL_ID
+        key = self._key("txt2img", model_id)
+
+        def load():
+            try:
+                from diffusers import StableDiffusionPipeline
+                import torch
+            except Exception:
+                return None
+            pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=getattr(torch, key.dtype))
+            return pipe.to(key.device)
+
+        return self.cache.get_or_load(key, load)
+
+    def get_img2img(self, model_id: Optional[str] = None):
+        model_id = model_id or get_settings().SD_MODEL_ID
+        key = self._key("img2img", model_id)
+
+        def load():
+            try:
+                from diffusers import StableDiffusionImg2ImgPipeline
+            except Exception:
+                return None
+            base = self.get_txt2img(model_id)
+            if base is None:
+                return None
+            # Reuse the resident UNet/VAE/text encoder instead of loading a second copy
+            return StableDiffusionImg2ImgPipeline(**base.components)
+
+        return self.cache.get_or_load(key, load, parent=self._key("txt2img", model_id))
+
+    def get_upscaler(self):
+        key = self._default_key("upscaler")
+
+        def load():
+            try:
+                from realesrgan import RealESRGAN
+            except Exception:
+                return None
+            try:
+                upscaler = RealESRGAN(key.device, scale=4)
+                upscaler.load_weights(os.path.join(get_settings().MODELS_DIR, "realesrgan", "weights.pth"))
+            except Exception:
+                # Missing/placeholder weights: tasks fall back to copying the source
+                return None
+            return upscaler
+
+        return self.cache.get_or_load(key, load)
+
+    def get_img2video(self):
+        """Stable Video Diffusion; frames feed ``core.video.PipelineFrameSource``."""
+        key = self._default_key("img2video")
+
+        def load():
             try:
-                from PIL import Image
+                from diffusers import StableVideoDiffusionPipeline
                 import torch
-                device = "cuda" if torch and torch.cuda.is_available() else "cpu"
-                self.upscaler = RealESRGAN(device, scale=4)
-                self.upscaler.load_weights(os.path.join(get_settings().MODELS_DIR, "realesrgan", "weights.pth"))
             except Exception:
-                self.upscaler = None
+                return None
+            pipe = StableVideoDiffusionPipeline.from_pretrained(key.model_id, torch_dtype=getattr(torch, key.dtype))
+            return pipe.to(key.device)
+
+        return self.cache.get_or_load(key, load)
+
+    # Default models, only if currently resident
+
+    @property
+    def sd_pipeline(self):
+        return self.cache.peek(self._default_key("txt2img"))
+
+    @property
+    def img2img_pipeline(self):
+        return self.cache.peek(self._default_key("img2img"))
+
+    @property
+    def upscaler(self):
+        return self.cache.peek(self._default_key("upscaler"))
 
-        # Load video model placeholder (actual loading implemented in worker)
-        self.video_model = None
+    @property
+    def img2video_pipeline(self):
+        return self.cache.peek(self._default_key("img2video"))
 
-        # NSFW smart classifier
-        self.nsfw = NSFWSmartClassifier()
+    def _load_txt2img(self):
+        return self.get_txt2img()
 
-        self._loaded = True
+    def _load_img2img(self):
+        return self.get_img2img()
+
+    def _load_upscaler(self):
+        return self.get_upscaler()
+
+    def _load_img2video(self):
+        return self.get_img2video()
+
+    def _load_nsfw(self):
+        with timed(MODEL_LOAD_SECONDS, model="nsfw"):
+            self.nsfw = NSFWSmartClassifier(image_detector=OnnxImageDetector.from_settings())
+        return self.nsfw
+
+    def ensure(self, *names: str) -> "ModelRegistry":
+        """Load the named default models if they are not resident yet. Idempotent and thread-safe."""
+        for name in names:
+            if self._residency[name].status in ("loaded", "unavailable"):
+                continue
+            with self._lock:
+                state = self._residency[name]
+                if state.status in ("loaded", "unavailable"):
+                    continue
+                state.status = "loading"
+                state.error = None
+                start = time.perf_counter()
+                try:
+                    model = getattr(self, f"_load_{name}")()
+                except Exception as e:
+                    state.status = "failed"
+                    state.error = str(e)
+                    raise
+                state.load_time_s = time.perf_counter() - start
+                state.loaded_at = time.time()
+                state.status = "loaded" if model is not None else "unavailable"
         return self
 
+    def load_all(self) -> "ModelRegistry":
+        return self.ensure(*MODEL_NAMES)
+
+    def is_loaded(self, name: str) -> bool:
+        return self._residency[name].status in ("loaded", "unavailable")
+
+    def residency(self) -> Dict[str, dict]:
+        out = {}
+        for name, state in self._residency.items():
+            info = asdict(state)
+            key = self._default_key(name)
+            if state.status == "unloaded" and key is not None and key in self.cache:
+                # Loaded on demand by a task rather than through ensure()
+                info["status"] = "loaded"
+            out[name] = info
+        out["cache"] = {"budget_bytes": self.cache.budget_bytes, "total_bytes": self.cache.total_bytes,
+                        "entries": self.cache.stats()}
+        return out
+
+    def warm_up(self, names: Iterable[str]) -> None:
+        """Run one tiny inference per resident model so kernels/allocators are initialised."""
+        from PIL import Image
+
+        names = set(names)
+        if "txt2img" in names and self.sd_pipeline is not None:
+            self.sd_pipeline(prompt="warm-up", num_inference_steps=1, width=64, height=64)
+        if "img2img" in names and self.img2img_pipeline is not None:
+            self.img2img_pipeline(
+                prompt="warm-up", image=Image.new("RGB", (64, 64)), strength=0.5, num_inference_steps=2
+            )
+        if "upscaler" in names and self.upscaler is not None:
+            self.upscaler.predict(Image.new("RGB", (16, 16)))
+        if "img2video" in names and self.img2video_pipeline is not None:
+            self.img2video_pipeline(
+                Image.new("RGB", (64, 64)), height=64, width=64, num_frames=2, num_inference_steps=1, decode_chunk_size=1
+            )
+        if "nsfw" in names and self.nsfw is not None:
+            self.nsfw.classify_prompt("warm-up")
+            if self.nsfw.image_detector is not None:
+                self.nsfw.classify_image(Image.new("RGB", (64, 64)))
+
 
 registry = ModelRegistry()
@@ -1,50 +1,332 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+import json
+import logging
+import os
 import re
+import threading
+import time
 
+from ..config import get_settings
+
+
+logger = logging.getLogger(__name__)
 
 EXPLICIT_KEYWORDS = {
     "sex", "sexy", "nude", "naked", "pussy", "penis", "vagina", "boobs", "breasts",
-    "cum", "cumshot", "sperm", "semen", "anal", "fuck", "hardcore", "porn", "xxx",
+    "cum", "cumshot", "sperm", "semen", "anal", "fuck", "hardcore", "porn", "porno",
+    "pornography", "pornographic", "xxx",
     "fetish", "bondage", "bdsm", "slave", "rape", "tentacle", "fellatio", "blowjob",
     "handjob", "threesome", "orgy", "69", "hentai", "nsfw", "explicit",
 }
 SOFT_KEYWORDS = {"bikini", "lingerie", "cleavage", "seethrough", "underboob", "nipple"}
 FETISH_KEYWORDS = {"feet", "armpit", "pregnant", "macro", "giantess", "vore"}
 
+DEFAULT_KEYWORDS: Dict[str, Iterable[str]] = {
+    "explicit": EXPLICIT_KEYWORDS,
+    "soft": SOFT_KEYWORDS,
+    "fetish": FETISH_KEYWORDS,
+}
+
+
+@dataclass
+class KeywordMatch:
+    tag: str
+    keyword: str
+    start: int
+    end: int
+
 
 @dataclass
 class NSFWResult:
     action: str  # allow|flag|block
     tags: List[str]
+    matches: List[KeywordMatch] = field(default_factory=list)
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """Regex alternation shaped as a prefix trie, e.g. ``cum(?:shot)?``.
+
+    Python's ``re`` tries every branch of a flat alternation at each position;
+    a trie lets it reject a position after one character, so the cost stays
+    flat as keyword lists grow.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node: Dict) -> str:
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            return "(?:" + body + ")?" if len(alts) == 1 else body + "?"
+        return body
+
+    return emit(trie)
+
+
+# Endings a keyword may take and still match as a whole word ("fucking", "sexual", "nudity")
+INFLECTIONS = ("s", "es", "ing", "ed", "er", "ers", "y", "ual", "ic", "ity")
+_VOWELS = "aeiouy"
+
+
+def inflected_forms(keyword: str) -> List[str]:
+    """``keyword`` and its inflections; only the last word of a multi-word keyword is inflected.
+
+    A final silent "e" is dropped before a vowel ending ("rape" -> "raped",
+    "raping") and a final consonant after a single vowel may be doubled
+    ("cum" -> "cumming"). Forms that are not words are harmless: they never occur.
+    """
+    forms = [keyword]
+    if not keyword[-1:].isalpha():
+        return forms
+    for ending in INFLECTIONS:
+        if keyword.endswith("e") and ending[0] in _VOWELS:
+            forms.append(keyword[:-1] + ending)
+            continue
+        forms.append(keyword + ending)
+        cvc = len(keyword) >= 3 and keyword[-1] not in _VOWELS + "wx" and keyword[-2] in _VOWELS and keyword[-3] not in _VOWELS
+        if cvc and ending[0] in _VOWELS:
+            forms.append(keyword + keyword[-1] + ending)
+    return forms
+
+
+# ASCII characters outside \w mapped to spaces, so split() yields exactly the \w+ runs
+_ASCII_NON_WORD = str.maketrans({chr(c): " " for c in range(128) if not (chr(c).isalnum() or chr(c) == "_")})
+
+
+class CompiledKeywords:
+    """All tags' keywords, with their inflections, compiled into one whole-word regex.
+
+    Scanning a prompt is a single pass regardless of how many keywords there
+    are, and "cum" no longer matches inside "document" nor "69" inside "1969".
+    When every keyword is a single word, ASCII prompts are first checked with
+    a set lookup over their words, so the regex only runs to extract spans
+    when something actually matches.
+    """
+
+    def __init__(self, keywords: Dict[str, Iterable[str]]) -> None:
+        self.tags: Dict[str, str] = {}
+        for tag, words in keywords.items():
+            for w in words:
+                if w:
+                    self.tags.setdefault(w.lower(), tag)
+        # Matched form -> keyword; a keyword itself wins over another's inflection
+        self.forms: Dict[str, str] = {w: w for w in self.tags}
+        for w in self.tags:
+            for form in inflected_forms(w):
+                self.forms.setdefault(form, w)
+        if self.forms:
+            source = r"\b(" + _trie_regex(self.forms) + r")\b"
+        else:
+            source = r"(?!x)x"  # never matches
+        # Multi-word or hyphenated keywords ("see-through") span several split() words
+        if all(re.fullmatch(r"\w+", w) for w in self.forms):
+            self.words = frozenset(self.forms)
+        else:
+            self.words = None
+        self.pattern = re.compile(source)
+        # Only for text whose length changes when lower-cased (spans would drift)
+        self.pattern_ci = re.compile(source, re.IGNORECASE)
+
+    def find(self, text: str) -> List[KeywordMatch]:
+        lower = text.lower()
+        if self.words is not None and lower.isascii() and self.words.isdisjoint(lower.translate(_ASCII_NON_WORD).split()):
+            return []
+        if len(lower) == len(text):
+            found = self.pattern.finditer(lower)
+        else:
+            found = self.pattern_ci.finditer(text)
+        matches = []
+        for m in found:
+            keyword = self.forms[m.group(1).lower()]
+            matches.append(KeywordMatch(tag=self.tags[keyword], keyword=keyword, start=m.start(), end=m.end()))
+        return matches
+
+
+# Built once at import; matchers without a keywords file share it
+DEFAULT_COMPILED = CompiledKeywords(DEFAULT_KEYWORDS)
+
+
+class KeywordMatcher:
+    """Compiled prompt matcher, optionally hot-reloaded from a JSON file.
+
+    The file maps tags to keyword lists, e.g. ``{"explicit": [...], "soft": [...]}``;
+    it is re-read when its mtime changes, checked at most every ``check_interval_s``.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval_s: float = 5.0) -> None:
+        self.path = path
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.compiled = DEFAULT_COMPILED
+        self.maybe_reload()
+
+    def maybe_reload(self) -> bool:
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            self._next_check = now + self.check_interval_s
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            # Recorded even on failure: a broken file is reported once, not every interval
+            self._mtime = mtime
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.compiled = CompiledKeywords(json.load(f))
+            except Exception:
+                logger.exception("could not load NSFW keywords from %s; keeping the previous list", self.path)
+                return False
+            return True
+
+    def find(self, text: str) -> List[KeywordMatch]:
+        self.maybe_reload()
+        return self.compiled.find(text)
+
+
+_default_matcher: Optional[KeywordMatcher] = None
+
+
+def default_matcher() -> KeywordMatcher:
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = KeywordMatcher(get_settings().NSFW_KEYWORDS_FILE or None)
+    return _default_matcher
+
+
+def prepare_image(image, size: int):
+    """Downscale a PIL image or HxWxC uint8 array to ``size`` x ``size`` RGB cheaply.
+
+    Large images are first shrunk by an integer factor with ``Image.reduce``
+    (box filter over whole pixel blocks, much cheaper than a full resample),
+    then resized to the exact model input.
+    """
+    from PIL import Image
+
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    factor = min(image.width, image.height) // size
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize((size, size), Image.BILINEAR)
+
+
+class OnnxImageDetector:
+    """NSFW image classifier running an ONNX model on ONNX Runtime's CPU provider.
+
+    The model takes a batch of ``input_size`` square RGB images (NCHW or NHWC,
+    detected from its input shape) and returns one probability per label.
+    Labels are mapped to our tags (explicit/soft); everything else is ignored.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        labels: List[str],
+        label_tags: Dict[str, str],
+        threshold: float = 0.6,
+        input_size: int = 224,
+        threads: int = 0,
+    ) -> None:
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        shape = self.session.get_inputs()[0].shape
+        self.channels_first = len(shape) == 4 and shape[1] == 3
+        self.labels = labels
+        self.label_tags = label_tags
+        self.threshold = threshold
+        self.input_size = input_size
+
+    @classmethod
+    def from_settings(cls) -> Optional["OnnxImageDetector"]:
+        settings = get_settings()
+        path = settings.NSFW_IMAGE_MODEL_PATH
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            import onnxruntime  # noqa: F401
+        except Exception:
+            return None
+        label_tags = dict(item.split("=", 1) for item in settings.NSFW_IMAGE_LABEL_TAGS.split(",") if "=" in item)
+        return cls(
+            model_path=path,
+            labels=[l.strip() for l in settings.NSFW_IMAGE_LABELS.split(",") if l.strip()],
+            label_tags=label_tags,
+            threshold=settings.NSFW_IMAGE_THRESHOLD,
+            input_size=settings.NSFW_IMAGE_INPUT_SIZE,
+            threads=settings.NSFW_IMAGE_THREADS,
+        )
+
+    def _batch(self, images: List):
+        import numpy as np
+
+        arr = np.stack([np.asarray(prepare_image(img, self.input_size), dtype=np.float32) for img in images])
+        arr /= 255.0
+        if self.channels_first:
+            arr = arr.transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(arr)
+
+    def predict(self, images: List) -> List[Dict[str, float]]:
+        if not images:
+            return []
+        scores = self.session.run(None, {self.input_name: self._batch(images)})[0]
+        return [dict(zip(self.labels, (float(x) for x in row))) for row in scores]
+
+    def classify(self, images: List) -> List[NSFWResult]:
+        results = []
+        for scores in self.predict(images):
+            tags = sorted({
+                self.label_tags[label]
+                for label, score in scores.items()
+                if label in self.label_tags and score >= self.threshold
+            })
+            results.append(NSFWResult(action="flag" if "explicit" in tags else "allow", tags=tags))
+        return results
 
 
 class NSFWSmartClassifier:
-    def __init__(self) -> None:
-        # Placeholders for possible ML-based safety/nudity detectors
-        # In a production setup, integrate multiple detectors and fuse with prompt heuristics
-        pass
+    def __init__(self, matcher: Optional[KeywordMatcher] = None, image_detector: Optional[OnnxImageDetector] = None) -> None:
+        # Prompt heuristics always run; the image detector is optional (no model file -> filename heuristic)
+        self.matcher = matcher or default_matcher()
+        self.image_detector = image_detector
 
     def classify_prompt(self, prompt: str) -> NSFWResult:
-        lower = prompt.lower()
-        tags: List[str] = []
-        explicit = any(k in lower for k in EXPLICIT_KEYWORDS)
-        soft = any(k in lower for k in SOFT_KEYWORDS)
-        fetish = any(k in lower for k in FETISH_KEYWORDS)
-        if explicit:
-            tags.append("explicit")
-        if soft:
-            tags.append("soft")
-        if fetish:
-            tags.append("fetish")
+        matches = self.matcher.find(prompt)
+        found = {m.tag for m in matches}
+        tags: List[str] = [t for t in ("explicit", "soft", "fetish") if t in found]
+        tags += sorted(found - set(tags))
         # Never auto-block purely from prompt; enable admin-in-loop
-        action = "flag" if explicit or fetish else "allow"
-        return NSFWResult(action=action, tags=tags)
+        action = "flag" if "explicit" in found or "fetish" in found else "allow"
+        return NSFWResult(action=action, tags=tags, matches=matches)
+
+    def classify_prompts(self, prompts: List[str]) -> List[NSFWResult]:
+        return [self.classify_prompt(p) for p in prompts]
 
-    def classify_image(self, image_path: str) -> NSFWResult:
-        # Placeholder: Implement real detectors (e.g., OpenAI safety checker replacement, nude-detector)
-        # For now, be permissive and only flag if filename hints explicit content
+    def _classify_path(self, image_path: str) -> NSFWResult:
+        # Fallback when no detector is configured or the file is not an image (e.g. video):
+        # be permissive and only flag if the filename hints explicit content
         lower = image_path.lower()
         tags: List[str] = []
         if any(k in lower for k in EXPLICIT_KEYWORDS):
@@ -55,3 +337,36 @@ class NSFWSmartClassifier:
             tags.append("fetish")
         action = "flag" if tags else "allow"
         return NSFWResult(action=action, tags=tags)
+
+    def classify_images(self, images: List) -> List[NSFWResult]:
+        """Classify PIL images, HxWxC arrays or file paths, running the detector once per batch."""
+        results: List[Optional[NSFWResult]] = [None] * len(images)
+        pending: List[int] = []
+        decoded: List = []
+        for i, image in enumerate(images):
+            if isinstance(image, str):
+                if self.image_detector is None:
+                    results[i] = self._classify_path(image)
+                    continue
+                try:
+                    from PIL import Image
+
+                    with Image.open(image) as im:
+                        # JPEG can decode straight at reduced scale
+                        im.draft("RGB", (self.image_detector.input_size * 2,) * 2)
+                        image = im.convert("RGB")
+                except Exception:
+                    results[i] = self._classify_path(images[i])
+                    continue
+            elif self.image_detector is None:
+                results[i] = NSFWResult(action="allow", tags=[])
+                continue
+            pending.append(i)
+            decoded.append(image)
+        if decoded:
+            for i, res in zip(pending, self.image_detector.classify(decoded)):
+                results[i] = res
+        return results
+
+    def classify_image(self, image) -> NSFWResult:
+        return self.classify_images([image])[0]
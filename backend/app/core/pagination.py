@@ -0,0 +1,46 @@
+from __future__ import annotations
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def after_cursor(created_col, id_col, cursor: Optional[str], descending: bool = False):
+    """WHERE clause selecting rows strictly past ``cursor`` in (created_at, id) order.
+
+    Spelled out as OR/AND rather than a row-value comparison so every backend
+    can drive it from a ``(..., created_at, id)`` index range scan.
+    """
+    if not cursor:
+        return None
+    created_at, row_id = decode_cursor(cursor)
+    if descending:
+        return or_(created_col < created_at, and_(created_col == created_at, id_col < row_id))
+    return or_(created_col > created_at, and_(created_col == created_at, id_col > row_id))
+
+
+def page(
+    rows: Sequence[Any], limit: int, key: Callable[[Any], Tuple[datetime, int]] = lambda row: (row.created_at, row.id)
+) -> Tuple[List[Any], Optional[str]]:
+    """Trim a ``limit + 1`` fetch to ``limit`` rows and build the next cursor from the last row's ``key``."""
+    items = list(rows[:limit])
+    if len(rows) <= limit or not items:
+        return items, None
+    return items, encode_cursor(*key(items[-1]))
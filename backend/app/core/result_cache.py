@@ -0,0 +1,158 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from ..config import get_settings
+from .metrics import cache_lookup
+from .storage import clone_file
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def result_cache_key(gen, model_id: str, source_digest: Optional[str] = None) -> Optional[str]:
+    """Canonical hash of everything that determines a generation's output.
+
+    Returns None when the output is not reproducible: diffusion jobs without a
+    seed, or jobs whose source file is missing. Pass ``source_digest`` when the
+    source was already read to avoid hashing it again.
+    """
+    if gen.type != "upscale" and gen.seed is None:
+        return None
+    if gen.source_path and source_digest is None:
+        if not os.path.exists(gen.source_path):
+            return None
+        source_digest = file_digest(gen.source_path)
+    fields = {
+        "type": gen.type,
+        "mode": gen.mode,
+        "prompt": gen.prompt,
+        "negative_prompt": gen.negative_prompt,
+        "seed": gen.seed,
+        "steps": gen.steps,
+        "width": gen.width,
+        "height": gen.height,
+        "style": gen.style,
+        "model_id": model_id,
+        "source": source_digest,
+    }
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed store of finished outputs under ``STORAGE_DIR/cache``.
+
+    Generation rows get a reflink/hardlink of the cached file, so evicting a cache
+    entry never breaks an existing row. Eviction is least-recently-used by
+    mtime, which is refreshed on every hit.
+    """
+
+    def __init__(self, root: str, max_bytes: int, enabled: bool = True):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "ResultCache":
+        settings = get_settings()
+        return cls(
+            root=os.path.join(settings.STORAGE_DIR, settings.RESULT_CACHE_DIR_NAME),
+            max_bytes=settings.RESULT_CACHE_MAX_MB * 1024 * 1024,
+            enabled=settings.RESULT_CACHE_ENABLED,
+        )
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def _entries(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st
+
+    def lookup(self, key: Optional[str], ext: str) -> Optional[str]:
+        if not self.enabled or key is None:
+            return None
+        path = self._path(key, ext)
+        if os.path.exists(path):
+            self.hits += 1
+            cache_lookup("result", True)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        self.misses += 1
+        cache_lookup("result", False)
+        return None
+
+    def fetch(self, key: Optional[str], ext: str, dst: str) -> bool:
+        """Materialise a cached result at ``dst``. Returns False on a miss."""
+        path = self.lookup(key, ext)
+        if path is None:
+            return False
+        try:
+            clone_file(path, dst)
+        except FileNotFoundError:
+            # Evicted by another worker between lookup and link
+            return False
+        return True
+
+    def store(self, key: Optional[str], src: str) -> None:
+        if not self.enabled or key is None or not os.path.exists(src):
+            return
+        path = self._path(key, os.path.splitext(src)[1])
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        clone_file(src, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(st.st_size for _, st in self._entries())
+            else:
+                self._total_bytes += os.path.getsize(path)
+            if self.max_bytes > 0 and self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Rescan: other worker processes share the directory
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, st in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= st.st_size
+        self._total_bytes = total
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache.from_settings()
@@ -0,0 +1,239 @@
+from __future__ import annotations
+import abc
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from ..config import get_settings
+
+try:
+    import fcntl
+
+    _FICLONE = 0x40049409  # linux/fs.h
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+    _FICLONE = None
+
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+_digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def clone_file(src: str, dst: str) -> None:
+    """Copy ``src`` to ``dst`` without decoding or streaming it through Python.
+
+    Tries a copy-on-write reflink (btrfs/xfs), then a hardlink (outputs are
+    never modified in place, so sharing the inode is safe), then the
+    kernel-side copy ``shutil.copyfile`` uses (sendfile/copy_file_range).
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+            return
+        except OSError:
+            os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def content_digest(path: str) -> str:
+    """sha256 of a file, memoised on (path, mtime, size) so hot files are hashed once."""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digests_lock:
+        _digests[key] = digest
+        while len(_digests) > 4096:
+            _digests.popitem(last=False)
+    return digest
+
+
+def object_key(digest: str, ext: str) -> str:
+    # Two levels of 256-way sharding keep every directory small
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+
+def locator_digest(locator: str) -> str:
+    """Content hash of a stored object; read from the name for content-addressed locators."""
+    stem = os.path.splitext(os.path.basename(locator))[0]
+    if _DIGEST_NAME.match(stem):
+        return stem
+    return content_digest(get_storage().local_path(locator))
+
+
+def scratch_path(name: str) -> str:
+    """Working file for a task; hand it to ``Storage.put_file`` once complete."""
+    settings = get_settings()
+    return os.path.join(settings.STORAGE_DIR, settings.STORAGE_TMP_DIR_NAME, name)
+
+
+def _atomic_copy(src: str, dst: str) -> None:
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    clone_file(src, tmp)
+    os.replace(tmp, dst)
+
+
+class Storage(abc.ABC):
+    """Content-addressed object store for task outputs and sources.
+
+    ``put_file`` returns a locator, which is what ``Generation.output_path``
+    holds. Identical files map to the same object, so duplicates are stored
+    once. Objects are never modified or deleted in place.
+    """
+
+    @abc.abstractmethod
+    def put_file(self, src: str, move: bool = False, digest: Optional[str] = None) -> str:
+        """Store ``src``; pass ``digest`` when its sha256 is already known to skip rehashing."""
+
+    @abc.abstractmethod
+    def exists(self, locator: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def local_path(self, locator: str) -> str:
+        """A readable local file for ``locator``; raises FileNotFoundError when missing."""
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def put_file(self, src: str, move: bool = False, digest: Optional[str] = None) -> str:
+        dst = os.path.join(self.root, object_key(digest or content_digest(src), os.path.splitext(src)[1]))
+        if os.path.exists(dst):
+            if move:
+                os.remove(src)
+            return dst
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if move:
+            try:
+                os.replace(src, dst)
+                return dst
+            except OSError:
+                pass  # different filesystem: copy below
+        _atomic_copy(src, dst)
+        if move:
+            os.remove(src)
+        return dst
+
+    def exists(self, locator: str) -> bool:
+        return os.path.exists(locator)
+
+    def local_path(self, locator: str) -> str:
+        # Also covers rows written before the object store (flat images/ upscales/ paths)
+        if not os.path.exists(locator):
+            raise FileNotFoundError(locator)
+        return locator
+
+
+class S3Storage(Storage):
+    """S3-compatible backend (AWS, MinIO, ...). Credentials come from the usual boto3 sources.
+
+    Objects are read through a local cache under ``cache_dir``. Files put with
+    ``move=True`` are kept there, so a worker does not download its own outputs.
+    """
+
+    def __init__(self, bucket: str, prefix: str, cache_dir: str, endpoint_url: str = "", region: str = "") -> None:
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def _split(self, locator: str) -> Tuple[str, str]:
+        bucket, _, key = locator[len("s3://"):].partition("/")
+        return bucket, key
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _head(self, bucket: str, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client().head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_file(self, src: str, move: bool = False, digest: Optional[str] = None) -> str:
+        key = self.prefix + object_key(digest or content_digest(src), os.path.splitext(src)[1])
+        if not self._head(self.bucket, key):
+            # Single-part PUTs are atomic; multipart uploads only appear once completed
+            content_type = mimetypes.guess_type(src)[0] or "application/octet-stream"
+            self.client().upload_file(src, self.bucket, key, ExtraArgs={"ContentType": content_type})
+        if move:
+            cached = self._cache_path(key)
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            try:
+                os.replace(src, cached)
+            except OSError:
+                os.remove(src)
+        return f"s3://{self.bucket}/{key}"
+
+    def exists(self, locator: str) -> bool:
+        if not locator.startswith("s3://"):
+            return os.path.exists(locator)
+        return self._head(*self._split(locator))
+
+    def local_path(self, locator: str) -> str:
+        if not locator.startswith("s3://"):
+            return LocalStorage(self.cache_dir).local_path(locator)
+        bucket, key = self._split(locator)
+        cached = self._cache_path(key)
+        if not os.path.exists(cached):
+            from botocore.exceptions import ClientError
+
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                self.client().download_file(bucket, key, tmp)
+            except ClientError:
+                raise FileNotFoundError(locator)
+            os.replace(tmp, cached)
+        return cached
+
+
+@lru_cache
+def get_storage() -> Storage:
+    settings = get_settings()
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            prefix=settings.S3_PREFIX,
+            cache_dir=os.path.join(settings.STORAGE_DIR, settings.S3_CACHE_DIR_NAME),
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region=settings.S3_REGION,
+        )
+    return LocalStorage(os.path.join(settings.STORAGE_DIR, settings.STORAGE_OBJECTS_DIR_NAME))
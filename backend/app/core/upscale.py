@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..config import get_settings
+from .artifacts import PngStreamWriter
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """Tile offsets covering ``length``; the last tile is shifted back so every tile is full-size.
+
+    No pixel is covered by more than two tiles, which ``blend_weights`` relies on.
+    """
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    starts = list(range(0, length - tile, step))
+    # A last tile closer than the overlap to the one before would also reach over the tile before that
+    if len(starts) > 1 and length - tile - starts[-1] < overlap:
+        starts.pop()
+    starts.append(length - tile)
+    return starts
+
+
+def blend_weights(starts: List[int], tile: int, length: int, scale: int) -> List[np.ndarray]:
+    """Per-tile 1-D weights at output resolution; linear ramps across overlaps sum to one everywhere."""
+    size = min(tile, length)
+    weights = []
+    for i, start in enumerate(starts):
+        w = np.ones(size * scale, dtype=np.float32)
+        end = start + size
+        if i > 0:
+            lo, hi = start * scale, (starts[i - 1] + size) * scale
+            n = hi - lo
+            w[:n] = (np.arange(n, dtype=np.float32) + 0.5) / n
+        if i + 1 < len(starts):
+            lo, hi = starts[i + 1] * scale, end * scale
+            n = hi - lo
+            w[size * scale - n:] = 1.0 - (np.arange(n, dtype=np.float32) + 0.5) / n
+        weights.append(w)
+    return weights
+
+
+class TiledUpscaler:
+    """Upscales overlapping tiles in batches and blends the seams.
+
+    Output rows are produced one tile-row strip at a time, so working memory
+    is bounded by ``memory_budget_bytes``: the tile height shrinks for very
+    wide images. The full-resolution result never exists in memory when it is
+    written with ``upscale_to_png``.
+    """
+
+    EMIT_ROWS = 64
+
+    def __init__(self, model, tile: int = 256, overlap: int = 16, batch_size: int = 4,
+                 memory_budget_bytes: int = 256 * 1024 * 1024) -> None:
+        self.model = model
+        self.tile = tile
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.memory_budget_bytes = memory_budget_bytes
+
+    @classmethod
+    def from_settings(cls, model) -> "TiledUpscaler":
+        settings = get_settings()
+        return cls(
+            model,
+            tile=settings.UPSCALE_TILE_SIZE,
+            overlap=settings.UPSCALE_TILE_OVERLAP,
+            batch_size=settings.UPSCALE_BATCH_SIZE,
+            memory_budget_bytes=settings.UPSCALE_MEMORY_BUDGET_MB * 1024 * 1024,
+        )
+
+    def _predict(self, tiles: List[Image.Image]) -> List[np.ndarray]:
+        predict_batch = getattr(self.model, "predict_batch", None)
+        outputs = predict_batch(tiles) if predict_batch else [self.model.predict(t) for t in tiles]
+        return [np.asarray(o.convert("RGB") if isinstance(o, Image.Image) else o, dtype=np.float32) for o in outputs]
+
+    def _scale(self, image: Image.Image) -> int:
+        scale = getattr(self.model, "scale", None)
+        if scale:
+            return int(scale)
+        probe = self._predict([image.crop((0, 0, min(8, image.width), min(8, image.height)))])[0]
+        return probe.shape[1] // min(8, image.width)
+
+    def _tile_height(self, width: int, scale: int) -> int:
+        # The budget covers one batch of float32 output tiles plus one float32 strip of
+        # tile_h * scale rows across the full output width
+        batch_bytes = self.batch_size * (self.tile * scale) ** 2 * 3 * 4
+        row_bytes = width * scale * scale * 3 * 4
+        fitted = (self.memory_budget_bytes - batch_bytes) // max(row_bytes, 1)
+        return int(max(2 * self.overlap + 1, min(self.tile, fitted)))
+
+    def output_size(self, image: Image.Image) -> Tuple[int, int]:
+        scale = self._scale(image)
+        return image.width * scale, image.height * scale
+
+    def iter_rows(self, image: Image.Image, scale: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Yield finished uint8 output row blocks, top to bottom."""
+        image = image.convert("RGB")
+        scale = scale or self._scale(image)
+        tile_h = self._tile_height(image.width, scale)
+        xs = tile_starts(image.width, self.tile, self.overlap)
+        ys = tile_starts(image.height, tile_h, self.overlap)
+        wxs = blend_weights(xs, self.tile, image.width, scale)
+        wys = blend_weights(ys, tile_h, image.height, scale)
+        tw, th = min(self.tile, image.width), min(tile_h, image.height)
+        out_w = image.width * scale
+
+        carry = np.zeros((0, out_w, 3), dtype=np.float32)
+        for row, y in enumerate(ys):
+            strip = np.zeros((th * scale, out_w, 3), dtype=np.float32)
+            strip[: len(carry)] = carry
+            boxes = [(x, y, x + tw, y + th) for x in xs]
+            for i in range(0, len(boxes), self.batch_size):
+                batch = boxes[i:i + self.batch_size]
+                outputs = self._predict([image.crop(b) for b in batch])
+                for (x, _, _, _), out in zip(batch, outputs):
+                    wx = wxs[xs.index(x)]
+                    out *= wys[row][:, None, None]
+                    out *= wx[None, :, None]
+                    strip[:, x * scale:(x + tw) * scale] += out
+                del outputs, out
+            done = (ys[row + 1] - y) * scale if row + 1 < len(ys) else len(strip)
+            # Copy so the previous strip can be freed before the next one is allocated
+            carry = strip[done:].copy()
+            # Convert in slices so no second full-strip temporary is created
+            for i in range(0, done, self.EMIT_ROWS):
+                chunk = strip[i:min(i + self.EMIT_ROWS, done)]
+                chunk += 0.5
+                yield np.clip(chunk, 0, 255, out=chunk).astype(np.uint8)
+            del strip, chunk
+
+    def upscale(self, image: Image.Image) -> Image.Image:
+        return Image.fromarray(np.concatenate(list(self.iter_rows(image)), axis=0))
+
+    def upscale_to_png(self, image: Image.Image, path: str) -> Tuple[int, int]:
+        """Stream the upscaled image into a PNG at ``path``; returns the output size."""
+        scale = self._scale(image)
+        width, height = image.width * scale, image.height * scale
+        with PngStreamWriter(path, width, height) as writer:
+            for rows in self.iter_rows(image, scale):
+                writer.write_rows(rows)
+        return width, height
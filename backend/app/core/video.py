@@ -0,0 +1,235 @@
+from __future__ import annotations
+import abc
+import collections
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from ..config import get_settings
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Preferred H.264 encoders, hardware first; each maps to its quality/speed flags
+ENCODER_PRESETS = {
+    "h264_nvenc": ["-preset", "p4", "-rc", "vbr", "-cq", "{crf}"],
+    "h264_qsv": ["-preset", "veryfast", "-global_quality", "{crf}"],
+    "h264_videotoolbox": ["-q:v", "60"],
+    "libx264": ["-preset", "veryfast", "-crf", "{crf}"],
+    "libopenh264": [],
+    "mpeg4": ["-q:v", "5"],
+}
+
+
+class VideoEncodeError(RuntimeError):
+    pass
+
+
+class FrameSource(abc.ABC):
+    """Frames of one clip, produced lazily. Subclasses yield RGB PIL images of ``size``.
+
+    A diffusion video pipeline plugs in through ``PipelineFrameSource``; the
+    encoder only ever holds one frame at a time from procedural sources.
+    """
+
+    def __init__(self, width: int, height: int, fps: int) -> None:
+        # yuv420p needs even dimensions
+        self.size = (max(2, width - width % 2), max(2, height - height % 2))
+        self.fps = fps
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def __iter__(self) -> Iterator[Image.Image]:
+        ...
+
+
+class SolidColorSource(FrameSource):
+    def __init__(self, width: int, height: int, fps: int, seconds: float, color: Tuple[int, int, int] = (0, 0, 0)):
+        super().__init__(width, height, fps)
+        self.frames = max(1, int(round(fps * seconds)))
+        self.color = color
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        frame = Image.new("RGB", self.size, self.color)
+        for _ in range(self.frames):
+            yield frame
+
+
+class StillImageSource(FrameSource):
+    """Slow centred zoom over a still image (Ken Burns)."""
+
+    def __init__(self, image: Image.Image, width: int, height: int, fps: int, seconds: float, zoom: float = 1.1):
+        super().__init__(width, height, fps)
+        self.frames = max(1, int(round(fps * seconds)))
+        self.zoom = zoom
+        # Cover-fit once; each frame is a crop + resize of this base
+        base = image.convert("RGB")
+        scale = max(self.size[0] / base.width, self.size[1] / base.height)
+        self.base = base.resize((max(1, round(base.width * scale)), max(1, round(base.height * scale))), Image.LANCZOS)
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        bw, bh = self.base.size
+        w, h = self.size
+        for i in range(self.frames):
+            z = 1.0 + (self.zoom - 1.0) * (i / max(1, self.frames - 1))
+            cw, ch = w / z, h / z
+            left, top = (bw - cw) / 2, (bh - ch) / 2
+            yield self.base.resize(self.size, Image.BILINEAR, box=(left, top, left + cw, top + ch))
+
+
+class PipelineFrameSource(FrameSource):
+    """Frames already produced by a video diffusion pipeline (e.g. ``result.frames[0]``)."""
+
+    def __init__(self, frames: Sequence[Image.Image], fps: int):
+        first = frames[0]
+        super().__init__(first.width, first.height, fps)
+        self.frames = frames
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        for frame in self.frames:
+            frame = frame.convert("RGB")
+            yield frame if frame.size == self.size else frame.resize(self.size, Image.LANCZOS)
+
+
+def _ffmpeg() -> Optional[str]:
+    return shutil.which(get_settings().FFMPEG_BINARY)
+
+
+@lru_cache
+def _encoder_works(ffmpeg: str, codec: str) -> bool:
+    # Listing is not enough for hardware encoders: the device may be absent. Encode a few frames.
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "color=c=black:s=64x64:d=0.2",
+           "-c:v", codec, "-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=15).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+@lru_cache
+def select_codec(ffmpeg: str) -> str:
+    """``VIDEO_CODEC``, or the first preset encoder that actually works on this machine."""
+    configured = get_settings().VIDEO_CODEC
+    if configured != "auto":
+        return configured
+    for codec in ENCODER_PRESETS:
+        if _encoder_works(ffmpeg, codec):
+            return codec
+    raise VideoEncodeError("ffmpeg has no usable H.264/MPEG-4 encoder")
+
+
+def _codec_args(codec: str) -> List[str]:
+    crf = str(get_settings().VIDEO_CRF)
+    return [arg.replace("{crf}", crf) for arg in ENCODER_PRESETS.get(codec, [])]
+
+
+def _drain(stream, tail: collections.deque) -> None:
+    for line in iter(stream.readline, b""):
+        tail.append(line.decode("utf-8", "replace").rstrip())
+
+
+def encode_ffmpeg(source: FrameSource, path: str, timeout: float) -> str:
+    """Pipe raw RGB frames into an ffmpeg subprocess; no intermediate files."""
+    ffmpeg = _ffmpeg()
+    if ffmpeg is None:
+        raise VideoEncodeError(f"{get_settings().FFMPEG_BINARY} not found")
+    codec = select_codec(ffmpeg)
+    w, h = source.size
+    cmd = [
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(source.fps), "-i", "pipe:0",
+        "-an", "-c:v", codec, *_codec_args(codec), "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+        path,
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Drain stderr concurrently so a chatty encoder can never block on a full pipe
+    tail: collections.deque = collections.deque(maxlen=20)
+    reader = threading.Thread(target=_drain, args=(proc.stderr, tail), daemon=True)
+    reader.start()
+    # A stalled encoder can block a pipe write indefinitely: kill it from a timer instead
+    expired = threading.Event()
+
+    def expire() -> None:
+        expired.set()
+        proc.kill()
+
+    watchdog = threading.Timer(timeout, expire)
+    watchdog.start()
+    try:
+        for frame in source:
+            proc.stdin.write(frame.tobytes())
+        proc.stdin.close()
+        returncode = proc.wait()
+    except BrokenPipeError:
+        returncode = proc.wait()  # ffmpeg exited early (or was killed); its stderr says why
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        watchdog.cancel()
+        reader.join(timeout=1)
+    if expired.is_set() and returncode != 0:
+        raise VideoEncodeError(f"ffmpeg timed out after {timeout:.0f}s")
+    if returncode != 0:
+        raise VideoEncodeError(f"ffmpeg exited with {returncode}: {' | '.join(tail) or 'no output'}")
+    return path
+
+
+def encode_pyav(source: FrameSource, path: str, timeout: float) -> str:
+    """Encode in-process with PyAV (libav bindings)."""
+    configured = get_settings().VIDEO_CODEC
+    codec = configured if configured != "auto" else "libx264"
+    deadline = time.monotonic() + timeout
+    with av.open(path, mode="w", options={"movflags": "+faststart"}) as container:
+        stream = container.add_stream(codec, rate=source.fps)
+        stream.width, stream.height = source.size
+        stream.pix_fmt = "yuv420p"
+        if codec == "libx264":
+            stream.options = {"preset": "veryfast", "crf": str(get_settings().VIDEO_CRF)}
+        for frame in source:
+            if time.monotonic() > deadline:
+                raise VideoEncodeError(f"encoding timed out after {timeout:.0f}s")
+            container.mux(stream.encode(av.VideoFrame.from_image(frame)))
+        container.mux(stream.encode())
+    return path
+
+
+def encode_video(source: FrameSource, path: str, timeout: Optional[float] = None) -> str:
+    """Encode ``source`` to an H.264 MP4 at ``path`` with the configured backend.
+
+    ``VIDEO_ENCODER`` is ``pyav``, ``ffmpeg`` or ``auto`` (PyAV when installed).
+    Raises VideoEncodeError with the encoder's message on failure.
+    """
+    settings = get_settings()
+    timeout = timeout or settings.VIDEO_ENCODE_TIMEOUT
+    backend = settings.VIDEO_ENCODER
+    if backend == "auto":
+        backend = "pyav" if av is not None else "ffmpeg"
+    if backend == "pyav":
+        if av is None:
+            raise VideoEncodeError("PyAV is not installed")
+        try:
+            return encode_pyav(source, path, timeout)
+        except av.error.FFmpegError as e:
+            raise VideoEncodeError(str(e)) from e
+    return encode_ffmpeg(source, path, timeout)
@@ -4,15 +4,26 @@ from typing import List
 
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
 
 from .config import get_settings
-from .db import Base, engine, get_db
+from .core import metrics
+from .core.health import readiness
+from .core.passwords import password_hasher
+from .db import Base, engine, get_async_db, get_db, dispose_async_engine
 from .models import User
 from .security import get_password_hash
 from .api.v1 import auth as auth_router
 from .api.v1 import generate as generate_router
 from .api.v1 import admin as admin_router
+from .api.v1 import generations as generations_router
+from .api.v1 import favorites as favorites_router
+from .api.v1 import media as media_router
+from .api.v1 import sources as sources_router
 
 
 def create_app() -> FastAPI:
@@ -28,16 +39,37 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(metrics.RequestMetricsMiddleware)
 
     # Routers
     app.include_router(auth_router.router)
     app.include_router(generate_router.router)
     app.include_router(admin_router.router)
+    app.include_router(generations_router.router)
+    app.include_router(favorites_router.router)
+    app.include_router(media_router.router)
+    app.include_router(sources_router.router)
+
+    @app.on_event("shutdown")
+    async def close_pools():
+        await dispose_async_engine()
+        password_hasher.shutdown()
 
     @app.get("/health")
     def health():
+        # Liveness only; /ready checks dependencies
         return {"status": "ok"}
 
+    @app.get("/ready")
+    async def ready(db: AsyncSession = Depends(get_async_db)):
+        ok, checks = await readiness(db)
+        return JSONResponse({"status": "ready" if ok else "unavailable", "checks": checks}, status_code=200 if ok else 503)
+
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics():
+        body, content_type = metrics.render()
+        return Response(body, media_type=content_type)
+
     return app
 
 
@@ -46,6 +78,16 @@ app = create_app()
 
 # Initialize DB on import
 Base.metadata.create_all(bind=engine)
+# create_all skips tables that already exist; add columns (with a server default) and indexes introduced since
+_inspector = inspect(engine)
+for table in Base.metadata.sorted_tables:
+    existing = {c["name"] for c in _inspector.get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing and (column.nullable or column.server_default is not None):
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}"))
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 
 # Create default admin in dev
@@ -2,7 +2,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, false
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -15,6 +15,7 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
+    is_paid = Column(Boolean, default=False, server_default=false(), nullable=False)  # paid plan: higher queue priority
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     generations = relationship("Generation", back_populates="user", cascade="all, delete-orphan")
@@ -44,6 +45,8 @@ class Generation(Base):
 
     status = Column(String(20), default="queued", nullable=False)  # queued|running|completed|failed|blocked|flagged
     error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)  # times a worker claimed the row
+    claimed_by = Column(String(255), nullable=True)  # Celery task id of the delivery that last claimed the row
 
     nsfw_tags = Column(String(255), nullable=True)  # comma-separated tags: explicit,soft,fetish
     nsfw_action = Column(String(20), nullable=True)  # allow|flag|block
@@ -54,6 +57,13 @@ class Generation(Base):
     user = relationship("User", back_populates="generations")
     reviews = relationship("ModerationReview", back_populates="generation", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Admin queue: status filter + keyset walk over (created_at, id)
+        Index("ix_generations_status_created_at_id", "status", "created_at", "id"),
+        # User gallery/history: newest first per user
+        Index("ix_generations_user_created_at_id", "user_id", "created_at", "id"),
+    )
+
 
 class Favorite(Base):
     __tablename__ = "favorites"
@@ -65,6 +75,9 @@ class Favorite(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     user = relationship("User", back_populates="favorites")
+    generation = relationship("Generation")
+
+    __table_args__ = (Index("ix_favorites_user_created_at_id", "user_id", "created_at", "id"),)
 
 
 class ModerationReview(Base):
@@ -81,3 +94,20 @@ class ModerationReview(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     generation = relationship("Generation", back_populates="reviews")
+
+
+class SourceUpload(Base):
+    """An uploaded source image; generations reference it by id instead of a server path."""
+
+    __tablename__ = "source_uploads"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+
+    locator = Column(String(1024), nullable=False)  # storage locator of the original bytes
+    format = Column(String(10), nullable=False)  # PNG|JPEG|WEBP
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
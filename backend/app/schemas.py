@@ -30,6 +30,7 @@ class UserOut(BaseModel):
     id: int
     email: EmailStr
     is_admin: bool
+    is_paid: bool
     created_at: datetime
 
     class Config:
@@ -47,7 +48,15 @@ class GenerationCreate(BaseModel):
     width: Optional[int] = None
     height: Optional[int] = None
     style: Optional[str] = None
-    source_path: Optional[str] = None
+    source_id: Optional[int] = None  # from POST /api/v1/sources; the only way to pass a source image
+
+
+class GenerationBatchCreate(BaseModel):
+    jobs: List[GenerationCreate] = Field(min_items=1)
+
+
+class GenerationBatchOut(BaseModel):
+    ids: List[int]
 
 
 class GenerationOut(BaseModel):
@@ -74,6 +83,23 @@ class GenerationOut(BaseModel):
         orm_mode = True
 
 
+class GenerationPage(BaseModel):
+    items: List[GenerationOut]
+    next_cursor: Optional[str] = None
+
+
+class SourceUploadOut(BaseModel):
+    id: int
+    format: str
+    width: int
+    height: int
+    size_bytes: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
 class FavoriteOut(BaseModel):
     id: int
     generation_id: int
@@ -83,6 +109,15 @@ class FavoriteOut(BaseModel):
         orm_mode = True
 
 
+class FavoriteGenerationOut(FavoriteOut):
+    generation: GenerationOut
+
+
+class FavoritePage(BaseModel):
+    items: List[FavoriteGenerationOut]
+    next_cursor: Optional[str] = None
+
+
 class ModerationReviewCreate(BaseModel):
     action: str
     tags: Optional[str] = None
@@ -100,3 +135,16 @@ class ModerationReviewOut(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class ModerationBulkReviewCreate(BaseModel):
+    generation_ids: List[int] = Field(min_items=1)
+    action: str  # allow|flag|block
+    tags: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class ModerationBulkReviewOut(BaseModel):
+    reviewed: int
+    missing: List[int]
+    skipped: List[int] = []  # found, but running, failed or (for allow/flag) without an output
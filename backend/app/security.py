@@ -5,15 +5,16 @@ from typing import Optional
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import get_settings
-from .db import get_db
+from .core.auth_cache import UserSnapshot, auth_cache
+from .core.passwords import pwd_context
+from .db import get_async_db
 from .models import User
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 
@@ -34,7 +35,11 @@ def create_access_token(subject: int, expires_minutes: Optional[int] = None) ->
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> UserSnapshot:
+    cached = await auth_cache.get(token)
+    if cached is not None:
+        return cached
+
     settings = get_settings()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -47,16 +52,19 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         if sub is None:
             raise credentials_exception
         user_id = int(sub)
+        expires_at = payload.get("exp")
     except (JWTError, ValueError):
         raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise credentials_exception
-    return user
+    snapshot = UserSnapshot.from_user(user)
+    await auth_cache.put(token, snapshot, expires_at)
+    return snapshot
 
 
-def get_current_admin(user: User = Depends(get_current_user)) -> User:
+async def get_current_admin(user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return user
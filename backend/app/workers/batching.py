@@ -0,0 +1,179 @@
+from __future__ import annotations
+import time
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from sqlalchemy import func, or_, select, true
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..core.events import step_callback
+from ..core.lifecycle import WORKER_LOST, claim, claim_stmt, fail
+from ..core.metrics import observe_queue_wait, timed_inference
+from ..core.models_loader import registry, style_model_ids
+from ..models import Generation
+
+
+DEFAULT_WIDTH = 512
+DEFAULT_HEIGHT = 512
+DEFAULT_STEPS = 30
+
+
+def txt2img_model_id(gen: Generation) -> str:
+    return registry.model_id_for_style(gen.style)
+
+
+def _style_filter(model_id: str):
+    """SQL condition selecting rows whose style resolves to ``model_id``."""
+    styles = style_model_ids()
+    if model_id == get_settings().SD_MODEL_ID:
+        others = [s for s, m in styles.items() if m != model_id]
+        return or_(Generation.style.is_(None), Generation.style.notin_(others)) if others else true()
+    return Generation.style.in_([s for s, m in styles.items() if m == model_id])
+
+
+def batch_key(gen: Generation) -> Tuple[int, int, int, str]:
+    return (
+        gen.width or DEFAULT_WIDTH,
+        gen.height or DEFAULT_HEIGHT,
+        gen.steps or DEFAULT_STEPS,
+        txt2img_model_id(gen),
+    )
+
+
+def make_generators(pipe, seeds: List[Optional[int]]):
+    """One torch.Generator per job so each row keeps its own seed inside a batch."""
+    try:
+        import torch
+    except Exception:
+        return None
+    device = getattr(pipe, "device", "cpu")
+    generators = []
+    for seed in seeds:
+        g = torch.Generator(device=device)
+        if seed is None:
+            g.seed()
+        else:
+            g.manual_seed(seed)
+        generators.append(g)
+    return generators
+
+
+def run_txt2img_batch(pipe, gens: List[Generation]) -> List[Image.Image]:
+    """Run compatible txt2img rows through the pipeline as a single batched call.
+
+    Images are returned in the same order as ``gens``. Without a pipeline a
+    black placeholder is produced per row.
+    """
+    width, height, steps, _ = batch_key(gens[0])
+    if pipe is None:
+        return [Image.new("RGB", (width, height), color=(0, 0, 0)) for _ in gens]
+
+    with timed_inference("txt2img", steps):
+        result = pipe(
+            prompt=[g.prompt for g in gens],
+            negative_prompt=[g.negative_prompt or "" for g in gens],
+            num_inference_steps=steps,
+            width=width,
+            height=height,
+            generator=make_generators(pipe, [g.seed for g in gens]),
+            callback_on_step_end=step_callback([g.id for g in gens], steps),
+        )
+    images = list(result.images)
+    if len(images) != len(gens):
+        raise RuntimeError(f"pipeline returned {len(images)} images for a batch of {len(gens)}")
+    return images
+
+
+class Txt2ImgBatcher:
+    """Collects queued txt2img rows sharing a batch key with a leader row.
+
+    Rows are claimed with a conditional ``UPDATE ... WHERE status='queued'`` so
+    concurrent workers never run the same row twice; the Celery task of a
+    claimed row finds it no longer queued and exits.
+    """
+
+    def __init__(self, max_batch_size: int, window_s: float, poll_interval_s: float = 0.05):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_s = max(0.0, window_s)
+        self.poll_interval_s = poll_interval_s
+
+    @classmethod
+    def from_settings(cls) -> "Txt2ImgBatcher":
+        settings = get_settings()
+        if not settings.TXT2IMG_BATCHING:
+            return cls(max_batch_size=1, window_s=0.0)
+        return cls(
+            max_batch_size=settings.TXT2IMG_BATCH_MAX_SIZE,
+            window_s=settings.TXT2IMG_BATCH_WINDOW_MS / 1000.0,
+        )
+
+
+    def _candidates(self, session: Session, key: Tuple[int, int, int, str], exclude: List[int], limit: int):
+        width, height, steps, model_id = key
+        return session.scalars(
+            select(Generation.id)
+            .where(
+                Generation.status == "queued",
+                Generation.type == "image",
+                Generation.source_path.is_(None),
+                func.coalesce(Generation.width, DEFAULT_WIDTH) == width,
+                func.coalesce(Generation.height, DEFAULT_HEIGHT) == height,
+                func.coalesce(Generation.steps, DEFAULT_STEPS) == steps,
+                _style_filter(model_id),
+                Generation.id.notin_(exclude),
+            )
+            .order_by(Generation.created_at.asc(), Generation.id.asc())
+            .limit(limit)
+        ).all()
+
+    @staticmethod
+    def _claim_rows(session: Session, gen_ids: List[int], task_id: Optional[str], resume: bool = False) -> List[int]:
+        """One compare-and-set for all ``gen_ids``; returns those won, in order."""
+        stmt = claim_stmt(gen_ids, task_id, resume).returning(Generation.id, Generation.type, Generation.created_at)
+        won = {row.id: row for row in session.execute(stmt).all()}
+        observe_queue_wait((row.type, row.created_at) for row in won.values())
+        session.commit()
+        return [i for i in gen_ids if i in won]
+
+    def collect(self, session: Session, leader_id: int, task_id: Optional[str] = None,
+                resume: bool = False) -> List[Generation]:
+        """Claim the leader and up to ``max_batch_size - 1`` compatible rows for delivery ``task_id``.
+
+        Returns an empty list if the leader was already claimed elsewhere.
+        ``resume`` is passed through to ``lifecycle.claim`` for redelivered jobs,
+        and also takes back the batch-mates the lost delivery held: their own
+        messages were acked as claimed elsewhere, so nothing else would run them.
+        """
+        if not claim(session, leader_id, task_id, resume):
+            return []
+        leader = session.get(Generation, leader_id)
+        key = batch_key(leader)
+        claimed = [leader_id]
+
+        if resume and task_id is not None:
+            held = session.scalars(
+                select(Generation.id)
+                .where(Generation.status == "running", Generation.claimed_by == task_id, Generation.id != leader_id)
+                .order_by(Generation.id.asc())
+            ).all()
+            if held:
+                resumed = self._claim_rows(session, held, task_id, resume=True)
+                claimed.extend(resumed)
+                exhausted = [i for i in held if i not in resumed]
+                if exhausted:  # out of attempts, as the leader would be
+                    fail(session, exhausted, WORKER_LOST, claimed_by=task_id)
+
+        deadline = time.monotonic() + self.window_s
+        while len(claimed) < self.max_batch_size:
+            candidates = self._candidates(session, key, claimed, self.max_batch_size - len(claimed))
+            if candidates:
+                # Rows another worker took are skipped
+                claimed.extend(self._claim_rows(session, candidates, task_id))
+            if len(claimed) >= self.max_batch_size or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval_s)
+
+        gens = session.scalars(select(Generation).where(Generation.id.in_(claimed))).all()
+        by_id = {g.id: g for g in gens}
+        return [by_id[i] for i in claimed if i in by_id]
@@ -1,9 +1,19 @@
 from __future__ import annotations
+import logging
 import os
+import socket
+import threading
+import time
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init, worker_process_shutdown
 from ..config import get_settings
+from ..core import metrics
+from ..core.health import publish_residency
+from ..core.models_loader import registry
+from .routing import PRIORITY_DEFAULT, PRIORITY_STEPS, TASK_QUEUES
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 celery_app = Celery(
     "app",
@@ -11,8 +21,15 @@ celery_app = Celery(
     backend=settings.CELERY_RESULT_BACKEND,
 )
 
-celery_app.conf.task_routes = {
-    "app.workers.tasks.*": {"queue": "default"},
+celery_app.conf.task_routes = {name: {"queue": queue} for name, queue in TASK_QUEUES.items()}
+
+# Models each queue needs resident; workers preload the union for the queues they consume
+QUEUE_MODELS = {
+    "txt2img": ("txt2img", "nsfw"),
+    "img2img": ("img2img", "nsfw"),
+    "upscale": ("upscaler", "nsfw"),
+    "video": ("img2video", "nsfw"),
+    "moderation": ("nsfw",),
 }
 
 celery_app.conf.update(
@@ -22,4 +39,97 @@ celery_app.conf.update(
     accept_content=["json"],
     timezone="UTC",
     enable_utc=True,
+    # Priorities on the Redis transport: one list per step, lowest number served first
+    task_default_priority=PRIORITY_DEFAULT,
+    broker_transport_options={"priority_steps": PRIORITY_STEPS, "sep": ":", "queue_order_strategy": "priority"},
+    # Prefetched messages bypass priority ordering; long jobs gain nothing from prefetch anyway
+    worker_prefetch_multiplier=1,
+    # Ack after the task body ran, and put the message back if the worker process dies, so a
+    # crash redelivers the job instead of losing it. Tasks are idempotent (see lifecycle.claim).
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    task_time_limit=settings.JOB_TIMEOUT_SECONDS,
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+    task_eager_propagates=True,
+    beat_schedule={
+        "reap-stale-generations": {
+            "task": "app.workers.tasks.task_reap_stale",
+            "schedule": settings.REAPER_INTERVAL_SECONDS,
+        },
+    },
 )
+# Unacked messages are redelivered after the visibility timeout; it must outlast the longest task
+celery_app.conf.broker_transport_options["visibility_timeout"] = settings.JOB_TIMEOUT_SECONDS + 300
+
+
+def models_for_worker() -> list:
+    if settings.WORKER_PRELOAD_MODELS:
+        return [m.strip() for m in settings.WORKER_PRELOAD_MODELS.split(",") if m.strip()]
+    queues = celery_app.amqp.queues.consume_from or {}
+    names = []
+    for queue in queues:
+        for name in QUEUE_MODELS.get(queue, ()):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+@worker_process_init.connect
+def preload_models(**_):
+    names = models_for_worker()
+    try:
+        registry.ensure(*names)
+        if settings.WORKER_WARMUP:
+            registry.warm_up(names)
+    except Exception:
+        # Tasks retry the load lazily; residency() keeps the failure for inspection
+        logger.exception("model preload failed")
+    logger.info("model residency: %s", registry.residency())
+    threading.Thread(target=_heartbeat, args=(f"{socket.gethostname()}:{os.getpid()}",), daemon=True).start()
+
+
+def _loaded_models() -> list:
+    return [name for name, info in registry.residency().items() if info.get("status") == "loaded"]
+
+
+def _heartbeat(worker: str) -> None:
+    # Read by the API's /ready; the key expires if this process dies
+    while True:
+        publish_residency(worker, _loaded_models())
+        time.sleep(settings.WORKER_HEARTBEAT_SECONDS)
+
+
+@worker_init.connect
+def serve_metrics(**_):
+    if not settings.METRICS_WORKER_PORT:
+        return
+    from prometheus_client import start_http_server
+
+    if not metrics.MULTIPROCESS:
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is unset; pool processes' metrics will not be exported")
+    start_http_server(settings.METRICS_WORKER_PORT, registry=metrics.registry())
+
+
+@worker_process_shutdown.connect
+def retire_metrics(pid=None, **_):
+    if metrics.MULTIPROCESS:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _task_prerun(task_id=None, **_):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_postrun(task_id=None, task=None, state=None, **_):
+    start = _task_started.pop(task_id, None)
+    if start is not None and task is not None:
+        metrics.TASK_SECONDS.labels(task=task.name.rsplit(".", 1)[-1], state=state or "UNKNOWN").observe(
+            time.perf_counter() - start
+        )
@@ -0,0 +1,45 @@
+from __future__ import annotations
+from typing import Dict
+
+from celery import Task
+
+# Task family -> queue. Heavy diffusion/video queues and light upscale/moderation
+# queues are consumed by separately scaled worker pools (see README).
+TASK_QUEUES: Dict[str, str] = {
+    "app.workers.tasks.task_txt2img": "txt2img",
+    "app.workers.tasks.task_img2img": "img2img",
+    "app.workers.tasks.task_upscale": "upscale",
+    "app.workers.tasks.task_txt2video": "video",
+    "app.workers.tasks.task_img2video": "video",
+    "app.workers.tasks.task_moderate": "moderation",
+    "app.workers.tasks.task_reap_stale": "moderation",
+}
+DEFAULT_QUEUE = "txt2img"
+
+# Redis transport: 0 is consumed first, 9 last
+PRIORITY_ADMIN = 0
+PRIORITY_PAID = 3
+PRIORITY_DEFAULT = 6
+PRIORITY_BULK = 9
+PRIORITY_STEPS = list(range(10))
+
+
+def queue_for(task: Task) -> str:
+    return TASK_QUEUES.get(task.name, DEFAULT_QUEUE)
+
+
+def priority_for(user, bulk: bool = False) -> int:
+    if user.is_admin:
+        return PRIORITY_ADMIN
+    if user.is_paid:
+        return PRIORITY_PAID
+    # Bulk submissions (prompt sweeps) yield to interactive jobs
+    return PRIORITY_BULK if bulk else PRIORITY_DEFAULT
+
+
+def signature_for(task: Task, gen_id: int, user, bulk: bool = False):
+    return task.s(gen_id).set(queue=queue_for(task), priority=priority_for(user, bulk=bulk))
+
+
+def enqueue(task: Task, gen_id: int, user):
+    return task.apply_async(args=[gen_id], queue=queue_for(task), priority=priority_for(user))
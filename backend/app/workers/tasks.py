@@ -2,264 +2,385 @@ from __future__ import annotations
 import os
 from typing import Optional
 
+from celery import group
 from PIL import Image
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 
 from ..config import get_settings
 from ..db import SessionLocal
-from ..models import Generation
+from ..models import Generation, User
+from ..core.artifacts import (
+    ArtifactPipeline,
+    ImageArtifact,
+    SourceImage,
+    derivative_stage,
+    encode_stage,
+    moderation_stage,
+)
+from ..core.derivatives import render_stored
+from ..core.events import publish_status, step_callback
+from ..core.lifecycle import Outcome, claim, fail, finish, reap, transition_stmt, values_stmt
+from ..core.metrics import STAGE_SECONDS, timed, timed_inference
 from ..core.models_loader import registry
-from ..core.nsfw_pipeline import NSFWSmartClassifier
+from ..core.nsfw_pipeline import NSFWResult, NSFWSmartClassifier
+from ..core.result_cache import result_cache, result_cache_key
+from ..core.storage import get_storage, scratch_path
+from ..core.upscale import TiledUpscaler
+from ..core.video import FrameSource, PipelineFrameSource, SolidColorSource, StillImageSource, encode_video
+from .batching import Txt2ImgBatcher, make_generators, run_txt2img_batch, txt2img_model_id
 from .celery_app import celery_app
+from .routing import signature_for
 
 
 settings = get_settings()
 
+IMG2IMG_STRENGTH = 0.6
 
-def _update_status(session: Session, gen: Generation, status: str, error: Optional[str] = None):
-    gen.status = status
-    gen.error = error
-    session.add(gen)
-    session.commit()
 
+def _nsfw_classifier() -> NSFWSmartClassifier:
+    registry.ensure("nsfw")
+    return registry.nsfw or NSFWSmartClassifier()
 
-def _apply_nsfw_smart(gen: Generation, output_path: str, session: Session):
-    classifier: NSFWSmartClassifier = registry.nsfw or NSFWSmartClassifier()
+
+def _moderation(gen: Generation, output, image_res: Optional[NSFWResult] = None) -> Outcome:
+    """``output`` is the in-memory image when available, else the output path."""
+    classifier = _nsfw_classifier()
     # Combine prompt-based and output-based assessments
-    prompt_res = classifier.classify_prompt(gen.prompt)
-    image_res = classifier.classify_image(output_path)
+    with timed(STAGE_SECONDS, stage="moderation"):
+        prompt_res = classifier.classify_prompt(gen.prompt)
+        if image_res is None:
+            image_res = classifier.classify_image(output)
     tags = list({*prompt_res.tags, *image_res.tags})
-    if tags:
-        gen.nsfw_tags = ",".join(tags)
     # Merge actions: block > flag > allow; but keep human-in-loop, don't auto-block
     action = "flag" if ("explicit" in tags or "fetish" in tags) else "allow"
-    gen.nsfw_action = action
-    # If admin has not overridden, set status accordingly
-    if gen.status not in ("blocked", "completed"):
-        gen.status = "flagged" if action == "flag" else "completed"
-    session.add(gen)
-    session.commit()
+    values = {"nsfw_action": action}
+    if tags:
+        values["nsfw_tags"] = ",".join(tags)
+    # A moderator's decision made while the job ran is kept: see lifecycle.finish
+    return Outcome(gen.id, "flagged" if action == "flag" else "completed", values)
 
 
-@celery_app.task(name="app.workers.tasks.task_txt2img")
-def task_txt2img(gen_id: int):
-    session = SessionLocal()
+def _artifact_pipeline() -> ArtifactPipeline:
+    return ArtifactPipeline([moderation_stage(_nsfw_classifier), encode_stage, derivative_stage])
+
+
+def _moderation_pipeline() -> ArtifactPipeline:
+    return ArtifactPipeline([moderation_stage(_nsfw_classifier)])
+
+
+def _outcome(gen: Generation, locator: str, artifact: Optional[ImageArtifact] = None, frame=None) -> Outcome:
+    """Final status and columns of a finished job; written by ``lifecycle.finish`` in one UPDATE."""
+    if gen.mode != "nsfw_smart":
+        outcome = Outcome(gen.id, "completed")
+    elif artifact is not None:
+        outcome = _moderation(gen, artifact.image, image_res=artifact.moderation)
+    else:
+        outcome = _moderation(gen, frame if frame is not None else get_storage().local_path(locator))
+    outcome.values["output_path"] = locator
+    return outcome
+
+
+def _redelivered(task) -> bool:
+    # Set by the broker when an unacked message is put back (its worker was lost)
+    return bool((task.request.delivery_info or {}).get("redelivered"))
+
+
+def _claim(task, session, gen_id: int) -> Optional[Generation]:
+    """The claimed row, or None when there is nothing (left) to do.
+
+    A finished row is never claimed again: its output and final status are
+    written together, so a duplicate or redelivered message exits here.
+    """
+    if not claim(session, gen_id, task.request.id, resume=_redelivered(task)):
+        return None
+    return session.get(Generation, gen_id)
+
+
+def task_for_generation(gen):
+    if gen.type == "image":
+        return task_img2img if gen.source_path else task_txt2img
+    if gen.type == "upscale":
+        return task_upscale
+    return task_img2video if gen.source_path else task_txt2video
+
+
+def _source_image(gen: Generation) -> Optional[SourceImage]:
+    if not gen.source_path:
+        return None
     try:
-        gen = session.query(Generation).get(gen_id)
-        if not gen:
-            return
-        _update_status(session, gen, "running")
-
-        # Generate image via Stable Diffusion if available; else create placeholder
-        registry.load_all()
-        output_dir = os.path.join(settings.STORAGE_DIR, settings.IMAGES_DIR_NAME)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"gen_{gen.id}.png")
-
-        if registry.sd_pipeline:
-            pipe = registry.sd_pipeline
-            result = pipe(
-                prompt=gen.prompt,
-                negative_prompt=gen.negative_prompt,
-                num_inference_steps=gen.steps or 30,
-                width=gen.width or 512,
-                height=gen.height or 512,
-                generator=None,
-            )
-            image = result.images[0]
-            image.save(output_path)
-        else:
-            # Placeholder: black image with text
-            img = Image.new("RGB", (gen.width or 512, gen.height or 512), color=(0, 0, 0))
-            img.save(output_path)
+        return SourceImage(get_storage().local_path(gen.source_path))
+    except FileNotFoundError:
+        return None
 
-        gen.output_path = output_path
-        session.add(gen)
-        session.commit()
 
-        if gen.mode == "nsfw_smart":
-            _apply_nsfw_smart(gen, output_path, session)
-        else:
-            _update_status(session, gen, "completed")
+def _store_output(path: str) -> str:
+    """Move a finished scratch file into the object store; returns its locator."""
+    with timed(STAGE_SECONDS, stage="store"):
+        return get_storage().put_file(path, move=True)
+
+
+@celery_app.task(name="app.workers.tasks.task_txt2img", bind=True)
+def task_txt2img(self, gen_id: int):
+    session = SessionLocal()
+    gens = []
+    try:
+        # Claims this row plus any compatible queued rows (batch of one when batching is off)
+        gens = Txt2ImgBatcher.from_settings().collect(session, gen_id, self.request.id, resume=_redelivered(self))
+        if not gens:
+            return
+        for gen in gens[1:]:
+            publish_status(gen.id, "running")
+
+        # Generate images via Stable Diffusion if available; else create placeholders
+        pipe = registry.get_txt2img(txt2img_model_id(gens[0]))
+
+        # Seeded rows with a cached result skip the pipeline entirely
+        misses = []
+        keys = {}
+        outcomes = []
+        for gen in gens:
+            output_path = scratch_path(f"gen_{gen.id}.png")
+            keys[gen.id] = result_cache_key(gen, txt2img_model_id(gen))
+            if result_cache.fetch(keys[gen.id], ".png", output_path):
+                outcomes.append(_outcome(gen, _store_output(output_path)))
+            else:
+                misses.append(gen)
+
+        images = run_txt2img_batch(pipe, misses) if misses else []
+
+        # Moderation and encoding work on the in-memory images; each is written to disk once
+        artifacts = _artifact_pipeline().run([
+            ImageArtifact(gen=gen, image=image, output_path=scratch_path(f"gen_{gen.id}.png"))
+            for gen, image in zip(misses, images)
+        ])
+        for artifact in artifacts:
+            if pipe is not None:
+                result_cache.store(keys[artifact.gen.id], artifact.output_path)
+            outcomes.append(_outcome(artifact.gen, _store_output(artifact.output_path), artifact))
+        # One transaction for the whole batch
+        finish(session, outcomes)
     except Exception as e:
-        if 'gen' in locals():
-            _update_status(session, gen, "failed", error=str(e))
+        fail(session, [gen.id for gen in gens], str(e))
         raise
     finally:
         session.close()
 
 
-@celery_app.task(name="app.workers.tasks.task_img2img")
-def task_img2img(gen_id: int):
+@celery_app.task(name="app.workers.tasks.task_img2img", bind=True)
+def task_img2img(self, gen_id: int):
     session = SessionLocal()
     try:
-        gen = session.query(Generation).get(gen_id)
-        if not gen:
+        gen = _claim(self, session, gen_id)
+        if gen is None:
             return
-        _update_status(session, gen, "running")
-
-        registry.load_all()
-        output_dir = os.path.join(settings.STORAGE_DIR, settings.IMAGES_DIR_NAME)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"gen_{gen.id}.png")
-
-        if registry.img2img_pipeline and gen.source_path and os.path.exists(gen.source_path):
-            init_image = Image.open(gen.source_path).convert("RGB")
-            pipe = registry.img2img_pipeline
-            result = pipe(
-                prompt=gen.prompt,
-                image=init_image,
-                strength=0.6,
-                guidance_scale=7.5,
-                num_inference_steps=gen.steps or 30,
-            )
-            image = result.images[0]
-            image.save(output_path)
-        else:
-            # Fallback: copy or create placeholder
-            if gen.source_path and os.path.exists(gen.source_path):
-                Image.open(gen.source_path).save(output_path)
-            else:
-                Image.new("RGB", (gen.width or 512, gen.height or 512), color=(0, 0, 0)).save(output_path)
 
-        gen.output_path = output_path
-        session.add(gen)
-        session.commit()
-
-        if gen.mode == "nsfw_smart":
-            _apply_nsfw_smart(gen, output_path, session)
+        model_id = registry.model_id_for_style(gen.style)
+        pipe = registry.get_img2img(model_id)
+        output_path = scratch_path(f"gen_{gen.id}.png")
+
+        # Read the source once: the same bytes feed the cache key and the decoder
+        source = _source_image(gen)
+        cache_key = result_cache_key(gen, model_id, source.digest if source else None)
+        artifact = None
+        locator = None
+        if result_cache.fetch(cache_key, ".png", output_path):
+            pass  # identical seeded job already produced this output
+        elif pipe and source:
+            steps = gen.steps or 30
+            # diffusers skips the first (1 - strength) of the schedule, so fewer steps actually run
+            denoise_steps = max(1, int(steps * IMG2IMG_STRENGTH))
+            with timed_inference("img2img", denoise_steps):
+                result = pipe(
+                    prompt=gen.prompt,
+                    image=source.image(),
+                    strength=IMG2IMG_STRENGTH,
+                    guidance_scale=7.5,
+                    num_inference_steps=steps,
+                    callback_on_step_end=step_callback([gen.id], denoise_steps),
+                )
+            artifact = ImageArtifact(gen=gen, image=result.images[0], output_path=output_path)
+            _artifact_pipeline().run([artifact])
+            result_cache.store(cache_key, output_path)
+        elif source:
+            # Fallback: the output is the source object itself (deduplicated, no copy)
+            output_path = None
+            locator = get_storage().put_file(source.path, digest=source.digest)
         else:
-            _update_status(session, gen, "completed")
+            artifact = ImageArtifact(
+                gen=gen, image=Image.new("RGB", (gen.width or 512, gen.height or 512), color=(0, 0, 0)),
+                output_path=output_path,
+            )
+            _artifact_pipeline().run([artifact])
+
+        if output_path is not None:
+            locator = _store_output(output_path)
+        finish(session, [_outcome(gen, locator, artifact)])
     except Exception as e:
-        if 'gen' in locals():
-            _update_status(session, gen, "failed", error=str(e))
+        fail(session, [gen_id], str(e))
         raise
     finally:
         session.close()
 
 
-@celery_app.task(name="app.workers.tasks.task_upscale")
-def task_upscale(gen_id: int):
+@celery_app.task(name="app.workers.tasks.task_upscale", bind=True)
+def task_upscale(self, gen_id: int):
     session = SessionLocal()
     try:
-        gen = session.query(Generation).get(gen_id)
-        if not gen:
+        gen = _claim(self, session, gen_id)
+        if gen is None:
             return
-        _update_status(session, gen, "running")
 
-        registry.load_all()
-        output_dir = os.path.join(settings.STORAGE_DIR, settings.UPSCALES_DIR_NAME)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"gen_{gen.id}.png")
-
-        if registry.upscaler and gen.source_path and os.path.exists(gen.source_path):
-            img = Image.open(gen.source_path).convert("RGB")
-            upscaled = registry.upscaler.predict(img)
-            upscaled.save(output_path)
+        upscaler = registry.get_upscaler()
+        output_path = scratch_path(f"gen_{gen.id}.png")
+
+        source = _source_image(gen)
+        cache_key = result_cache_key(gen, settings.REAL_ESRGAN_MODEL, source.digest if source else None)
+        artifact = None
+        locator = None
+        if result_cache.fetch(cache_key, ".png", output_path):
+            pass  # same source already upscaled by this model
+        elif upscaler and source:
+            # Streamed tile by tile into the PNG; moderation uses the source, which has the same content.
+            # Derivatives must match the output's size, so they are rendered from it once stored.
+            with timed_inference("upscale"):
+                TiledUpscaler.from_settings(upscaler).upscale_to_png(source.image(), output_path)
+            artifact = ImageArtifact(gen=gen, image=source.image(), output_path=output_path, encoded=True)
+            _moderation_pipeline().run([artifact])
+            result_cache.store(cache_key, output_path)
+        elif source:
+            # Placeholder: the source object as is
+            output_path = None
+            locator = get_storage().put_file(source.path, digest=source.digest)
         else:
-            # Placeholder: copy as is
-            if gen.source_path and os.path.exists(gen.source_path):
-                Image.open(gen.source_path).save(output_path)
-            else:
-                Image.new("RGB", (gen.width or 512, gen.height or 512), color=(0, 0, 0)).save(output_path)
-
-        gen.output_path = output_path
-        session.add(gen)
-        session.commit()
-
-        if gen.mode == "nsfw_smart":
-            _apply_nsfw_smart(gen, output_path, session)
-        else:
-            _update_status(session, gen, "completed")
+            artifact = ImageArtifact(
+                gen=gen, image=Image.new("RGB", (gen.width or 512, gen.height or 512), color=(0, 0, 0)),
+                output_path=output_path,
+            )
+            _artifact_pipeline().run([artifact])
+
+        if output_path is not None:
+            locator = _store_output(output_path)
+            if artifact is not None and artifact.encoded:
+                with timed(STAGE_SECONDS, stage="derivatives"):
+                    render_stored(locator)
+        finish(session, [_outcome(gen, locator, artifact)])
     except Exception as e:
-        if 'gen' in locals():
-            _update_status(session, gen, "failed", error=str(e))
+        fail(session, [gen_id], str(e))
         raise
     finally:
         session.close()
 
 
-@celery_app.task(name="app.workers.tasks.task_txt2video")
-def task_txt2video(gen_id: int):
+def _encode_video_output(gen: Generation, source: FrameSource) -> Outcome:
+    """Stream ``source`` into the encoder and store the MP4."""
+    output_path = scratch_path(f"gen_{gen.id}.mp4")
+    try:
+        with timed(STAGE_SECONDS, stage="encode"):
+            encode_video(source, output_path)
+        locator = _store_output(output_path)
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    # nsfw_smart assesses the first frame; the clip is derived from it
+    return _outcome(gen, locator, frame=next(iter(source)) if gen.mode == "nsfw_smart" else None)
+
+
+@celery_app.task(name="app.workers.tasks.task_txt2video", bind=True)
+def task_txt2video(self, gen_id: int):
     session = SessionLocal()
     try:
-        gen = session.query(Generation).get(gen_id)
-        if not gen:
+        gen = _claim(self, session, gen_id)
+        if gen is None:
             return
-        _update_status(session, gen, "running")
 
-        # Placeholder video creation using ffmpeg: create a black mp4 with prompt as metadata
-        output_dir = os.path.join(settings.STORAGE_DIR, settings.VIDEOS_DIR_NAME)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"gen_{gen.id}.mp4")
+        # No text-to-video model yet: a black placeholder clip
+        source = SolidColorSource(gen.width or 512, gen.height or 512, settings.VIDEO_FPS, settings.VIDEO_SECONDS)
+        finish(session, [_encode_video_output(gen, source)])
+    except Exception as e:
+        fail(session, [gen_id], str(e))
+        raise
+    finally:
+        session.close()
 
-        # Try to create a 2-second black video using ffmpeg if available
-        try:
-            os.system(
-                f"ffmpeg -y -f lavfi -i color=c=black:s={gen.width or 512}x{gen.height or 512}:d=2 -pix_fmt yuv420p {output_path} >/dev/null 2>&1"
-            )
-        except Exception:
-            # If ffmpeg not available, just create an empty file
-            open(output_path, "wb").close()
 
-        gen.output_path = output_path
-        session.add(gen)
-        session.commit()
+@celery_app.task(name="app.workers.tasks.task_img2video", bind=True)
+def task_img2video(self, gen_id: int):
+    session = SessionLocal()
+    try:
+        gen = _claim(self, session, gen_id)
+        if gen is None:
+            return
 
-        # NSFW smart applies conceptually; videos could be assessed by first frame for placeholder
-        if gen.mode == "nsfw_smart":
-            _apply_nsfw_smart(gen, output_path, session)
+        width, height = gen.width or 512, gen.height or 512
+        source_image = _source_image(gen)
+        pipe = registry.get_img2video() if source_image else None
+        if pipe is not None:
+            with timed_inference("img2video"):
+                result = pipe(
+                    source_image.image().resize((width, height)),
+                    height=height,
+                    width=width,
+                    decode_chunk_size=8,
+                    generator=make_generators(pipe, [gen.seed])[0],
+                )
+            source = PipelineFrameSource(result.frames[0], settings.VIDEO_FPS)
+        elif source_image:
+            # Placeholder: slow zoom over the source image
+            source = StillImageSource(source_image.image(), width, height, settings.VIDEO_FPS, settings.VIDEO_SECONDS)
         else:
-            _update_status(session, gen, "completed")
+            source = SolidColorSource(width, height, settings.VIDEO_FPS, settings.VIDEO_SECONDS)
+        finish(session, [_encode_video_output(gen, source)])
     except Exception as e:
-        if 'gen' in locals():
-            _update_status(session, gen, "failed", error=str(e))
+        fail(session, [gen_id], str(e))
         raise
     finally:
         session.close()
 
 
-@celery_app.task(name="app.workers.tasks.task_img2video")
-def task_img2video(gen_id: int):
+@celery_app.task(name="app.workers.tasks.task_moderate")
+def task_moderate(gen_id: int):
+    """Re-run image moderation on an existing output (e.g. rows finished before a detector was deployed)."""
     session = SessionLocal()
     try:
-        gen = session.query(Generation).get(gen_id)
-        if not gen:
+        gen = session.get(Generation, gen_id)
+        if not gen or not gen.output_path:
             return
-        _update_status(session, gen, "running")
-
-        output_dir = os.path.join(settings.STORAGE_DIR, settings.VIDEOS_DIR_NAME)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"gen_{gen.id}.mp4")
-
-        if gen.source_path and os.path.exists(gen.source_path):
-            # Create a short zoom/pan effect video from the image if ffmpeg is available
-            try:
-                # Simple still image to video
-                os.system(
-                    f"ffmpeg -y -loop 1 -t 2 -i {gen.source_path} -vf scale={gen.width or 512}:{gen.height or 512} -pix_fmt yuv420p {output_path} >/dev/null 2>&1"
-                )
-            except Exception:
-                open(output_path, "wb").close()
-        else:
-            try:
-                os.system(
-                    f"ffmpeg -y -f lavfi -i color=c=black:s={gen.width or 512}x{gen.height or 512}:d=2 -pix_fmt yuv420p {output_path} >/dev/null 2>&1"
-                )
-            except Exception:
-                open(output_path, "wb").close()
-
-        gen.output_path = output_path
-        session.add(gen)
+        try:
+            output = get_storage().local_path(gen.output_path)
+        except FileNotFoundError:
+            return
+        res = _nsfw_classifier().classify_image(output)
+        tags = sorted({*(gen.nsfw_tags.split(",") if gen.nsfw_tags else []), *res.tags})
+        values = {"nsfw_tags": ",".join(tags) or None}
+        status = gen.status
+        if res.action == "flag":
+            values["nsfw_action"] = "flag"
+            # Never override a moderator's decision; the CAS also loses to one made since the read
+            if status == "completed" and not gen.reviews:
+                if session.execute(transition_stmt([gen.id], ["completed"], "flagged", **values)).rowcount == 1:
+                    status, values = "flagged", {}
+        if values:
+            session.execute(values_stmt(gen.id, **values))
         session.commit()
+        publish_status(gen.id, status)
+    finally:
+        session.close()
 
-        if gen.mode == "nsfw_smart":
-            _apply_nsfw_smart(gen, output_path, session)
-        else:
-            _update_status(session, gen, "completed")
-    except Exception as e:
-        if 'gen' in locals():
-            _update_status(session, gen, "failed", error=str(e))
-        raise
+
+@celery_app.task(name="app.workers.tasks.task_reap_stale")
+def task_reap_stale():
+    """Celery beat: requeue (or fail) jobs lost along with their worker or broker message."""
+    session = SessionLocal()
+    try:
+        ids = reap(session)
+        if not ids:
+            return 0
+        rows = session.execute(
+            select(Generation.id, Generation.type, Generation.source_path, User.is_admin, User.is_paid)
+            .join(User, User.id == Generation.user_id)
+            .where(Generation.id.in_(ids))
+        ).all()
     finally:
         session.close()
+    group(signature_for(task_for_generation(row), row.id, row) for row in rows).apply_async()
+    return len(rows)
@@ -0,0 +1,79 @@
+"""Micro-benchmark: compiled NSFW prompt matcher vs the previous per-keyword substring scans.
+
+Run from backend/:  python -m benchmarks.bench_nsfw_prompt
+
+The substring scan costs O(keywords x prompt length); the compiled matcher is
+one pass over the prompt whatever the list size. With the built-in lists the
+two are within about 10-20% of each other (the compiled matcher is not a
+long-prompt speedup there; what it buys is whole-word matching with
+inflections). It only pulls clearly ahead once a keywords file grows the list
+to hundreds of entries, which the second run simulates with 500 synthetic ones.
+"""
+from __future__ import annotations
+import random
+import string
+import time
+
+from app.core.nsfw_pipeline import DEFAULT_KEYWORDS, KeywordMatcher, NSFWSmartClassifier, CompiledKeywords
+
+WORDS = (
+    "a highly detailed portrait of an astronaut riding a horse on mars cinematic lighting "
+    "volumetric fog trending on artstation octane render 8k masterpiece best quality "
+    "intricate ornate baroque architecture golden hour bokeh depth of field document 1969"
+).split()
+
+
+def make_keywords(extra: int, seed: int = 0):
+    rng = random.Random(seed)
+    keywords = {tag: set(words) for tag, words in DEFAULT_KEYWORDS.items()}
+    for _ in range(extra):
+        keywords["explicit"].add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10))))
+    return keywords
+
+
+def substring_classifier(keywords):
+    lists = list(keywords.values())
+
+    def classify(prompt: str):
+        lower = prompt.lower()
+        return [any(k in lower for k in words) for words in lists]
+
+    return classify
+
+
+def compiled_classifier(keywords):
+    matcher = KeywordMatcher()
+    matcher.compiled = CompiledKeywords(keywords)
+    return NSFWSmartClassifier(matcher).classify_prompt
+
+
+def make_prompts(n: int, words: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(n)]
+
+
+def bench(fn, prompts, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for p in prompts:
+            fn(p)
+        best = min(best, time.perf_counter() - start)
+    return best / len(prompts)
+
+
+def main():
+    for extra in (0, 500):
+        keywords = make_keywords(extra)
+        old_fn, new_fn = substring_classifier(keywords), compiled_classifier(keywords)
+        total = sum(len(v) for v in keywords.values())
+        print(f"{total} keywords ({'built-in lists' if not extra else f'built-in + {extra} synthetic'})")
+        for words in (16, 75, 300, 1000):
+            prompts = make_prompts(500, words)
+            old = bench(old_fn, prompts)
+            new = bench(new_fn, prompts)
+            print(f"  {words:>5} words  substring {old * 1e6:8.1f} us  compiled {new * 1e6:8.1f} us  x{old / new:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
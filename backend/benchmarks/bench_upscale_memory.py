@@ -0,0 +1,84 @@
+"""Peak memory of whole-image vs tiled 4x upscaling, with a stub upscaler.
+
+Run from backend/:  python -m benchmarks.bench_upscale_memory
+
+Each case runs in a fresh process; the reported figure is peak RSS minus the
+RSS once the input image is decoded, i.e. what the upscale itself costs. The
+whole-image path grows with the output (16x the input pixels); the tiled path
+levels off at the memory budget (BUDGET_MB here) once that starts to bind.
+"""
+from __future__ import annotations
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = (512, 1024, 2048, 3072)
+BUDGET_MB = 96
+
+
+class StubUpscaler:
+    """Nearest-neighbour 4x: the memory profile of a real model's I/O without the model."""
+
+    scale = 4
+
+    def predict(self, image):
+        import numpy as np
+        from PIL import Image
+
+        return Image.fromarray(np.asarray(image).repeat(4, axis=0).repeat(4, axis=1))
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(mode: str, size: int) -> None:
+    import numpy as np
+    from PIL import Image
+
+    from app.core.artifacts import save_image
+    from app.core.upscale import TiledUpscaler
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 255, (size, size, 3), dtype=np.uint8))
+    base = _rss_mb()
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out.png")
+        if mode == "whole":
+            save_image(StubUpscaler().predict(image), path)
+        else:
+            TiledUpscaler.from_settings(StubUpscaler()).upscale_to_png(image, path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(f"{peak - base:.1f} {elapsed:.2f}")
+
+
+def main():
+    print(f"tile budget {BUDGET_MB} MB")
+    print(f"{'input':>10} {'whole MB':>10} {'tiled MB':>10} {'whole s':>8} {'tiled s':>8}")
+    for size in SIZES:
+        results = {}
+        for mode in ("whole", "tiled"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_upscale_memory", "--child", mode, str(size)],
+                check=True, capture_output=True, text=True,
+                env={**os.environ, "UPSCALE_MEMORY_BUDGET_MB": str(BUDGET_MB)},
+            ).stdout.split()
+            results[mode] = (float(out[0]), float(out[1]))
+        print(f"{size:>5}x{size:<4} {results['whole'][0]:>10.1f} {results['tiled'][0]:>10.1f} "
+              f"{results['whole'][1]:>8.2f} {results['tiled'][1]:>8.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
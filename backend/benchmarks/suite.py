@@ -0,0 +1,323 @@
+"""Reproducible CPU-only benchmark suite for the generation pipeline.
+
+Run from backend/:  python -m benchmarks.suite [--only e2e,auth] [--output out.json]
+
+Benchmarks:
+
+* ``e2e``     API submit -> worker completion with Celery in eager mode and a
+              deterministic stub diffusion pipeline (``--step-ms`` per step),
+              plus the DB statements and commits each job costs
+* ``prompt``  ``classify_prompt`` throughput
+* ``encode``  PNG output and WebP derivative encode time per resolution
+* ``auth``    per-request cost of authentication, token cache hit and miss
+
+Results are printed (or written with ``--output``) as JSON and compared with
+``benchmarks/baseline.json``; metrics ending in ``_per_s`` are better higher,
+all others lower. ``--save-baseline`` replaces the baseline with this run and
+``--fail-on-regression`` exits 1 when a metric is worse than ``--tolerance``.
+Baselines only compare on the same machine: regenerate it on the box you
+benchmark on before judging a change.
+
+Everything runs in a scratch directory against SQLite unless DATABASE_URL /
+STORAGE_DIR are set. Redis is not used unless EVENTS_REDIS_URL,
+ADMISSION_REDIS_URL or AUTH_CACHE_REDIS_URL point at one.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SCHEMA = 1
+
+
+def _prepare_env() -> None:
+    """Settings are read at import time, so this has to run before any ``app`` import."""
+    scratch = tempfile.mkdtemp(prefix="bench_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{scratch}/bench.db")
+    os.environ.setdefault("STORAGE_DIR", os.path.join(scratch, "storage"))
+    for name in ("EVENTS_REDIS_URL", "ADMISSION_REDIS_URL", "AUTH_CACHE_REDIS_URL"):
+        os.environ.setdefault(name, "")
+    os.environ["CELERY_TASK_ALWAYS_EAGER"] = "true"
+    os.environ["ENV"] = "dev"
+
+
+def stub_image(seed: int, width: int, height: int):
+    """Smooth gradient plus mild noise: compresses roughly like a generated photo, unlike pure noise."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    noise = rng.normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+class StubTxt2ImgPipeline:
+    """Stands in for the diffusers pipeline: fixed cost per step, images determined by the seed."""
+
+    def __init__(self, step_ms: float) -> None:
+        self.step_s = step_ms / 1000.0
+
+    def __call__(self, prompt, num_inference_steps, width, height, generator=None,
+                 callback_on_step_end=None, **_):
+        for step in range(num_inference_steps):
+            time.sleep(self.step_s)
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, step, {})
+        images = [stub_image(zlib.crc32(p.encode()), width, height) for p in prompt]
+        return type("Output", (), {"images": images})()
+
+
+def _timings(fn: Callable[[int], None], n: int) -> List[float]:
+    out = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        out.append(time.perf_counter() - start)
+    return out
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _round(metrics: Dict[str, float]) -> Dict[str, float]:
+    return {k: float(f"{v:.4g}") for k, v in metrics.items()}
+
+
+class StatementCounter:
+    """Counts SQL statements by verb, and commits, on the sync engine and the API's async engine."""
+
+    def __init__(self, *engines) -> None:
+        from sqlalchemy import event
+
+        self.counts: Dict[str, int] = {}
+        self.active = False
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._statement)
+            event.listen(engine, "commit", self._commit)
+
+    def _bump(self, name: str) -> None:
+        if self.active:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _statement(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self._bump(statement.lstrip().split(None, 1)[0].lower())
+
+    def _commit(self, conn) -> None:
+        self._bump("commit")
+
+
+def _client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    return TestClient(app)
+
+
+def _token(client, email: str) -> Dict[str, str]:
+    client.post("/api/v1/auth/register", json={"email": email, "password": "bench-password"})
+    r = client.post("/api/v1/auth/login", data={"username": email, "password": "bench-password"})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def bench_e2e(args) -> Dict[str, float]:
+    from sqlalchemy import func, select
+
+    from app.config import get_settings
+    from app.core.models_loader import registry
+    from app.db import SessionLocal, engine, get_async_engine
+    from app.models import Generation
+
+    # Installed as the resident model so the real registry / cache lookup path is exercised
+    model_id = get_settings().SD_MODEL_ID
+    registry.cache.get_or_load(registry._key("txt2img", model_id), lambda: StubTxt2ImgPipeline(args.step_ms))
+    counter = StatementCounter(engine, get_async_engine().sync_engine)
+
+    with _client() as client:
+        headers = _token(client, "bench-e2e@example.com")
+
+        def submit(i: int) -> None:
+            payload = {"type": "image", "mode": "nsfw_smart", "prompt": f"bench prompt {i} lighthouse at dusk",
+                       "seed": i, "steps": args.steps, "width": args.size, "height": args.size}
+            client.post("/api/v1/generate/image", json=payload, headers=headers).raise_for_status()
+
+        _timings(lambda i: submit(-1 - i), 2)  # warm-up: classifier load, first encodes
+        counter.active = True
+        latencies = _timings(submit, args.jobs)
+        counter.active = False
+
+    with SessionLocal() as s:
+        done = s.scalar(select(func.count()).where(Generation.status.in_(("completed", "flagged")), Generation.seed >= 0))
+    if done != args.jobs:
+        raise RuntimeError(f"only {done} of {args.jobs} jobs completed")
+    inference = args.steps * args.step_ms / 1000.0
+    metrics = {
+        "jobs_per_s": args.jobs / sum(latencies),
+        "latency_p50_ms": _pct(latencies, 0.5) * 1000,
+        "latency_p95_ms": _pct(latencies, 0.95) * 1000,
+        # Everything but the stub's sleeps: API, queueing, moderation, encode, storage, DB
+        "overhead_p50_ms": (_pct(latencies, 0.5) - inference) * 1000,
+    }
+    for verb, n in sorted(counter.counts.items()):
+        metrics[f"db_{verb}_per_job"] = n / args.jobs
+    return metrics
+
+
+def bench_prompt(args) -> Dict[str, float]:
+    from app.core.nsfw_pipeline import NSFWSmartClassifier
+    from benchmarks.bench_nsfw_prompt import bench, make_prompts
+
+    classify = NSFWSmartClassifier().classify_prompt
+    # Best of several passes: the least disturbed run is the most repeatable figure
+    return {
+        f"prompts_{words}w_per_s": 1.0 / bench(classify, make_prompts(1000, words), repeat=7)
+        for words in (16, 75, 300)
+    }
+
+
+def bench_encode(args) -> Dict[str, float]:
+    from app.core.artifacts import save_image
+    from app.core.derivatives import render_derivative
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        png, webp = os.path.join(tmp, "out.png"), os.path.join(tmp, "out.webp")
+        for size in (256, 512, 1024, 2048):
+            image = stub_image(size, size, size)
+            repeat = max(3, 16 * 512 * 512 // (size * size))
+            metrics[f"png_{size}_ms"] = min(_timings(lambda _: save_image(image, png), repeat)) * 1000
+            metrics[f"png_{size}_kb"] = os.path.getsize(png) / 1024
+            # Full-size WebP so the figures compare across resolutions (derivatives downscale first)
+            metrics[f"webp_{size}_ms"] = min(
+                _timings(lambda _: render_derivative(image, size, "webp", webp), repeat)
+            ) * 1000
+    return metrics
+
+
+def bench_auth(args) -> Dict[str, float]:
+    from app.core.auth_cache import auth_cache
+
+    n = args.requests
+    with _client() as client:
+        headers = _token(client, "bench-auth@example.com")
+        client.get("/api/v1/auth/me", headers=headers).raise_for_status()
+        public = _timings(lambda _: client.get("/health"), n)
+        cached = _timings(lambda _: client.get("/api/v1/auth/me", headers=headers), n)
+
+        def uncached(_):
+            auth_cache.clear()
+            client.get("/api/v1/auth/me", headers=headers)
+
+        verified = _timings(uncached, n)
+    base = statistics.median(public)
+    return {
+        "public_request_us": base * 1e6,
+        "authed_cached_us": statistics.median(cached) * 1e6,
+        "authed_uncached_us": statistics.median(verified) * 1e6,
+        "auth_overhead_cached_us": (statistics.median(cached) - base) * 1e6,
+        "auth_overhead_uncached_us": (statistics.median(verified) - base) * 1e6,
+    }
+
+
+BENCHMARKS = {"e2e": bench_e2e, "prompt": bench_prompt, "encode": bench_encode, "auth": bench_auth}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float):
+    """Per metric: baseline, current, change (positive = better) and a verdict."""
+    out = {}
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if base is None:
+                continue
+            higher_better = metric.endswith("_per_s")
+            if base == 0:
+                change = 0.0 if value == 0 else (1.0 if higher_better == (value > 0) else -1.0)
+            else:
+                change = (value - base) / abs(base) * (1 if higher_better else -1)
+            verdict = "regressed" if change < -tolerance else "improved" if change > tolerance else "same"
+            out[f"{name}.{metric}"] = {"baseline": base, "current": value, "change": round(change, 4), "verdict": verdict}
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated subset of " + ",".join(BENCHMARKS))
+    parser.add_argument("--jobs", type=int, default=40, help="e2e: jobs submitted")
+    parser.add_argument("--steps", type=int, default=20, help="e2e: inference steps per job")
+    parser.add_argument("--step-ms", type=float, default=5.0, help="e2e: stub pipeline cost per step")
+    parser.add_argument("--size", type=int, default=512, help="e2e: output width and height")
+    parser.add_argument("--requests", type=int, default=300, help="auth: requests per variant")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    _prepare_env()
+    selected = [b.strip() for b in args.only.split(",") if b.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    params = {k: getattr(args, k) for k in ("jobs", "steps", "step_ms", "size", "requests")}
+    results = {}
+    for name in selected:
+        print(f"running {name}", file=sys.stderr)
+        results[name] = _round(BENCHMARKS[name](args))
+
+    report = {
+        "schema": SCHEMA,
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "params": params,
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        },
+        "results": results,
+    }
+    regressed = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("params") != params:
+            print("warning: baseline was run with different parameters", file=sys.stderr)
+        report["comparison"] = compare(results, baseline.get("results", {}), args.tolerance)
+        regressed = [k for k, v in report["comparison"].items() if v["verdict"] == "regressed"]
+        for key, row in report["comparison"].items():
+            print(f"{key:<45} {row['baseline']:>12} {row['current']:>12} {row['change']:>+8.1%}  {row['verdict']}",
+                  file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(text + "\n")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if regressed:
+        print(f"{len(regressed)} metric(s) regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+    return 1 if regressed and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
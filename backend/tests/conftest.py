@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+# Settings are read at import time: point everything at a scratch directory before ``app`` is imported
+_scratch = tempfile.mkdtemp(prefix="tests_")
+os.environ.update({
+    "ENV": "test",
+    "DATABASE_URL": f"sqlite:///{_scratch}/test.db",
+    "STORAGE_DIR": os.path.join(_scratch, "storage"),
+    "CELERY_TASK_ALWAYS_EAGER": "true",
+    "CELERY_BROKER_URL": "memory://",
+    "EVENTS_REDIS_URL": "",
+    "ADMISSION_REDIS_URL": "",
+    "AUTH_CACHE_REDIS_URL": "",
+})
+
+import pytest  # noqa: E402
+
+from app.core.auth_cache import auth_cache  # noqa: E402
+from app.db import Base, SessionLocal, engine  # noqa: E402
+from app.models import Generation, User  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    Base.metadata.create_all(bind=engine)
+    s = SessionLocal()
+    try:
+        yield s
+    finally:
+        s.close()
+        with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+        # Bulk deletes skip the invalidation listener, and SQLite reuses the ids
+        auth_cache.clear()
+
+
+@pytest.fixture
+def user(session):
+    u = User(email="user@example.com", password_hash="x")
+    session.add(u)
+    session.commit()
+    return u
+
+
+@pytest.fixture
+def make_generation(session, user):
+    def make(**values):
+        values.setdefault("type", "image")
+        values.setdefault("mode", "sfw")
+        values.setdefault("prompt", "a lighthouse at dusk")
+        gen = Generation(user_id=user.id, **values)
+        session.add(gen)
+        session.commit()
+        return gen
+
+    return make
+
+
+@pytest.fixture
+def client(session):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def auth_headers(user):
+    from app.security import create_access_token
+
+    return {"Authorization": f"Bearer {create_access_token(subject=user.id)}"}
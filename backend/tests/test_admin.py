@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import select
+
+from app.core.lifecycle import claim
+from app.models import Generation, ModerationReview, User
+from app.security import create_access_token
+
+
+@pytest.fixture
+def admin_headers(session):
+    admin = User(email="admin@example.com", password_hash="x", is_admin=True)
+    session.add(admin)
+    session.commit()
+    return {"Authorization": f"Bearer {create_access_token(subject=admin.id)}"}
+
+
+def _status(session, gen_id):
+    session.expire_all()
+    return session.scalar(select(Generation.status).where(Generation.id == gen_id))
+
+
+def test_flagging_a_queued_job_is_refused_and_it_still_runs(client, admin_headers, session, make_generation):
+    gen = make_generation(status="queued")
+
+    r = client.post(f"/api/v1/admin/review/{gen.id}", json={"action": "flag"}, headers=admin_headers)
+
+    assert r.status_code == 409
+    assert _status(session, gen.id) == "queued"
+    assert session.scalar(select(ModerationReview.id)) is None
+    assert claim(session, gen.id)
+
+
+def test_blocking_a_queued_job_stops_it(client, admin_headers, session, make_generation):
+    gen = make_generation(status="queued")
+
+    r = client.post(f"/api/v1/admin/review/{gen.id}", json={"action": "block", "notes": "spam"}, headers=admin_headers)
+
+    assert r.status_code == 200
+    assert _status(session, gen.id) == "blocked"
+    assert not claim(session, gen.id)
+
+
+def test_running_jobs_cannot_be_reviewed(client, admin_headers, session, make_generation):
+    gen = make_generation(status="running")
+    r = client.post(f"/api/v1/admin/review/{gen.id}", json={"action": "block"}, headers=admin_headers)
+    assert r.status_code == 409
+    assert _status(session, gen.id) == "running"
+
+
+def test_bulk_review_reports_what_it_skipped(client, admin_headers, session, make_generation):
+    flagged = make_generation(status="flagged", output_path="/x.png")
+    completed = make_generation(status="completed", output_path="/y.png")
+    queued = make_generation(status="queued")
+    failed = make_generation(status="failed")
+
+    r = client.post("/api/v1/admin/review/bulk", headers=admin_headers, json={
+        "generation_ids": [flagged.id, completed.id, queued.id, failed.id, 9999], "action": "allow", "tags": "soft",
+    })
+
+    assert r.json() == {"reviewed": 2, "missing": [9999], "skipped": [queued.id, failed.id]}
+    assert [_status(session, g.id) for g in (flagged, completed, queued, failed)] == ["completed", "completed", "queued", "failed"]
+    session.expire_all()
+    assert session.get(Generation, completed.id).nsfw_tags == "soft"
+    assert sorted(session.scalars(select(ModerationReview.generation_id))) == sorted([flagged.id, completed.id])
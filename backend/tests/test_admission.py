@@ -0,0 +1,112 @@
+"""Admission control with its in-process state (no Redis)."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.admission import AdmissionController, admission, in_flight_counts_stmt
+from app.core.lifecycle import Outcome, finish
+from app.models import User
+
+ALICE = SimpleNamespace(id=1, is_admin=False)
+ADMIN = SimpleNamespace(id=2, is_admin=True)
+
+
+def _controller(**kwargs):
+    kwargs.setdefault("rates", {})
+    kwargs.setdefault("max_in_flight", 0)
+    kwargs.setdefault("max_queue_depth", 0)
+    return AdmissionController(retry_after_seconds=7, **kwargs)
+
+
+def _admit(controller, user, costs):
+    asyncio.run(controller.admit(user, costs))
+
+
+def _rejected(controller, user, costs) -> HTTPException:
+    with pytest.raises(HTTPException) as exc:
+        _admit(controller, user, costs)
+    assert exc.value.status_code == 429
+    return exc.value
+
+
+def test_token_bucket_allows_the_burst_then_says_when_to_retry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.core.admission.time.time", lambda: now[0])
+    controller = _controller(rates={"video": (1 / 60, 2)})
+
+    _admit(controller, ALICE, {"video": 2})
+    exc = _rejected(controller, ALICE, {"video": 1})
+    assert exc.headers["Retry-After"] == "60"
+
+    now[0] += 30
+    assert _rejected(controller, ALICE, {"video": 1}).headers["Retry-After"] == "30"
+    now[0] += 30
+    _admit(controller, ALICE, {"video": 1})
+    _admit(controller, ALICE, {"image": 5})  # other types are not limited
+    assert controller.rejected == {"rate": 2}
+
+
+def test_batches_above_the_burst_are_a_400():
+    controller = _controller(rates={"video": (1.0, 2)})
+    with pytest.raises(HTTPException) as exc:
+        _admit(controller, ALICE, {"video": 3})
+    assert exc.value.status_code == 400
+
+
+def test_in_flight_cap_frees_up_on_release():
+    controller = _controller(max_in_flight=2)
+    _admit(controller, ALICE, {"image": 2})
+    exc = _rejected(controller, ALICE, {"image": 1})
+    assert exc.headers["Retry-After"] == "7"
+    _admit(controller, SimpleNamespace(id=3, is_admin=False), {"image": 2})  # the cap is per user
+
+    controller.release([ALICE.id])
+    _admit(controller, ALICE, {"image": 1})
+    assert controller.rejected == {"in_flight": 1}
+
+
+def test_queue_depth_is_global_backpressure():
+    controller = _controller(max_queue_depth=3)
+    _admit(controller, ALICE, {"image": 2})
+    _rejected(controller, SimpleNamespace(id=3, is_admin=False), {"image": 2})
+    controller.reconcile([])  # everything finished
+    _admit(controller, SimpleNamespace(id=3, is_admin=False), {"image": 2})
+    assert controller.rejected == {"backpressure": 1}
+
+
+def test_admins_are_never_limited_or_counted():
+    controller = _controller(rates={"video": (1 / 60, 1)}, max_in_flight=1, max_queue_depth=1)
+    for _ in range(3):
+        _admit(controller, ADMIN, {"video": 1})
+    assert controller.stats()["in_flight_local"] == 0
+
+
+def test_admin_jobs_hold_no_slot_to_release_or_reconcile(session, user, make_generation):
+    admin = User(email="admin@example.com", password_hash="x", is_admin=True)
+    session.add(admin)
+    session.commit()
+    mine = make_generation(status="running")
+    theirs = make_generation(status="running")
+    theirs.user_id = admin.id
+    make_generation(status="queued")
+    session.commit()
+
+    assert sorted(session.execute(in_flight_counts_stmt()).all()) == [(user.id, 2)]
+
+    admission.reconcile([(user.id, 2)])
+    finish(session, [Outcome(mine.id, "completed"), Outcome(theirs.id, "completed")])
+    assert admission.stats()["in_flight_local"] == 1
+    admission.reconcile([])
+
+
+def test_generate_is_429_with_retry_after(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(admission, "max_in_flight", 1)
+    admission.reconcile([])
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json={"jobs": [
+        {"type": "image", "mode": "sfw", "prompt": "x"},
+        {"type": "image", "mode": "sfw", "prompt": "y"},
+    ]})
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == str(admission.retry_after_seconds)
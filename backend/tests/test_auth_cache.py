@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+from app.core.auth_cache import AuthCache, UserSnapshot, auth_cache
+
+SNAPSHOT = UserSnapshot(id=1, email="user@example.com", is_admin=False, is_paid=False, created_at=None)
+
+
+def _get(cache, token):
+    return asyncio.run(cache.get(token))
+
+
+def _put(cache, token, snapshot, expires_at=None):
+    asyncio.run(cache.put(token, snapshot, expires_at))
+
+
+def test_entries_are_hits_until_the_ttl_or_the_token_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.core.auth_cache.time.monotonic", lambda: now[0])
+    cache = AuthCache(ttl_seconds=60, max_entries=10)
+
+    _put(cache, "t", SNAPSHOT)
+    _put(cache, "short", SNAPSHOT, expires_at=time.time() + 10)
+    assert _get(cache, "t") == SNAPSHOT
+    now[0] += 30
+    assert _get(cache, "t") == SNAPSHOT
+    assert _get(cache, "short") is None
+    now[0] += 31
+    assert _get(cache, "t") is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_updating_a_user_invalidates_after_commit(session, user):
+    snapshot = UserSnapshot.from_user(user)
+    _put(auth_cache, "t", snapshot)
+
+    user.is_paid = True
+    session.flush()
+    assert _get(auth_cache, "t") == snapshot  # not committed yet
+    session.rollback()
+    assert _get(auth_cache, "t") == snapshot
+
+    user.is_paid = True
+    session.commit()
+    assert _get(auth_cache, "t") is None
+
+
+def test_redis_invalidation_runs_off_the_event_loop(monkeypatch):
+    cache = AuthCache(ttl_seconds=60, max_entries=10, redis_url="redis://cache")
+    done = threading.Event()
+    calls = []
+
+    def invalidate(user_ids):
+        calls.append((list(user_ids), threading.get_ident()))
+        done.set()
+
+    monkeypatch.setattr(cache, "_invalidate_redis", invalidate)
+
+    async def update():
+        cache.invalidate_users([1, 2])
+        await asyncio.get_running_loop().run_in_executor(None, done.wait, 5)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(update())
+    assert calls[0][0] == [1, 2]
+    assert calls[0][1] != loop_thread
+
+
+class BrokenRedis:
+    def __init__(self):
+        self.calls = 0
+
+    async def get(self, key):
+        self.calls += 1
+        raise ConnectionError("redis unreachable")
+
+    def pipeline(self, transaction=True):
+        self.calls += 1
+        raise ConnectionError("redis unreachable")
+
+
+def test_unreachable_redis_is_bypassed_with_backoff():
+    cache = AuthCache(ttl_seconds=60, max_entries=10, redis_url="redis://cache")
+    cache._async_redis = broken = BrokenRedis()
+
+    assert _get(cache, "t") is None
+    _put(cache, "t", SNAPSHOT)
+    assert _get(cache, "t") is None
+    assert broken.calls == 1
+    assert cache.misses == 2
@@ -0,0 +1,48 @@
+import pytest
+from PIL import Image
+
+from app.workers.batching import Txt2ImgBatcher, run_txt2img_batch
+
+torch = pytest.importorskip("torch")
+
+
+class SeededStubPipeline:
+    """Each image is a solid colour drawn from that row's generator, like a real sampler's initial noise."""
+
+    device = "cpu"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompt, generator, width, height, **_):
+        self.calls.append(list(prompt))
+        images = []
+        for g in generator:
+            r, gr, b = torch.randint(0, 256, (3,), generator=g).tolist()
+            images.append(Image.new("RGB", (width, height), (r, gr, b)))
+        return type("Output", (), {"images": images})()
+
+
+def test_collect_claims_only_compatible_rows(session, make_generation):
+    leader = make_generation(seed=1, width=64, height=64, steps=4)
+    mate = make_generation(seed=2, width=64, height=64, steps=4)
+    make_generation(seed=3, width=128, height=64, steps=4)
+    make_generation(seed=4, width=64, height=64, steps=8)
+
+    gens = Txt2ImgBatcher(max_batch_size=4, window_s=0).collect(session, leader.id)
+
+    assert [g.id for g in gens] == [leader.id, mate.id]
+    assert {g.status for g in gens} == {"running"}
+
+
+def test_batched_rows_keep_their_own_seeds(session, make_generation):
+    gens = [make_generation(prompt=f"p{i}", seed=seed, width=16, height=16, steps=4) for i, seed in enumerate((7, 8, 7))]
+    pipe = SeededStubPipeline()
+
+    batched = run_txt2img_batch(pipe, gens)
+    alone = [run_txt2img_batch(pipe, [g])[0] for g in gens]
+
+    assert len(pipe.calls[0]) == 3
+    assert [im.getpixel((0, 0)) for im in batched] == [im.getpixel((0, 0)) for im in alone]
+    assert batched[0].getpixel((0, 0)) == batched[2].getpixel((0, 0))
+    assert batched[0].getpixel((0, 0)) != batched[1].getpixel((0, 0))
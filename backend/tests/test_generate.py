@@ -0,0 +1,150 @@
+import io
+
+import pytest
+
+from PIL import Image
+from sqlalchemy import select
+
+from app.models import Generation, SourceUpload, User
+
+
+def _upload(client, headers):
+    body = io.BytesIO()
+    Image.new("RGB", (32, 32), (10, 20, 30)).save(body, format="PNG")
+    r = client.post("/api/v1/sources", content=body.getvalue(), headers={**headers, "Content-Type": "image/png"})
+    assert r.status_code == 201
+    return r.json()["id"]
+
+
+def test_client_supplied_paths_are_ignored(client, auth_headers, session):
+    r = client.post("/api/v1/generate/image", headers=auth_headers, json={
+        "type": "upscale", "mode": "sfw", "prompt": "x", "source_path": "/etc/passwd",
+    })
+    assert r.status_code == 200
+    assert session.scalar(select(Generation.source_path).where(Generation.id == r.json()["id"])) is None
+
+
+def test_uploaded_source_is_resolved_by_id(client, auth_headers, session):
+    source_id = _upload(client, auth_headers)
+    r = client.post("/api/v1/generate/image", headers=auth_headers, json={
+        "type": "upscale", "mode": "sfw", "prompt": "x", "source_id": source_id,
+    })
+    assert r.status_code == 200
+    locator = session.scalar(select(SourceUpload.locator).where(SourceUpload.id == source_id))
+    assert session.scalar(select(Generation.source_path).where(Generation.id == r.json()["id"])) == locator
+
+
+def test_sources_of_other_users_are_not_found(client, auth_headers, session):
+    other = User(email="other@example.com", password_hash="x")
+    session.add(other)
+    session.commit()
+    session.add(SourceUpload(user_id=other.id, locator="/etc/passwd", format="PNG", width=1, height=1, size_bytes=1))
+    session.commit()
+    foreign = session.scalar(select(SourceUpload.id).where(SourceUpload.user_id == other.id))
+
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json={"jobs": [
+        {"type": "image", "mode": "sfw", "prompt": "x", "source_id": foreign},
+    ]})
+    assert r.status_code == 404
+
+
+def test_unqueued_job_is_failed_and_its_slot_released(client, auth_headers, session, user, monkeypatch):
+    from app.api.v1 import generate
+    from app.core.admission import admission
+
+    def broker_down(*args, **kwargs):
+        raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(generate, "enqueue", broker_down)
+    before = admission.stats()["in_flight_local"]
+    with pytest.raises(ConnectionError):
+        client.post("/api/v1/generate/image", headers=auth_headers, json={"type": "image", "mode": "sfw", "prompt": "x"})
+
+    assert session.scalars(select(Generation.status).where(Generation.user_id == user.id)).all() == ["failed"]
+    assert admission.stats()["in_flight_local"] == before
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Batches handed to the broker, as lists of (task name, generation id); nothing runs."""
+    from app.api.v1 import generate
+
+    sent = []
+
+    class Group:
+        def __init__(self, signatures):
+            self.signatures = list(signatures)
+
+        def apply_async(self):
+            sent.append([(s.task, s.args[0]) for s in self.signatures])
+
+    monkeypatch.setattr(generate, "group", Group)
+    return sent
+
+
+def _jobs(*types, **values):
+    return {"jobs": [{"type": t, "mode": "sfw", "prompt": f"job {i}", **values} for i, t in enumerate(types)]}
+
+
+def test_batch_ids_follow_job_order_across_types(client, auth_headers, session, published):
+    source_id = _upload(client, auth_headers)
+    payload = _jobs("image", "upscale", "video", "image")
+    payload["jobs"][1]["source_id"] = payload["jobs"][3]["source_id"] = source_id
+
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json=payload)
+
+    assert r.status_code == 200
+    ids = r.json()["ids"]
+    rows = {g.id: g for g in session.scalars(select(Generation))}
+    assert [(rows[i].type, rows[i].prompt, rows[i].status) for i in ids] == [
+        ("image", "job 0", "queued"), ("upscale", "job 1", "queued"),
+        ("video", "job 2", "queued"), ("image", "job 3", "queued"),
+    ]
+    assert published == [[
+        ("app.workers.tasks.task_txt2img", ids[0]), ("app.workers.tasks.task_upscale", ids[1]),
+        ("app.workers.tasks.task_txt2video", ids[2]), ("app.workers.tasks.task_img2img", ids[3]),
+    ]]
+
+
+def test_batch_size_is_capped(client, auth_headers, session, published, monkeypatch):
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "GENERATE_BATCH_MAX_JOBS", 2)
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json=_jobs("image", "image", "image"))
+    assert r.status_code == 400
+    assert session.scalars(select(Generation.id)).all() == [] and published == []
+
+
+def test_batch_is_admitted_whole_or_not_at_all(client, auth_headers, session, published, monkeypatch):
+    from app.core.admission import admission
+
+    monkeypatch.setattr(admission, "max_in_flight", 2)
+    admission.reconcile([])
+
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json=_jobs("image", "image", "image"))
+    assert r.status_code == 429 and "Retry-After" in r.headers
+    assert session.scalars(select(Generation.id)).all() == [] and published == []
+
+    r = client.post("/api/v1/generate/batch", headers=auth_headers, json=_jobs("image", "image"))
+    assert r.status_code == 200 and len(published[0]) == 2
+    admission.reconcile([])
+
+
+def test_unpublished_batch_is_failed_and_its_slots_released(client, auth_headers, session, monkeypatch):
+    from app.api.v1 import generate
+    from app.core.admission import admission
+
+    class BrokerDown:
+        def __init__(self, signatures):
+            pass
+
+        def apply_async(self):
+            raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(generate, "group", BrokerDown)
+    before = admission.stats()["in_flight_local"]
+    with pytest.raises(ConnectionError):
+        client.post("/api/v1/generate/batch", headers=auth_headers, json=_jobs("image", "video"))
+
+    assert session.scalars(select(Generation.status)).all() == ["failed", "failed"]
+    assert admission.stats()["in_flight_local"] == before
@@ -0,0 +1,54 @@
+import pytest
+
+from app.config import get_settings
+from app.core import health
+
+
+@pytest.fixture
+def ready(client):
+    def get():
+        r = client.get("/ready")
+        return r.status_code, r.json()
+
+    return get
+
+
+def test_ready_checks_database_and_broker(ready):
+    assert ready() == (200, {"status": "ready", "checks": {"database": "ok", "broker": "ok"}})
+
+
+def test_unreachable_broker_is_not_ready(ready, monkeypatch):
+    def down():
+        raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(health, "check_broker", down)
+    status, body = ready()
+    assert (status, body["status"], body["checks"]["broker"]) == (503, "unavailable", "error: connection refused")
+
+
+def test_ready_models_need_a_live_worker_holding_them(ready, monkeypatch):
+    monkeypatch.setattr(get_settings(), "READY_MODELS", "txt2img,nsfw")
+    monkeypatch.setattr(health, "worker_models", lambda: {"nsfw": 2})
+    status, body = ready()
+    assert (status, body["checks"]["models"]) == (503, {"txt2img": 0, "nsfw": 2})
+
+    monkeypatch.setattr(health, "worker_models", lambda: {"nsfw": 2, "txt2img": 1})
+    assert ready()[0] == 200
+
+
+def test_model_check_is_skipped_without_a_heartbeat_store(ready, monkeypatch):
+    # e.g. an AMQP broker and no WORKER_HEARTBEAT_REDIS_URL
+    monkeypatch.setattr(get_settings(), "READY_MODELS", "txt2img")
+    monkeypatch.setattr(get_settings(), "WORKER_HEARTBEAT_REDIS_URL", "")
+    status, body = ready()
+    assert status == 200
+    assert body["checks"]["models"].startswith("skipped")
+    health.publish_residency("worker@host:1", ["txt2img"])  # a no-op, not an error
+
+
+def test_metrics_are_exposed(client):
+    client.get("/health")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in r.text
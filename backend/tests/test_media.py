@@ -0,0 +1,27 @@
+from PIL import Image
+
+from app.core.storage import get_storage
+
+
+def _stored(tmp_path, name, write):
+    path = tmp_path / name
+    write(path)
+    return get_storage().put_file(str(path))
+
+
+def test_image_outputs_have_derivatives(client, auth_headers, make_generation, tmp_path):
+    locator = _stored(tmp_path, "out.png", lambda p: Image.new("RGB", (300, 200), (9, 9, 9)).save(p))
+    gen = make_generation(status="completed", output_path=locator)
+
+    r = client.get(f"/api/v1/media/{gen.id}/thumb?format=webp", headers=auth_headers)
+
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+
+
+def test_video_outputs_only_have_an_original(client, auth_headers, make_generation, tmp_path):
+    locator = _stored(tmp_path, "out.mp4", lambda p: p.write_bytes(b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 64))
+    gen = make_generation(type="video", status="completed", output_path=locator)
+
+    assert client.get(f"/api/v1/media/{gen.id}/thumb", headers=auth_headers).status_code == 415
+    assert client.get(f"/api/v1/media/{gen.id}/original", headers=auth_headers).status_code == 200
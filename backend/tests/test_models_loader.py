@@ -0,0 +1,156 @@
+import itertools
+import sys
+import types
+
+import pytest
+
+from app.core.models_loader import ModelCache, ModelKey, ModelRegistry
+
+_ptrs = itertools.count(1)
+
+
+class FakeTensor:
+    def __init__(self, nbytes):
+        self._ptr = next(_ptrs)
+        self._nbytes = nbytes
+
+    def data_ptr(self):
+        return self._ptr
+
+    def numel(self):
+        return self._nbytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeModule:
+    def __init__(self, *sizes):
+        self.tensors = [FakeTensor(n) for n in sizes]
+
+    def parameters(self):
+        return iter(self.tensors)
+
+    def buffers(self):
+        return iter(())
+
+
+class FakePipeline:
+    """Reports its size through ``components``, like a diffusers pipeline."""
+
+    def __init__(self, **components):
+        self.components = components
+
+
+def _key(kind, model_id="m"):
+    return ModelKey(kind, model_id, "float32", "cpu")
+
+
+def test_least_recently_used_is_evicted_over_budget():
+    evicted = []
+    cache = ModelCache(budget_bytes=100, on_evict=evicted.append)
+    a, b, c = _key("a"), _key("b"), _key("c")
+    cache.get_or_load(a, lambda: FakeModule(60))
+    cache.get_or_load(b, lambda: FakeModule(30))
+    assert cache.get_or_load(a, lambda: pytest.fail("a is resident")) is not None
+
+    cache.get_or_load(c, lambda: FakeModule(30))
+
+    assert evicted == [b]
+    assert (a in cache, b in cache, c in cache) == (True, False, True)
+    assert cache.total_bytes == 90
+
+
+def test_a_model_larger_than_the_budget_stays_loaded():
+    cache = ModelCache(budget_bytes=50)
+    cache.get_or_load(_key("a"), lambda: FakeModule(40))
+    cache.get_or_load(_key("big"), lambda: FakeModule(80))
+    assert [e["kind"] for e in cache.stats()] == ["big"]
+
+
+def test_dependents_are_charged_for_unshared_tensors_and_evicted_with_their_parent():
+    evicted = []
+    cache = ModelCache(budget_bytes=100, on_evict=evicted.append)
+    parent, child, other = _key("txt2img"), _key("img2img"), _key("upscaler")
+    unet, vae = FakeModule(50), FakeModule(20)
+    cache.get_or_load(parent, lambda: FakePipeline(unet=unet, vae=vae))
+    cache.get_or_load(child, lambda: FakePipeline(unet=unet, vae=vae, extra=FakeModule(10)), parent=parent)
+    assert [(e["kind"], e["bytes"], e["parent"]) for e in cache.stats()] == [
+        ("txt2img", 70, None), ("img2img", 10, "txt2img"),
+    ]
+
+    # Using the child keeps the parent recent too, so the upscaler evicts neither...
+    cache.get_or_load(other, lambda: FakeModule(20))
+    assert cache.total_bytes == 100 and evicted == []
+    # ...until the budget forces the parent out, which takes the child with it
+    cache.get_or_load(_key("a"), lambda: FakeModule(20))
+    assert evicted == [child, parent]
+    assert [e["kind"] for e in cache.stats()] == ["upscaler", "a"]
+
+
+@pytest.fixture
+def fake_diffusers(monkeypatch):
+    loads = []
+
+    class Txt2Img(FakePipeline):
+        @classmethod
+        def from_pretrained(cls, model_id, torch_dtype=None):
+            loads.append(model_id)
+            return cls(unet=FakeModule(50), vae=FakeModule(20))
+
+        def to(self, device):
+            return self
+
+    class Img2Img(FakePipeline):
+        pass
+
+    class Img2Video(Txt2Img):
+        calls = []
+
+        def __call__(self, image, **kwargs):
+            self.calls.append(kwargs)
+
+    diffusers = types.ModuleType("diffusers")
+    diffusers.StableDiffusionPipeline = Txt2Img
+    diffusers.StableDiffusionImg2ImgPipeline = Img2Img
+    diffusers.StableVideoDiffusionPipeline = Img2Video
+    torch = types.ModuleType("torch")
+    torch.float32 = "float32"
+    torch.cuda = types.SimpleNamespace(is_available=lambda: False)
+    monkeypatch.setitem(sys.modules, "diffusers", diffusers)
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    return loads
+
+
+@pytest.fixture
+def registry(fake_diffusers, monkeypatch):
+    monkeypatch.setattr("app.core.models_loader.get_settings", lambda: types.SimpleNamespace(
+        SD_MODEL_ID="sd", MODEL_DTYPE="float32", MODEL_CACHE_BUDGET_MB=0, REAL_ESRGAN_MODEL="esrgan",
+        STABLE_VIDEO_MODEL_ID="svd",
+    ))
+    return ModelRegistry()
+
+
+def test_img2img_reuses_the_resident_txt2img_components(registry, fake_diffusers):
+
+    img2img = registry.get_img2img("sd")
+    txt2img = registry.get_txt2img("sd")
+
+    assert fake_diffusers == ["sd"]
+    assert img2img.components == txt2img.components
+    assert {e["kind"]: e["bytes"] for e in registry.cache.stats()} == {"txt2img": 70, "img2img": 0}
+
+    registry.cache.evict(registry._key("txt2img", "sd"))
+    assert registry.cache.stats() == []
+
+
+def test_video_workers_preload_and_warm_img2video(registry, fake_diffusers):
+    from app.workers.celery_app import QUEUE_MODELS
+
+    assert "img2video" in QUEUE_MODELS["video"]
+    registry.ensure(*QUEUE_MODELS["video"])
+    registry.warm_up(QUEUE_MODELS["video"])
+
+    assert fake_diffusers == ["svd"]
+    assert registry.residency()["img2video"]["status"] == "loaded"
+    assert registry.img2video_pipeline.calls[0]["num_inference_steps"] == 1
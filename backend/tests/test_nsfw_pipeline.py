@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core.nsfw_pipeline import (
+    DEFAULT_COMPILED,
+    CompiledKeywords,
+    KeywordMatcher,
+    NSFWSmartClassifier,
+    OnnxImageDetector,
+)
+
+
+def test_whole_words_only():
+    compiled = CompiledKeywords({"explicit": ["cum", "69"]})
+    assert compiled.find("a document from 1969") == []
+    assert [m.keyword for m in compiled.find("Cums and 69")] == ["cum", "69"]
+
+
+@pytest.mark.parametrize("prompt, keyword", [
+    ("two people fucking", "fuck"),
+    ("sexual content", "sex"),
+    ("raped", "rape"),
+    ("RAPING", "rape"),
+    ("pornographic scene", "pornographic"),
+    ("nudity", "nude"),
+    ("cumming", "cum"),
+    ("fetishes", "fetish"),
+])
+def test_inflections_match_their_keyword(prompt, keyword):
+    assert [(m.tag, m.keyword) for m in DEFAULT_COMPILED.find(prompt)] == [("explicit", keyword)]
+    assert NSFWSmartClassifier().classify_prompt(prompt).action == "flag"
+
+
+@pytest.mark.parametrize("prompt", ["an analysis of the sextant", "slavery museum", "a cumulus cloud", "raptors"])
+def test_inflections_stay_whole_words(prompt):
+    assert DEFAULT_COMPILED.find(prompt) == []
+
+
+def test_multi_word_keywords_match_regardless_of_charset():
+    compiled = CompiledKeywords({"explicit": ["blow job"], "soft": ["see-through"]})
+    for prompt in ("a see-through dress, blow job", "a see-through dress, blow job, café"):
+        assert [(m.tag, m.keyword) for m in compiled.find(prompt)] == [("soft", "see-through"), ("explicit", "blow job")]
+
+
+def test_malformed_reload_keeps_previous_keywords(tmp_path):
+    path = tmp_path / "keywords.json"
+    path.write_text(json.dumps({"explicit": ["lighthouse"]}))
+    matcher = KeywordMatcher(str(path), check_interval_s=0)
+    assert [m.tag for m in matcher.find("a lighthouse")] == ["explicit"]
+
+    path.write_text("{not json")
+    os.utime(path, (1, 1))
+    assert [m.tag for m in matcher.find("a lighthouse")] == ["explicit"]
+
+    path.write_text(json.dumps({"soft": ["lighthouse"]}))
+    assert [m.tag for m in matcher.find("a lighthouse")] == ["soft"]
+
+
+@pytest.fixture
+def detector(tmp_path):
+    """A dummy ONNX model whose three "probabilities" are the mean red, green and blue of the input."""
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node("ReduceMean", ["pixels"], ["scores"], axes=[2, 3], keepdims=0)],
+        "channel_means",
+        [helper.make_tensor_value_info("pixels", TensorProto.FLOAT, ["N", 3, 32, 32])],
+        [helper.make_tensor_value_info("scores", TensorProto.FLOAT, ["N", 3])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    path = tmp_path / "detector.onnx"
+    onnx.save(model, str(path))
+    return OnnxImageDetector(str(path), ["red", "green", "blue"], {"red": "explicit", "green": "soft"}, input_size=32)
+
+
+def test_detector_classifies_a_mixed_batch_in_order(detector, tmp_path):
+    red_path = tmp_path / "red.png"
+    Image.new("RGB", (64, 64), (255, 0, 0)).save(red_path)
+    not_an_image = tmp_path / "clip.mp4"
+    not_an_image.write_bytes(b"\x00" * 64)
+    classifier = NSFWSmartClassifier(image_detector=detector)
+
+    results = classifier.classify_images([
+        Image.new("RGB", (1000, 700), (0, 255, 0)),  # downscaled before inference
+        np.zeros((48, 48, 3), dtype=np.uint8),
+        str(red_path),
+        str(not_an_image),
+    ])
+
+    assert [(r.action, r.tags) for r in results] == [
+        ("allow", ["soft"]), ("allow", []), ("flag", ["explicit"]), ("allow", []),
+    ]
+
+
+def test_detector_scores_follow_the_model(detector):
+    (scores,) = detector.predict([Image.new("RGB", (32, 32), (51, 102, 255))])
+    assert scores == pytest.approx({"red": 0.2, "green": 0.4, "blue": 1.0}, abs=1e-3)
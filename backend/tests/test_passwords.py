@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.core import passwords
+from app.core.passwords import PasswordHasher, make_context
+from app.models import User
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    # Thread pool and cheap rounds: the process pool and the default cost only slow the tests down
+    hasher = PasswordHasher(workers=0, max_queue=8)
+    monkeypatch.setattr("app.api.v1.auth.password_hasher", hasher)
+    monkeypatch.setattr(passwords, "pwd_context", make_context(5))
+    return hasher
+
+
+def _login(client, password="secret"):
+    return client.post("/api/v1/auth/login", data={"username": "user@example.com", "password": password})
+
+
+def test_login_rehashes_when_the_rounds_changed(client, session, user, hasher):
+    user.password_hash = make_context(4).hash("secret")
+    session.commit()
+
+    assert _login(client).status_code == 200
+    stored = session.scalar(select(User.password_hash).where(User.id == user.id))
+    assert stored.startswith("$2b$05$")
+
+    assert _login(client).status_code == 200
+    assert _login(client, "wrong").status_code == 401
+    assert hasher.stats()["rehashed"] == 1
+
+
+def test_a_full_queue_is_rejected_with_503():
+    hasher = PasswordHasher(workers=0, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(hasher._run(release.wait, 5))
+        waiting = asyncio.ensure_future(hasher._run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        assert (hasher.in_flight, hasher.waiting) == (1, 1)
+        with pytest.raises(HTTPException) as exc:
+            await hasher.hash("secret")
+        release.set()
+        await asyncio.gather(running, waiting)
+        return exc.value
+
+    exc = asyncio.run(scenario())
+    assert (exc.status_code, exc.headers["Retry-After"]) == (503, "1")
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["completed"] == 2
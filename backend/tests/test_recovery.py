@@ -0,0 +1,113 @@
+"""Claiming, redelivery and the reaper, with Celery running tasks eagerly."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import get_settings
+from app.core.lifecycle import WORKER_LOST, reap
+from app.models import Generation
+from app.workers import tasks
+
+
+@pytest.fixture
+def redelivered(monkeypatch):
+    # Eager mode has no broker to set delivery_info["redelivered"]
+    monkeypatch.setattr(tasks, "_redelivered", lambda task: True)
+
+
+def _row(session, gen_id):
+    session.expire_all()
+    return session.get(Generation, gen_id)
+
+
+def _run(gen_id, task_id):
+    tasks.task_txt2img.apply(args=[gen_id], task_id=task_id).get()
+
+
+def test_first_delivery_claims_and_finishes(session, make_generation):
+    gen = make_generation(width=16, height=16)
+    _run(gen.id, "a")
+    row = _row(session, gen.id)
+    assert (row.status, row.attempts, row.claimed_by) == ("completed", 1, "a")
+    assert row.output_path
+
+
+def test_duplicate_delivery_is_a_no_op(session, make_generation, redelivered):
+    gen = make_generation(width=16, height=16)
+    _run(gen.id, "a")
+    first = _row(session, gen.id).output_path
+
+    _run(gen.id, "a")
+    _run(gen.id, "b")
+
+    row = _row(session, gen.id)
+    assert (row.status, row.attempts, row.output_path) == ("completed", 1, first)
+
+
+def test_redelivery_resumes_a_row_its_lost_worker_held(session, make_generation, redelivered):
+    gen = make_generation(width=16, height=16, status="running", attempts=1, claimed_by="a")
+    _run(gen.id, "a")
+    row = _row(session, gen.id)
+    assert (row.status, row.attempts) == ("completed", 2)
+
+
+def test_redelivery_leaves_a_live_retry_alone(session, make_generation, redelivered):
+    max_attempts = get_settings().JOB_MAX_ATTEMPTS
+    gen = make_generation(width=16, height=16, status="running", attempts=max_attempts, claimed_by="b")
+    _run(gen.id, "a")
+    row = _row(session, gen.id)
+    assert (row.status, row.attempts, row.claimed_by, row.error) == ("running", max_attempts, "b", None)
+
+
+def test_redelivery_out_of_attempts_fails_the_row(session, make_generation, redelivered):
+    gen = make_generation(status="running", attempts=get_settings().JOB_MAX_ATTEMPTS, claimed_by="a")
+    _run(gen.id, "a")
+    row = _row(session, gen.id)
+    assert (row.status, row.error) == ("failed", WORKER_LOST)
+
+
+def test_reaper_requeues_fails_and_reenqueues(session, make_generation):
+    settings = get_settings()
+    stale = datetime.utcnow() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS + 120)
+    waiting = datetime.utcnow() - timedelta(seconds=settings.JOB_QUEUED_TIMEOUT_SECONDS + 60)
+    requeue = make_generation(status="running", attempts=1, claimed_by="a", updated_at=stale)
+    exhausted = make_generation(status="running", attempts=settings.JOB_MAX_ATTEMPTS, updated_at=stale)
+    lost = make_generation(status="queued", updated_at=waiting)
+    live = make_generation(status="running", attempts=1, claimed_by="c")
+    fresh = make_generation(status="queued")
+
+    assert sorted(reap(session)) == sorted([requeue.id, lost.id])
+    assert [_row(session, g.id).status for g in (requeue, exhausted, lost, live, fresh)] == [
+        "queued", "failed", "queued", "running", "queued",
+    ]
+    assert _row(session, exhausted.id).error == WORKER_LOST
+    # Touched, so the next pass does not enqueue it again
+    assert reap(session) == []
+
+
+def test_reap_task_runs_requeued_jobs(session, make_generation):
+    stale = datetime.utcnow() - timedelta(seconds=get_settings().JOB_TIMEOUT_SECONDS + 120)
+    gen = make_generation(width=16, height=16, status="running", attempts=1, claimed_by="a", updated_at=stale)
+
+    assert tasks.task_reap_stale.apply().get() == 1
+
+    row = _row(session, gen.id)
+    assert (row.status, row.attempts) == ("completed", 2)
+    assert row.claimed_by != "a"
+
+
+def test_redelivered_batch_leader_takes_back_its_batch_mates(session, make_generation, redelivered, monkeypatch):
+    monkeypatch.setattr(tasks.Txt2ImgBatcher, "from_settings", classmethod(lambda cls: cls(max_batch_size=4, window_s=0)))
+    max_attempts = get_settings().JOB_MAX_ATTEMPTS
+    leader = make_generation(width=16, height=16, status="running", attempts=1, claimed_by="a")
+    mate = make_generation(width=16, height=16, status="running", attempts=1, claimed_by="a")
+    exhausted = make_generation(width=16, height=16, status="running", attempts=max_attempts, claimed_by="a")
+    other = make_generation(width=16, height=16, status="running", attempts=1, claimed_by="b")
+
+    _run(leader.id, "a")
+
+    assert [(_row(session, g.id).status, _row(session, g.id).attempts) for g in (leader, mate)] == [
+        ("completed", 2), ("completed", 2),
+    ]
+    assert (_row(session, exhausted.id).status, _row(session, exhausted.id).error) == ("failed", WORKER_LOST)
+    assert (_row(session, other.id).status, _row(session, other.id).claimed_by) == ("running", "b")
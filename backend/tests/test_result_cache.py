@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from PIL import Image
+
+from app.core.result_cache import ResultCache, result_cache_key
+from app.core.storage import get_storage
+from app.models import Generation
+from app.workers import tasks
+from app.workers.batching import txt2img_model_id
+
+
+def _file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_miss_then_hit_counts_and_clones(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=0)
+    dst = str(tmp_path / "out.png")
+
+    assert cache.fetch("ab" * 32, ".png", dst) is False
+    cache.store("ab" * 32, _file(tmp_path, "result.png", 64))
+    assert cache.fetch("ab" * 32, ".png", dst) is True
+    assert open(dst, "rb").read() == open(tmp_path / "result.png", "rb").read()
+    assert cache.fetch(None, ".png", dst) is False  # not reproducible: not even a lookup
+
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_least_recently_used_results_are_evicted_over_budget(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=250)
+    keys = [c * 64 for c in "abc"]
+    for age, key in zip((300, 200), keys[:2]):
+        cache.store(key, _file(tmp_path, f"{key[0]}.png", 100))
+        os.utime(cache._path(key, ".png"), (1e9 - age, 1e9 - age))
+
+    assert cache.lookup(keys[0], ".png")  # a hit refreshes the oldest entry
+    cache.store(keys[2], _file(tmp_path, "c.png", 100))
+
+    assert [cache.lookup(k, ".png") is not None for k in keys] == [True, False, True]
+
+
+def test_disabled_cache_neither_stores_nor_counts(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=0, enabled=False)
+    cache.store("ab" * 32, _file(tmp_path, "result.png", 10))
+    assert cache.lookup("ab" * 32, ".png") is None
+    assert cache.stats()["hits"] + cache.stats()["misses"] == 0
+
+
+def test_a_hit_completes_the_job_without_running_the_pipeline(session, make_generation, monkeypatch, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=0)
+    monkeypatch.setattr(tasks, "result_cache", cache)
+    monkeypatch.setattr(tasks, "run_txt2img_batch", lambda pipe, gens: pytest.fail("pipeline ran on a hit"))
+    gen = make_generation(seed=42, width=16, height=16)
+    cached = tmp_path / "cached.png"
+    Image.new("RGB", (16, 16), (255, 0, 0)).save(cached)
+    cache.store(result_cache_key(gen, txt2img_model_id(gen)), str(cached))
+
+    tasks.task_txt2img.apply(args=[gen.id]).get()
+
+    session.expire_all()
+    row = session.get(Generation, gen.id)
+    assert row.status == "completed"
+    with Image.open(get_storage().local_path(row.output_path)) as out:
+        assert out.getpixel((0, 0)) == (255, 0, 0)
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import pytest
+
+from app.core.storage import LocalStorage, S3Storage, Storage
+
+
+def _file(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_local_objects_are_sharded_and_deduplicated(tmp_path):
+    store = LocalStorage(str(tmp_path / "objects"))
+    digest = hashlib.sha256(b"png bytes").hexdigest()
+
+    first = store.put_file(_file(tmp_path, "a.PNG", b"png bytes"))
+    moved_src = _file(tmp_path, "b.png", b"png bytes")
+    second = store.put_file(moved_src, move=True)
+
+    assert first == second == str(tmp_path / "objects" / digest[:2] / digest[2:4] / f"{digest}.png")
+    assert not os.path.exists(moved_src)
+    assert store.exists(first) and open(store.local_path(first), "rb").read() == b"png bytes"
+    with pytest.raises(FileNotFoundError):
+        store.local_path(str(tmp_path / "missing.png"))
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    moto = pytest.importorskip("moto")
+    for name, value in (("AWS_ACCESS_KEY_ID", "test"), ("AWS_SECRET_ACCESS_KEY", "test"), ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        store = S3Storage("outputs", "gen/", str(tmp_path / "cache"), region="us-east-1")
+        store.client().create_bucket(Bucket="outputs")
+        yield store
+
+
+def test_s3_put_dedup_and_read_back(s3, tmp_path):
+    digest = hashlib.sha256(b"video bytes").hexdigest()
+    key = f"gen/{digest[:2]}/{digest[2:4]}/{digest}.mp4"
+
+    locator = s3.put_file(_file(tmp_path, "a.mp4", b"video bytes"))
+    again = s3.put_file(_file(tmp_path, "b.mp4", b"video bytes"), move=True)
+
+    assert locator == again == f"s3://outputs/{key}"
+    assert s3.exists(locator)
+    head = s3.client().head_object(Bucket="outputs", Key=key)
+    assert head["ContentType"] == "video/mp4"
+    assert s3.client().list_objects_v2(Bucket="outputs")["KeyCount"] == 1
+    # The moved file was kept as the local copy, so reading it needs no download
+    assert s3.local_path(locator) == str(tmp_path / "cache" / key)
+
+
+def test_s3_downloads_objects_missing_from_the_cache(s3, tmp_path):
+    locator = s3.put_file(_file(tmp_path, "a.png", b"image bytes"))
+    path = s3.local_path(locator)
+    assert open(path, "rb").read() == b"image bytes"
+    with pytest.raises(FileNotFoundError):
+        s3.local_path("s3://outputs/gen/00/00/missing.png")
+    assert not s3.exists("s3://outputs/gen/00/00/missing.png")
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core.upscale import TiledUpscaler, blend_weights, tile_starts
+
+
+class Identity:
+    scale = 1
+
+    def predict(self, image):
+        return image
+
+
+class Nearest2x:
+    scale = 2
+
+    def predict_batch(self, images):
+        return [Image.fromarray(np.asarray(im).repeat(2, axis=0).repeat(2, axis=1)) for im in images]
+
+
+@pytest.mark.parametrize("length", [64, 65, 100, 244, 250, 260, 500, 1000])
+def test_blend_weights_sum_to_one(length):
+    starts = tile_starts(length, 64, 16)
+    total = np.zeros(length)
+    for start, w in zip(starts, blend_weights(starts, 64, length, 1)):
+        total[start:start + min(64, length)] += w
+    np.testing.assert_allclose(total, 1.0, atol=1e-6)
+
+
+def test_identity_round_trips_flat_gray():
+    image = Image.new("RGB", (500, 300), (200, 200, 200))
+    out = TiledUpscaler(Identity(), tile=256, overlap=16).upscale(image)
+    assert np.array_equal(np.asarray(out), np.asarray(image))
+
+
+@pytest.mark.parametrize("size", [(500, 37), (97, 203), (260, 260), (64, 64)])
+def test_tiles_reassemble_exactly(size):
+    pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+
+    same = TiledUpscaler(Identity(), tile=48, overlap=8, batch_size=3).upscale(image)
+    doubled = TiledUpscaler(Nearest2x(), tile=48, overlap=8).upscale(image)
+
+    assert np.array_equal(np.asarray(same), pixels)
+    assert np.array_equal(np.asarray(doubled), pixels.repeat(2, axis=0).repeat(2, axis=1))
+
+
+def test_upscale_derivatives_are_rendered_from_the_output(session, make_generation, monkeypatch, tmp_path):
+    from app.core.derivatives import derivative_path
+    from app.core.models_loader import registry
+    from app.core.storage import get_storage, locator_digest
+    from app.models import Generation
+    from app.workers import tasks
+
+    source = tmp_path / "source.png"
+    pixels = np.random.default_rng(1).integers(0, 256, (400, 600, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(source)
+    gen = make_generation(type="upscale", source_path=get_storage().put_file(str(source)))
+    monkeypatch.setattr(registry, "get_upscaler", lambda: Nearest2x())
+
+    tasks.task_upscale.apply(args=[gen.id]).get()
+
+    session.expire_all()
+    row = session.get(Generation, gen.id)
+    assert row.status == "completed"
+    with Image.open(get_storage().local_path(row.output_path)) as out:
+        assert out.size == (1200, 800)
+    with Image.open(derivative_path(locator_digest(row.output_path), "preview", "webp")) as preview:
+        assert preview.size == (1024, 683)
+    with Image.open(derivative_path(locator_digest(row.output_path), "thumb", "webp")) as thumb:
+        assert thumb.size == (256, 171)
@@ -0,0 +1,84 @@
+import os
+import stat
+import types
+
+import pytest
+
+from app.config import get_settings
+from app.core import video
+from app.core.storage import scratch_path
+from app.core.video import SolidColorSource, VideoEncodeError, encode_video
+from app.models import Generation
+from app.workers import tasks
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Point FFMPEG_BINARY at a shell script; the output path is ffmpeg's last argument."""
+
+    def install(body):
+        path = tmp_path / "ffmpeg"
+        path.write_text("#!/bin/sh\nfor out; do :; done\n" + body)
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+        settings = get_settings()
+        monkeypatch.setattr(settings, "FFMPEG_BINARY", str(path))
+        monkeypatch.setattr(settings, "VIDEO_CODEC", "libx264")
+        monkeypatch.setattr(settings, "VIDEO_ENCODER", "ffmpeg")
+
+    return install
+
+
+def _run_video_task(session, make_generation):
+    gen = make_generation(type="video", width=16, height=16)
+    with pytest.raises(VideoEncodeError) as exc:
+        tasks.task_txt2video.apply(args=[gen.id]).get()
+    session.expire_all()
+    return session.get(Generation, gen.id), str(exc.value)
+
+
+def test_ffmpeg_error_fails_the_row_and_removes_the_partial_file(session, make_generation, fake_ffmpeg):
+    fake_ffmpeg('echo partial > "$out"\ncat > /dev/null\necho "boom: unsupported pixel format" >&2\nexit 1\n')
+
+    row, error = _run_video_task(session, make_generation)
+
+    assert "exited with 1: boom: unsupported pixel format" in error
+    assert (row.status, row.error, row.output_path) == ("failed", error, None)
+    assert not os.path.exists(scratch_path(f"gen_{row.id}.mp4"))
+
+
+def test_stalled_ffmpeg_is_killed_at_the_timeout(fake_ffmpeg, tmp_path):
+    fake_ffmpeg("exec sleep 30\n")  # never reads its input
+    # Far more than a pipe buffer of frames: the writer must not block past the timeout
+    source = SolidColorSource(256, 256, fps=25, seconds=4)
+    with pytest.raises(VideoEncodeError, match="timed out"):
+        encode_video(source, str(tmp_path / "out.mp4"), timeout=0.5)
+
+
+def test_auto_prefers_pyav_and_maps_its_errors(session, make_generation, monkeypatch):
+    class FFmpegError(Exception):
+        pass
+
+    def broken_pyav(source, path, timeout):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise FFmpegError("Invalid argument")
+
+    monkeypatch.setattr(video, "av", types.SimpleNamespace(error=types.SimpleNamespace(FFmpegError=FFmpegError)))
+    monkeypatch.setattr(video, "encode_pyav", broken_pyav)
+    monkeypatch.setattr(video, "encode_ffmpeg", lambda *args: pytest.fail("ffmpeg used although PyAV is available"))
+    monkeypatch.setattr(get_settings(), "VIDEO_ENCODER", "auto")
+
+    row, error = _run_video_task(session, make_generation)
+
+    assert (row.status, error) == ("failed", "Invalid argument")
+    assert not os.path.exists(scratch_path(f"gen_{row.id}.mp4"))
+
+
+def test_auto_falls_back_to_ffmpeg_without_pyav(monkeypatch, tmp_path):
+    used = []
+    monkeypatch.setattr(video, "av", None)
+    monkeypatch.setattr(video, "encode_ffmpeg", lambda source, path, timeout: used.append(path) or path)
+    monkeypatch.setattr(get_settings(), "VIDEO_ENCODER", "auto")
+
+    encode_video(SolidColorSource(16, 16, fps=1, seconds=1), str(tmp_path / "out.mp4"))
+    assert used == [str(tmp_path / "out.mp4")]